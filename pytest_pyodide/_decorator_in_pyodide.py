@@ -18,9 +18,11 @@ https://github.com/pyodide/pytest-pyodide/issues/43
 
 import pickle
 from base64 import b64decode, b64encode
+from collections.abc import Awaitable, Callable
 from inspect import isclass
 from io import BytesIO
 from pathlib import Path
+from secrets import token_hex
 from typing import Any
 
 import pyodide_js
@@ -54,8 +56,20 @@ class PyodideHandle:
         self.ptr = id(obj)
 
 
+# Buffers of at least this many bytes are passed as binary blobs through the
+# scratch directory of the web server, see _encode_out_of_band in decorator.py.
+_OOB_THRESHOLD = 1 << 18
+_OOB_PREFIX = "oob:"
+_BYTES_TYPES = {"bytes": bytes, "bytearray": bytearray}
+_SCRATCH_ROUTE = "/_pytest_pyodide/scratch/"
+
+
 class Pickler(pickle.Pickler):
     def persistent_id(self, obj: Any) -> Any:
+        if type(obj) in _BYTES_TYPES.values() and len(obj) >= _OOB_THRESHOLD:
+            # bytes and bytearray are always pickled in band, wrap large ones
+            # in a PickleBuffer so that they can be sent out of band
+            return (type(obj).__name__, pickle.PickleBuffer(obj))
         if not isinstance(obj, PyodideHandle):
             return None
         pyodide_js._module._Py_IncRef(obj.ptr)
@@ -77,6 +91,8 @@ class Pickler(pickle.Pickler):
 
 class Unpickler(pickle.Unpickler):
     def persistent_load(self, pid: Any) -> Any:
+        if isinstance(pid, tuple) and len(pid) == 2 and pid[0] in _BYTES_TYPES:
+            return _BYTES_TYPES[pid[0]](pid[1])
         if not isinstance(pid, tuple) or len(pid) != 2 or pid[0] != "PyodideHandle":
             raise pickle.UnpicklingError("unsupported persistent object")
         ptr = pid[1]
@@ -87,7 +103,7 @@ class Unpickler(pickle.Unpickler):
 
 def encode(x: Any) -> str:
     f = BytesIO()
-    p = Pickler(f)
+    p = Pickler(f, protocol=5)
     p.dump(x)
     return b64encode(f.getvalue()).decode()
 
@@ -96,23 +112,109 @@ def decode(x: str) -> Any:
     return Unpickler(BytesIO(b64decode(x))).load()
 
 
-async def run_in_pyodide_main(
-    mod64: str, args64: str, module_filename: str, func_name: str, async_func: bool
-) -> tuple[int, str, str]:
-    """
-    This actually runs the code for run_in_pyodide.
-    """
-    __tracebackhide__ = True
+async def encode_out_of_band(x: Any) -> str:
+    """Like encode, but upload large buffers to the scratch directory"""
+    buffers: list[pickle.PickleBuffer] = []
+
+    def buffer_callback(buf: pickle.PickleBuffer) -> bool:
+        try:
+            nbytes = buf.raw().nbytes
+        except BufferError:
+            return True
+        if nbytes < _OOB_THRESHOLD:
+            return True
+        buffers.append(buf)
+        return False
+
+    f = BytesIO()
+    Pickler(f, protocol=5, buffer_callback=buffer_callback).dump(x)
+    pickled64 = b64encode(f.getvalue()).decode()
+    if not buffers:
+        return pickled64
+
+    from pyodide.ffi import to_js
+    from pyodide.http import pyfetch
+
+    names = []
+    for buf in buffers:
+        name = f"blob-{token_hex(16)}.bin"
+        resp = await pyfetch(_SCRATCH_ROUTE + name, method="PUT", body=to_js(buf.raw()))
+        if not resp.ok:
+            raise RuntimeError(f"Failed to upload {name}: {resp.status}")
+        names.append(name)
+    return f"{_OOB_PREFIX}{','.join(names)}:{pickled64}"
+
+
+async def _encode_async(x: Any) -> str:
+    return encode(x)
+
+
+async def decode_out_of_band(x: str) -> Any:
+    """Like decode, but fetch the buffers that the host sent out of band"""
+    if not x.startswith(_OOB_PREFIX):
+        return decode(x)
+
+    from pyodide.http import pyfetch
+
+    names, pickled64 = x.removeprefix(_OOB_PREFIX).split(":", 1)
+    buffers = []
+    for name in names.split(","):
+        resp = await pyfetch(_SCRATCH_ROUTE + name)
+        if not resp.ok:
+            raise RuntimeError(f"Failed to fetch {name}: {resp.status}")
+        buffers.append(await resp.bytes())
+    return Unpickler(BytesIO(b64decode(pickled64)), buffers=buffers).load()
+
+
+# The namespaces of the run_in_pyodide modules that were compiled so far, by
+# the hash of their payload. The host only sends the hash for modules it has
+# sent before.
+_MODULE_CACHE: dict[str, dict[str, Any]] = {}
+_CACHE_INFO = {"hits": 0, "misses": 0}
+
+
+def is_cached(mod_hash: str) -> bool:
+    return mod_hash in _MODULE_CACHE
+
 
-    # We've pickled and base 64 encoded the ast module and the arguments so first
-    # we have to decode them.
+def cache_info() -> dict[str, int]:
+    return {**_CACHE_INFO, "size": len(_MODULE_CACHE)}
+
+
+def load_module(
+    mod64: str | None, module_filename: str, mod_hash: str | None
+) -> dict[str, Any]:
+    """Return the namespace of a run_in_pyodide module, compiling it if needed"""
+    if mod_hash is not None and mod_hash in _MODULE_CACHE:
+        _CACHE_INFO["hits"] += 1
+        return _MODULE_CACHE[mod_hash]
+
+    assert mod64 is not None
+    _CACHE_INFO["misses"] += 1
+    # We've pickled and base 64 encoded the ast module so first we have to
+    # decode it.
     mod = decode(mod64)
-    args: tuple[Any] = decode(args64)
 
     # Compile and execute the ast
     co = compile(mod, module_filename, "exec")
     d: dict[str, Any] = {}
     exec(co, d)
+    if mod_hash is not None:
+        _MODULE_CACHE[mod_hash] = d
+    return d
+
+
+async def _run_case(
+    d: dict[str, Any],
+    args64: str,
+    func_name: str,
+    async_func: bool,
+    encode_result: Callable[[Any], Awaitable[str]],
+) -> tuple[int, str, str]:
+    """Run the function ``func_name`` of the module namespace ``d``"""
+    __tracebackhide__ = True
+
+    args: tuple[Any] = await decode_out_of_band(args64)
 
     try:
         # Look up the appropriate function on the module and execute it.
@@ -120,7 +222,7 @@ async def run_in_pyodide_main(
         result = d[func_name](None, *args)
         if async_func:
             result = await result
-        return (0, encode(result), repr(result))
+        return (0, await encode_result(result), repr(result))
     except BaseException as e:
         try:
             # If tblib is present, we can show much better tracebacks.
@@ -142,7 +244,53 @@ async def run_in_pyodide_main(
 
         except ImportError:
             pass
-        return (1, encode(e), repr(e))
+        return (1, await encode_result(e), repr(e))
+
+
+async def run_in_pyodide_main(
+    mod64: str | None,
+    args64: str,
+    module_filename: str,
+    func_name: str,
+    async_func: bool,
+    mod_hash: str | None = None,
+    out_of_band: bool = False,
+) -> tuple[int, str, str]:
+    """
+    This actually runs the code for run_in_pyodide.
+
+    If ``mod_hash`` is given, ``mod64`` may be None if the module is in the
+    cache. If ``out_of_band`` is True, large buffers of the result are
+    uploaded to the scratch directory of the web server.
+    """
+    __tracebackhide__ = True
+
+    d = load_module(mod64, module_filename, mod_hash)
+    encode_result = encode_out_of_band if out_of_band else _encode_async
+    return await _run_case(d, args64, func_name, async_func, encode_result)
+
+
+async def run_in_pyodide_batch(
+    mod64: str | None,
+    cases64: list[str],
+    module_filename: str,
+    func_name: str,
+    async_func: bool,
+    mod_hash: str | None = None,
+    out_of_band: bool = False,
+) -> tuple[int, list[tuple[int, str, str]], str]:
+    """
+    Like run_in_pyodide_main, but run the function once for each of the
+    encoded argument tuples in ``cases64`` and return all the results.
+    """
+    __tracebackhide__ = True
+
+    d = load_module(mod64, module_filename, mod_hash)
+    encode_result = encode_out_of_band if out_of_band else _encode_async
+    results = []
+    for args64 in cases64:
+        results.append(await _run_case(d, args64, func_name, async_func, encode_result))
+    return (0, results, "")
 
 
 def start_coverage(coverage_args64):
@@ -0,0 +1,172 @@
+"""
+This file is not imported normally, it is loaded as a string and then exec'd
+into a module called _pytest_pyodide_session inside of Pyodide. See
+run_tests_inside_pyodide.py.
+
+It runs the tests for --run-in-pyodide and sends their reports back to the
+host serialized with pytest_report_to_serializable, like pytest-xdist does.
+Either pytest is started for each test with run_main, or with run_test one
+pytest session is kept alive: each test module is collected once, then the host
+asks for the items to run one at a time.
+"""
+
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+from _pytest.config import Config
+from _pytest.main import Session
+
+# pytest has no public API to run single items of a session that is kept alive,
+# so PyodideSession uses pytest internals. They are only used by the functions
+# below, which are known to work with these pytest versions (the maximum is
+# excluded).
+MIN_PYTEST_VERSION = (7, 0)
+MAX_PYTEST_VERSION = (10, 0)
+
+
+def check_pytest_version(version: str) -> None:
+    major_minor = tuple(int(part) for part in version.split(".")[:2])
+    if not MIN_PYTEST_VERSION <= major_minor < MAX_PYTEST_VERSION:
+        supported = ".".join(map(str, MIN_PYTEST_VERSION))
+        unsupported = ".".join(map(str, MAX_PYTEST_VERSION))
+        raise RuntimeError(
+            f"pytest {version} is not supported by "
+            f"--run-in-pyodide-session, pytest >={supported},<{unsupported} "
+            "is needed"
+        )
+
+
+def _prepare_config(args: list[str], plugins: list[Any]) -> Config:
+    from _pytest.config import _prepareconfig
+
+    config = _prepareconfig(args, plugins=plugins)
+    config._do_configure()
+    return config
+
+
+def _collect_module(session: Session, path: Path) -> list[pytest.Item]:
+    # perform_collect is called once per module, the items are cached by
+    # PyodideSession
+    return list(session.perform_collect([str(path)]))
+
+
+def _teardown_until(session: Session, nextitem: pytest.Item | None) -> None:
+    """Tear down the fixtures that nextitem doesn't need (all if it's None)"""
+    session._setupstate.teardown_exact(nextitem)
+
+
+def _unconfigure(config: Config) -> None:
+    config._ensure_unconfigure()
+
+
+class _ReportCollector:
+    """Plugin that records the serialized reports of the item that is running"""
+
+    def __init__(self):
+        self.config: Any = None
+        self.reports: list[dict[str, Any]] = []
+
+    def pytest_configure(self, config):
+        self.config = config
+
+    def _add(self, report):
+        self.reports.append(
+            self.config.hook.pytest_report_to_serializable(
+                config=self.config, report=report
+            )
+        )
+
+    def pytest_runtest_logreport(self, report):
+        self._add(report)
+
+    def pytest_collectreport(self, report):
+        if report.failed:
+            self._add(report)
+
+    def dumps(self) -> str:
+        reports, self.reports = self.reports, []
+        return json.dumps(reports, separators=(",", ":"), default=str)
+
+
+class PyodideSession:
+    def __init__(self, args: list[str]):
+        check_pytest_version(pytest.__version__)
+        self.collector = _ReportCollector()
+        self.config = _prepare_config(args, [self.collector])
+        self.session = Session.from_config(self.config)
+        self.config.hook.pytest_sessionstart(session=self.session)
+        # The items of every collected module, in module order
+        self.modules: dict[Path, list[pytest.Item]] = {}
+
+    def _collect(self, path: Path) -> list[pytest.Item]:
+        if path not in self.modules:
+            try:
+                items = _collect_module(self.session, path)
+            except Exception:
+                # The collect report has been recorded, retry next time
+                return []
+            self.modules[path] = items
+        return self.modules[path]
+
+    def find(self, nodeid: str) -> tuple[pytest.Item | None, pytest.Item | None]:
+        """Return the item with the given node id and the item after it"""
+        module, _, name = nodeid.partition("::")
+        path = Path(module).resolve()
+        items = self._collect(path)
+        for idx, item in enumerate(items):
+            if item.nodeid.partition("::")[2] == name:
+                nextitem = items[idx + 1] if idx + 1 < len(items) else None
+                return item, nextitem
+        return None, None
+
+    def run(self, nodeid: str) -> str:
+        item, nextitem = self.find(nodeid)
+        if item is not None:
+            # Tear down the fixtures of the previous item if the host doesn't
+            # run the items in module order
+            _teardown_until(self.session, item)
+            item.ihook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+        elif not self.collector.reports:
+            self.collector._add(
+                pytest.CollectReport(
+                    nodeid, "failed", f"Test {nodeid} not found", result=None
+                )
+            )
+        return self.collector.dumps()
+
+    def finish(self):
+        _teardown_until(self.session, None)
+        self.config.hook.pytest_sessionfinish(
+            session=self.session, exitstatus=pytest.ExitCode.OK
+        )
+        _unconfigure(self.config)
+
+
+def run_main(args: list[str]) -> str:
+    """Run pytest with the given arguments and return the reports"""
+    collector = _ReportCollector()
+    pytest.main(args, plugins=[collector])
+    return collector.dumps()
+
+
+_session: PyodideSession | None = None
+
+
+def run_test(nodeid: str, args: list[str]) -> str:
+    """
+    Run a test in the pytest session, which is started with the given
+    arguments if needed, and return its reports
+    """
+    global _session
+    if _session is None:
+        _session = PyodideSession(args)
+    return _session.run(nodeid)
+
+
+def finish_session():
+    global _session
+    if _session is not None:
+        session, _session = _session, None
+        session.finish()
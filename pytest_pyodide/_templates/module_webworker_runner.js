@@ -5,6 +5,8 @@
 // the main page posts {id, code} messages whose `code` is an async
 // JavaScript function body. The worker evaluates it and posts back
 // {id, ok, result} on success or {id, ok: false, error, stack} on error.
+// {id, name, args, pyodideChecks} messages call a function that was
+// registered with ``runner.prepare`` instead, without compiling anything.
 //
 // The worker does NOT automatically load Pyodide. The main-thread runner
 // sends the standard load-pyodide script as its first RPC, just like it
@@ -62,10 +64,23 @@ for (const level of ["log", "warn", "info", "error"]) {
 }
 
 onmessage = async function (e) {
-  const { id, code } = e.data ?? {};
+  const { id, code, name, args, pyodideChecks } = e.data ?? {};
   if (typeof id === "undefined") {
     return;
   }
+  if (typeof name !== "undefined") {
+    // Call of a function registered with ``runner.prepare``. The registry
+    // reports errors itself: result is [0, value] or [1, error, stack,
+    // message], or null if the registry or the function hasn't been
+    // installed, then the runner prepares its functions again.
+    const registry = self.__pytestPyodide;
+    const result =
+      registry && Object.hasOwn(registry.functions, name)
+        ? await registry.call(name, args, pyodideChecks)
+        : null;
+    self.postMessage({ id, ok: true, result });
+    return;
+  }
   try {
     // `code` is the body of an async function. It may reference `self`,
     // `pyodide`, etc. It should `return` a JSON-serializable value.
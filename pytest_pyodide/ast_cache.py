@@ -0,0 +1,305 @@
+"""
+Keep the ASTs of ``run_in_pyodide`` modules.
+
+Only the sources are kept for the whole session. The trees are built when
+``run_in_pyodide`` first needs them, which is mostly while the module is
+imported, and only the most recently used ones are kept. Asserts are rewritten
+only in the functions that are sent to Pyodide, not in the whole module.
+
+Like pytest does for the ``.pyc`` files of rewritten test modules, the parsed
+tree of a module, its function index and the functions rewritten so far are
+stored in the pytest cache. An unchanged module is unpickled on the next run
+instead of being parsed and rewritten again.
+"""
+
+import ast
+import hashlib
+import os
+import pickle
+import sys
+from collections import OrderedDict
+from collections.abc import Iterator, Mapping
+from copy import deepcopy
+from pathlib import Path
+from typing import Any, cast
+
+import pytest
+from _pytest.assertion.rewrite import AssertionRewriter, rewrite_asserts
+
+FuncDef = ast.FunctionDef | ast.AsyncFunctionDef
+
+AST_CACHE_DIR = "pytest-pyodide-asts"
+
+# Modules that were found in / added to the cache in this session
+AST_CACHE_STATS = {"hits": 0, "misses": 0}
+
+
+def ast_cache_key(source: bytes, filename: str, rewrite_config: Any) -> str:
+    """
+    Return a key that changes whenever the cached trees of the module could
+    change: the source, the file name, the Python and pytest versions and the
+    options of the assertion rewriter.
+    """
+    pass_hook = (
+        rewrite_config.getini("enable_assertion_pass_hook")
+        if rewrite_config is not None
+        else False
+    )
+    h = hashlib.sha256()
+    for part in [
+        source,
+        filename.encode(),
+        sys.version.encode(),
+        pytest.__version__.encode(),
+        str(bool(pass_hook)).encode(),
+    ]:
+        h.update(part)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def first_line(funcdef: FuncDef) -> int:
+    """The first line of a function including its decorators, like co_firstlineno"""
+    if funcdef.decorator_list:
+        return funcdef.decorator_list[0].lineno
+    return funcdef.lineno
+
+
+class ParsedModule:
+    """The AST of a module with an index of all the functions defined in it"""
+
+    def __init__(
+        self,
+        tree: ast.Module,
+        source: bytes,
+        filename: str,
+        rewrite_config: Any,
+        functions: dict[tuple[str, int], FuncDef] | None = None,
+        rewritten: dict[FuncDef, tuple[list[ast.stmt], FuncDef]] | None = None,
+    ):
+        self.tree = tree
+        self._source = source
+        self._filename = filename
+        self._rewrite_config = rewrite_config
+        self._rewrite_disabled = AssertionRewriter.is_rewrite_disabled(
+            ast.get_docstring(tree) or ""
+        )
+        if functions is None:
+            functions = {}
+            for node in ast.walk(tree):
+                if isinstance(node, FuncDef):
+                    functions.setdefault((node.name, first_line(node)), node)
+        self._functions = functions
+        self._rewritten = rewritten if rewritten is not None else {}
+        # Whether the cache file is missing or out of date
+        self.dirty = False
+
+    def find_function(self, name: str, lineno: int) -> FuncDef:
+        """
+        Return the definition of the function ``name`` that starts at
+        ``lineno``, or else the first one after it
+        """
+        funcdef = self._functions.get((name, lineno))
+        if funcdef is not None:
+            return funcdef
+        candidates = [
+            node
+            for (node_name, _), node in self._functions.items()
+            if node_name == name and node.lineno >= lineno
+        ]
+        if not candidates:
+            raise Exception(f"Didn't find function {name} (line {lineno}) in module.")
+        return min(candidates, key=lambda node: node.lineno)
+
+    def locate(
+        self, name: str, lineno: int, rewrite: bool
+    ) -> tuple[list[ast.stmt], FuncDef]:
+        """
+        Return the statements that the function ``name`` at ``lineno`` needs
+        and its definition. If ``rewrite`` is True, the asserts in the function
+        are rewritten and the statements are the imports that the rewritten
+        asserts use.
+        """
+        funcdef = self.find_function(name, lineno)
+        if not rewrite or self._rewrite_disabled:
+            return [], funcdef
+        if funcdef not in self._rewritten:
+            mod = ast.Module([deepcopy(funcdef)], type_ignores=[])
+            rewrite_asserts(mod, self._source, self._filename, self._rewrite_config)
+            *statements, rewritten = mod.body
+            self._rewritten[funcdef] = (statements, cast(FuncDef, rewritten))
+            self.dirty = True
+        statements, rewritten = self._rewritten[funcdef]
+        return list(statements), rewritten
+
+    def dumps(self, key: str) -> bytes:
+        # The nodes in the function index and in the rewritten functions are
+        # the ones in the tree, pickle keeps them shared.
+        return pickle.dumps((key, self.tree, self._functions, self._rewritten))
+
+
+def _cache_path(cache_dir: Path, filename: str) -> Path:
+    return cache_dir / f"{hashlib.sha256(filename.encode()).hexdigest()[:32]}.pickle"
+
+
+def load_module(
+    cache_dir: Path | None, source: bytes, filename: str, rewrite_config: Any
+) -> ParsedModule:
+    """
+    Parse a module, or use the one cached in ``cache_dir`` if it is up to
+    date. There is one cache file per module which is replaced when the module
+    changes.
+    """
+    if cache_dir is None:
+        tree = ast.parse(source, filename=filename)
+        return ParsedModule(tree, source, filename, rewrite_config)
+
+    key = ast_cache_key(source, filename, rewrite_config)
+    try:
+        cached_key, tree, functions, rewritten = pickle.loads(
+            _cache_path(cache_dir, filename).read_bytes()
+        )
+        if cached_key == key:
+            AST_CACHE_STATS["hits"] += 1
+            return ParsedModule(
+                tree, source, filename, rewrite_config, functions, rewritten
+            )
+    except Exception:
+        # Missing, truncated or from an incompatible version
+        pass
+
+    AST_CACHE_STATS["misses"] += 1
+    tree = ast.parse(source, filename=filename)
+    module = ParsedModule(tree, source, filename, rewrite_config)
+    module.dirty = True
+    return module
+
+
+def save_module(cache_dir: Path, module: ParsedModule) -> None:
+    """Write ``module`` to the cache if it changed since it was loaded"""
+    if not module.dirty:
+        return
+    key = ast_cache_key(module._source, module._filename, module._rewrite_config)
+    path = _cache_path(cache_dir, module._filename)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.part")
+    try:
+        tmp_path.write_bytes(module.dumps(key))
+        tmp_path.replace(path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+    module.dirty = False
+
+
+class ModuleASTStore:
+    """
+    The sources of the ``run_in_pyodide`` modules and an LRU of their parsed
+    trees that holds at most ``maxsize`` modules (all of them if ``maxsize`` is
+    0).
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        # How many times the tree of a module was parsed or unpickled
+        self.loads = 0
+        self._sources: dict[str, tuple[bytes, Path | None, Any]] = {}
+        self._modules: OrderedDict[str, ParsedModule] = OrderedDict()
+        self.original = ModuleASTView(self, rewritten=False)
+        self.rewritten = ModuleASTView(self, rewritten=True)
+
+    def add(
+        self,
+        filename: str,
+        source: bytes,
+        cache_dir: Path | None = None,
+        rewrite_config: Any = None,
+    ):
+        """
+        Register the source of a module. It is loaded with load_module when it
+        is needed.
+        """
+        self._sources[filename] = (source, cache_dir, rewrite_config)
+        self._modules.pop(filename, None)
+
+    def __contains__(self, filename: object) -> bool:
+        return filename in self._sources
+
+    def get(self, filename: str) -> ParsedModule:
+        """Return the parsed module"""
+        module = self._modules.get(filename)
+        if module is not None:
+            self._modules.move_to_end(filename)
+            return module
+
+        source, cache_dir, rewrite_config = self._sources[filename]
+        module = load_module(cache_dir, source, filename, rewrite_config)
+        self.loads += 1
+        self._modules[filename] = module
+        while self.maxsize > 0 and len(self._modules) > self.maxsize:
+            self._save(*self._modules.popitem(last=False))
+        return module
+
+    def _save(self, filename: str, module: ParsedModule) -> None:
+        cache_dir = self._sources[filename][1]
+        if cache_dir is not None:
+            save_module(cache_dir, module)
+
+    def flush(self) -> None:
+        """Write the modules in memory that changed to the cache"""
+        for filename, module in self._modules.items():
+            self._save(filename, module)
+
+    def locate(
+        self, filename: str, name: str, lineno: int, rewrite: bool
+    ) -> tuple[list[ast.stmt], FuncDef]:
+        """See ParsedModule.locate"""
+        return self.get(filename).locate(name, lineno, rewrite)
+
+    def filenames(self) -> Iterator[str]:
+        return iter(self._sources)
+
+    def memory_usage(self) -> dict[str, int]:
+        """
+        The number of registered modules, the size of their sources in bytes
+        and the number of modules whose trees are in memory
+        """
+        return {
+            "modules": len(self._sources),
+            "source_bytes": sum(len(source) for source, _, _ in self._sources.values()),
+            "trees": len(self._modules),
+        }
+
+    def summary(self) -> str:
+        usage = self.memory_usage()
+        return (
+            "run_in_pyodide ASTs: {modules} modules ({kib} KiB of source), "
+            "{trees} in memory, loaded {loads} times".format(
+                kib=usage["source_bytes"] // 1024, loads=self.loads, **usage
+            )
+        )
+
+
+class ModuleASTView(Mapping[str, ast.Module]):
+    """
+    The original or the assertion rewritten ASTs of the modules in a
+    ModuleASTStore. Rewritten trees are built on every lookup, run_in_pyodide
+    uses ModuleASTStore.locate instead.
+    """
+
+    def __init__(self, store: ModuleASTStore, rewritten: bool):
+        self._store = store
+        self._rewritten = rewritten
+
+    def __getitem__(self, filename: str) -> ast.Module:
+        module = self._store.get(filename)
+        if not self._rewritten:
+            return module.tree
+        source, _, rewrite_config = self._store._sources[filename]
+        tree = deepcopy(module.tree)
+        rewrite_asserts(tree, source, filename, rewrite_config)
+        return tree
+
+    def __iter__(self) -> Iterator[str]:
+        return self._store.filenames()
+
+    def __len__(self) -> int:
+        return self._store.memory_usage()["modules"]
@@ -6,6 +6,8 @@ from collections.abc import Iterable, Sequence
 from typing import Literal
 
 RUNTIMES = Literal["chrome", "firefox", "node", "safari"]
+NODE_PROTOCOLS = Literal["line", "framed"]
+NODE_TRANSPORTS = Literal["pty", "pipe", "threads"]
 
 _global_load_pyodide_script = """
 let pyodide = await loadPyodide({ fullStdLib: false, jsglobals : self });
@@ -34,6 +36,20 @@ class Config:
         self.initialize_script: str = "pyodide.runPython('');"
         self.node_extra_globals = []
 
+        # How commands and results are exchanged with node_test_driver.js.
+        # "line" sends code in short lines and waits for an acknowledgement
+        # after each of them, "framed" sends every command and result as a
+        # single length-prefixed frame.
+        self.node_protocol: NODE_PROTOCOLS = "line"
+
+        # How node_test_driver.js is started. "pty" types the node command
+        # into bash running in a pseudo terminal, "pipe" starts node directly
+        # and exchanges frames over a socketpair, keeping stdout and stderr
+        # for console output only. "threads" shares one node process between
+        # all node runners and gives each of them a worker thread with its own
+        # Pyodide. "pipe" and "threads" always use the framed protocol.
+        self.node_transport: NODE_TRANSPORTS = "pty"
+
     def set_flags(self, runtime: RUNTIMES, flags: list[str]):
         self.flags[runtime] = flags
 
@@ -58,6 +74,22 @@ class Config:
     def get_node_extra_globals(self) -> Sequence[str]:
         return self.node_extra_globals
 
+    def set_node_protocol(self, protocol: NODE_PROTOCOLS):
+        if protocol not in ("line", "framed"):
+            raise ValueError(f"Invalid node protocol: {protocol}")
+        self.node_protocol = protocol
+
+    def get_node_protocol(self) -> NODE_PROTOCOLS:
+        return self.node_protocol
+
+    def set_node_transport(self, transport: NODE_TRANSPORTS):
+        if transport not in ("pty", "pipe", "threads"):
+            raise ValueError(f"Invalid node transport: {transport}")
+        self.node_transport = transport
+
+    def get_node_transport(self) -> NODE_TRANSPORTS:
+        return self.node_transport
+
 
 SINGLETON = Config()
 
@@ -1,10 +1,98 @@
-from collections.abc import MutableSequence, Sequence
+import contextlib
+import hashlib
+import json
+import os
+import tarfile
+from collections.abc import Iterable, Sequence
 from pathlib import Path
 from typing import Any
 
-from .server import spawn_web_server
+from .server import SCRATCH_ROUTE, get_scratch_dir, spawn_web_server
 
-_copied_files: dict[Any, MutableSequence[tuple[Path, str]]] = {}
+# Web servers that serve the files to copy by served directory. They are
+# started when they are first needed and kept until close_file_servers.
+_file_servers: dict[Path, tuple[str, int, Path]] = {}
+_file_server_stack = contextlib.ExitStack()
+
+# Number of files that are fetched at the same time by _transfer_files
+COPY_CONCURRENCY = 8
+
+# Size, modification time and sha256 of a file. The sha256 is empty for files
+# that were copied lazily, which are not hashed.
+FileState = tuple[int, int, str]
+
+# Lazy files are fetched in chunks of this many bytes when they are read
+LAZY_CHUNK_SIZE = 1 << 20
+
+
+class CopyIndex:
+    """
+    The files that have been copied to the emscripten file system of a runner
+    by destination, with their source and its state when it was copied. Each
+    runner has one as ``runner.copy_index``, which is cleared when the runner
+    gets a new Pyodide.
+    """
+
+    def __init__(self):
+        self.files: dict[str, tuple[Path, FileState]] = {}
+        # Directories synced by sync_directory_to_emscripten_fs
+        self.synced_directories: set[Path] = set()
+        # Host directories mounted by destination, see _mount_files
+        self.mounts: dict[str, Path] = {}
+
+    def clear(self):
+        self.files.clear()
+        self.synced_directories.clear()
+        self.mounts.clear()
+
+    def changed(
+        self, files: Iterable[tuple[Path, str]], lazy: bool = False
+    ) -> list[tuple[Path, str, FileState]]:
+        """
+        Return the (src, dest) pairs of files whose destination doesn't have the
+        content of src yet, with the state of src. Sources are only hashed if
+        their size or modification time changed. If ``lazy`` is True, sources
+        are never read: a file is changed unless it was copied from the same
+        source with the same size and modification time.
+        """
+        changed = []
+        for src, dest in files:
+            previous_src, previous = self.files.get(dest, (None, None))
+            if lazy:
+                stat = src.stat()
+                state = (stat.st_size, stat.st_mtime_ns, "")
+                if previous is None or previous_src != src or state[:2] != previous[:2]:
+                    changed.append((src, dest, state))
+                continue
+            state = file_state(src, previous if previous_src == src else None)
+            if previous is None or state[2] != previous[2]:
+                changed.append((src, dest, state))
+            else:
+                # Same content, remember the new source and modification time
+                self.files[dest] = (src, state)
+        return changed
+
+    def add(self, files: Iterable[tuple[Path, str, FileState]]):
+        for src, dest, state in files:
+            self.files[dest] = (src, state)
+
+
+def file_server(base_path: Path) -> tuple[str, int, Path]:
+    """
+    Return the hostname, port and log path of a web server serving base_path
+    that is shared by all the copies of the session
+    """
+    if base_path not in _file_servers:
+        _file_servers[base_path] = _file_server_stack.enter_context(
+            spawn_web_server(base_path)
+        )
+    return _file_servers[base_path]
+
+
+def close_file_servers():
+    """Stop the web servers started by file_server"""
+    _file_servers.clear()
+    _file_server_stack.close()
 
 
 def copy_files_to_emscripten_fs(
@@ -12,7 +100,10 @@ def copy_files_to_emscripten_fs(
     selenium: Any,
     install_wheels=True,
     recurse_directories=True,
-):
+    bulk=False,
+    mount=False,
+    lazy=False,
+) -> list[dict[str, Any]]:
     """
     Copies files in file_list to the emscripten file system. Files
     are passed as a list of source Path / install Path pairs.
@@ -27,9 +118,20 @@ def copy_files_to_emscripten_fs(
         install_wheels (bool): If True, any wheels in the copy list are installed instead of copied.
 
         recurse_directories (bool): If this is True, subdirectories of directories in file_list will be copied.
+
+        bulk (bool): If True, the files are packed into one tar archive that is fetched and unpacked in a single request. Archives are cached by the content of the files.
+
+        mount (bool): If True and the runner can mount host directories (node), nothing is copied. Directories are mounted read-only, files are linked from a mount of their directory and wheels are installed from there. Tests can't write next to mounted files.
+
+        lazy (bool): If True, files are created read-only and their content is fetched in chunks of LAZY_CHUNK_SIZE bytes when it is first read, so only the parts that a test reads are downloaded. The files can't be memory mapped. Not supported on node, which has no synchronous XMLHttpRequest.
+
+    Returns:
+        list[dict]: The url, destination, size in bytes and time in seconds of every copied file, or of every archive for bulk copies. The size of lazy files is None.
     """
-    if selenium not in _copied_files:
-        _copied_files[selenium] = []
+    mount = mount and hasattr(selenium, "mount_host_directory")
+    # node has no synchronous XMLHttpRequest, the files are copied instead
+    lazy = lazy and getattr(selenium, "browser", None) != "node"
+    mount_directories = []
     new_files = []
     for list_entry in file_list:
         if isinstance(list_entry, tuple):
@@ -51,6 +153,13 @@ def copy_files_to_emscripten_fs(
             if c == "/":
                 last_folder = str(src)[: i + 1]
                 last_remaining = str(src)[i + 1 :]
+        if src.is_dir() and recurse_directories and mount:
+            if not src.resolve().is_relative_to(Path.cwd()):
+                raise RuntimeError(
+                    "Can only copy directories to pyodide that are below the current directory"
+                )
+            mount_directories.append((src.resolve(), str(dest_path)))
+            continue
         if src.is_dir():
             # copy all files in directory
             if recurse_directories:
@@ -72,8 +181,7 @@ def copy_files_to_emscripten_fs(
                     continue
                 relative_path = f.relative_to(glob_base)
                 file_dest = Path(dest_path, relative_path)
-                if (f, str(file_dest)) not in _copied_files[selenium]:
-                    new_files.append((f, str(file_dest)))
+                new_files.append((f, str(file_dest)))
         else:
             # Single file to copy
             src = src.resolve()
@@ -81,63 +189,326 @@ def copy_files_to_emscripten_fs(
                 raise RuntimeError(
                     "Can only copy files to pyodide that are below the current directory"
                 )
-            if (src, str(dest_path)) not in _copied_files[selenium]:
-                new_files.append((src, str(dest_path)))
-    if len(new_files) == 0:
-        return
-    base_path = Path.cwd()
-    with spawn_web_server(base_path) as server:
-        server_hostname, server_port, _ = server
-        base_url = f"http://{server_hostname}:{server_port}/"
-        # fetch all files into the pyodide
-        # n.b. this might be slow for big packages
+            new_files.append((src, str(dest_path)))
+    changed = selenium.copy_index.changed(new_files, lazy=lazy)
+    if mount:
+        return _mount_files(mount_directories, changed, selenium, install_wheels)
+    if len(changed) == 0:
+        return []
+    to_copy = [(src, dest) for src, dest, _ in changed]
+    if lazy:
+        results = _create_lazy_files(to_copy, selenium, install_wheels)
+    elif bulk:
+        results = _transfer_archive(changed, selenium, install_wheels)
+    else:
+        results = _transfer_files(to_copy, selenium, install_wheels)
+    selenium.copy_index.add(changed)
+    return results
 
-        selenium.run(
-            """
-            import os
+
+def _transfer_files(
+    new_files: Sequence[tuple[Path, str]], selenium: Any, install_wheels: bool
+) -> list[dict[str, Any]]:
+    """
+    Fetch the (src, dest) pairs in new_files into pyodide and install the
+    wheels in a single round trip. Returns the url, destination, size and
+    time of every file.
+    """
+    base_path = Path.cwd()
+    server_hostname, server_port, _ = file_server(base_path)
+    base_url = f"http://{server_hostname}:{server_port}/"
+    manifest = []
+    for file, dest in new_files:
+        file_url = base_url + str(file.relative_to(base_path).as_posix())
+        # wheels are installed on the pyodide side (and not copied)
+        manifest.append((file_url, dest, file.suffix == ".whl" and install_wheels))
+    payload = json.dumps({"manifest": manifest, "concurrency": COPY_CONCURRENCY})
+    result = selenium.run_async(
+        f"""
+        async def _copy_files(payload):
+            import asyncio
+            import json
+            import time
             from pathlib import Path
             from pyodide.http import pyfetch
-            all_fetches = []
-            all_wheels = []
 
-            async def _fetch_file(src,dest):
-                response = await pyfetch(src)
-                dest.parent.mkdir(parents=True,exist_ok=True)
-                with open(dest, "wb") as fp:
-                    byte_data = await response.bytes()
-                    fp.write(byte_data)
+            payload = json.loads(payload)
+            manifest = payload["manifest"]
+            results = []
+            # install the wheels before any fetches
+            wheels = [url for url, _, is_wheel in manifest if is_wheel]
+            if wheels:
+                import micropip
 
-            """
-        )
-        for file, dest in new_files:
-            _copied_files[selenium].append((file, dest))
-            file_url = base_url + str(file.relative_to(base_path).as_posix())
-            if file.suffix == ".whl" and install_wheels:
-                # wheel - install the wheel on the pyodide side before
-                # any fetches (and don't copy it)
-                selenium.run_async(
-                    f"""
-                    all_wheels.append("{file_url}")
-                    """
-                )
-            else:
-                # add file to fetches
-                selenium.run_async(
-                    f"""
-                    all_fetches.append(_fetch_file("{file_url}",Path("{dest}")))
-                    """
+                start = time.perf_counter()
+                await micropip.install(wheels)
+                duration = time.perf_counter() - start
+                for url in wheels:
+                    results.append(
+                        {{"url": url, "dest": None, "size": None, "time": duration}}
+                    )
+
+            semaphore = asyncio.Semaphore(payload["concurrency"])
+
+            async def fetch(url, dest):
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await pyfetch(url)
+                    data = await response.bytes()
+                dest = Path(dest)
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                dest.write_bytes(data)
+                duration = time.perf_counter() - start
+                return {{"url": url, "dest": str(dest), "size": len(data), "time": duration}}
+
+            results.extend(
+                await asyncio.gather(
+                    *(fetch(url, dest) for url, dest, is_wheel in manifest if not is_wheel)
                 )
-        # install all wheels with micropip
+            )
+            return json.dumps(results)
+
+        await _copy_files({payload!r})
+        """
+    )
+    return json.loads(result)  # type: ignore[no-any-return]
+
+
+def _create_lazy_files(
+    new_files: Sequence[tuple[Path, str]], selenium: Any, install_wheels: bool
+) -> list[dict[str, Any]]:
+    """
+    Create lazy files for the (src, dest) pairs in new_files that are fetched
+    from the file server when they are read, and install the wheels. Returns
+    the url and destination of every lazy file, and the results of
+    _transfer_files for the wheels.
+    """
+    base_path = Path.cwd()
+    server_hostname, server_port, _ = file_server(base_path)
+    base_url = f"http://{server_hostname}:{server_port}/"
+    wheels = []
+    lazy_files = []
+    for file, dest in new_files:
+        if file.suffix == ".whl" and install_wheels:
+            wheels.append((file, dest))
+            continue
+        file_url = base_url + str(file.relative_to(base_path).as_posix())
+        lazy_files.append((file_url, dest, file.stat().st_size))
+
+    results = []
+    if wheels:
+        results.extend(_transfer_files(wheels, selenium, install_wheels))
+    if lazy_files:
+        selenium.create_lazy_files(lazy_files, LAZY_CHUNK_SIZE)
+    for url, dest, _ in lazy_files:
+        results.append({"url": url, "dest": dest, "size": None, "time": 0})
+    return results
+
+
+# Directories of single files that are linked into the emscripten file system
+# are mounted below this directory
+HOST_MOUNT_BASE = "/_pytest_pyodide/host"
+
+
+def _mount_files(
+    directories: Sequence[tuple[Path, str]],
+    files: Sequence[tuple[Path, str, FileState]],
+    selenium: Any,
+    install_wheels: bool,
+) -> list[dict[str, Any]]:
+    """
+    Make the files available in pyodide without copying them, with a runner
+    that can mount host directories. Each (src, dest) directory is mounted at
+    dest, unless it is already visible there through a mount of a parent
+    directory. Files are symlinked to a mount of their directory below
+    HOST_MOUNT_BASE, and wheels are installed from that mount. Returns the host
+    path and destination of every mounted directory and linked file.
+    """
+    copy_index = selenium.copy_index
+    results: list[dict[str, Any]] = []
+    for src, dest in directories:
+        mounted = any(
+            src.is_relative_to(mounted_src)
+            and Path(dest) == Path(mounted_dest) / src.relative_to(mounted_src)
+            for mounted_dest, mounted_src in copy_index.mounts.items()
+        )
+        if not mounted:
+            selenium.mount_host_directory(src, dest)
+            copy_index.mounts[dest] = src
+        results.append({"url": src.as_uri(), "dest": dest, "size": None, "time": 0})
+
+    links = []
+    wheels = []
+    for src, dest, _ in files:
+        src = src.resolve()
+        digest = hashlib.sha256(bytes(src.parent)).hexdigest()[:16]
+        mount_dest = f"{HOST_MOUNT_BASE}/{digest}"
+        if copy_index.mounts.get(mount_dest) != src.parent:
+            selenium.mount_host_directory(src.parent, mount_dest)
+            copy_index.mounts[mount_dest] = src.parent
+        target = f"{mount_dest}/{src.name}"
+        if src.suffix == ".whl" and install_wheels:
+            wheels.append(f"emfs:{target}")
+        else:
+            links.append((target, dest))
+        results.append({"url": src.as_uri(), "dest": dest, "size": None, "time": 0})
+    if links:
+        selenium.link_host_files(links)
+    if wheels:
         selenium.run_async(
-            """
+            f"""
             import micropip
-            await micropip.install(all_wheels)
+            await micropip.install({wheels!r})
             """
         )
-        # fetch everything all at once
-        selenium.run_async(
-            """
-            import asyncio, os, os.path
-            await asyncio.gather(*all_fetches)
-            """
+    selenium.copy_index.add(files)
+    return results
+
+
+def build_archive(
+    files: Sequence[tuple[Path, str, FileState]], archive_dir: Path
+) -> Path:
+    """
+    Pack the (src, dest, state) entries returned by CopyIndex.changed into a
+    tar archive in archive_dir in which each file is stored under its
+    destination. The name of the archive is the hash of the destinations and
+    the content hashes in the states, so an existing archive with the same name
+    is reused and the files are not read again.
+    """
+    h = hashlib.sha256()
+    for _, dest, state in files:
+        h.update(f"{dest}\0".encode())
+        h.update(bytes.fromhex(state[2]))
+    path = archive_dir / f"copy-{h.hexdigest()[:32]}.tar"
+    if not path.exists():
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.part")
+        with tarfile.open(tmp_path, "w") as tar:
+            for src, dest, _ in files:
+                tar.add(src, arcname=dest, recursive=False)
+        tmp_path.replace(path)
+    return path
+
+
+def _transfer_archive(
+    new_files: Sequence[tuple[Path, str, FileState]],
+    selenium: Any,
+    install_wheels: bool,
+) -> list[dict[str, Any]]:
+    """
+    Fetch the (src, dest, state) entries in new_files into pyodide as one tar archive
+    per extraction root (the current directory for relative destinations and
+    / for absolute ones) and install the wheels, in a single round trip.
+    Returns the url, extraction root, size and time of every archive.
+    """
+    base_path = Path.cwd()
+    server_hostname, server_port, log_path = file_server(base_path)
+    base_url = f"http://{server_hostname}:{server_port}"
+    archive_dir = get_scratch_dir(log_path)
+
+    wheels = []
+    roots: dict[str, list[tuple[Path, str, FileState]]] = {}
+    for file, dest, state in new_files:
+        if file.suffix == ".whl" and install_wheels:
+            wheels.append(f"{base_url}/{file.relative_to(base_path).as_posix()}")
+        elif Path(dest).is_absolute():
+            roots.setdefault("/", []).append((file, dest.lstrip("/"), state))
+        else:
+            roots.setdefault(".", []).append((file, dest, state))
+    archives = []
+    for root, files in roots.items():
+        archive = build_archive(files, archive_dir)
+        archives.append(
+            (f"{base_url}{SCRATCH_ROUTE}{archive.name}", root, archive.stat().st_size)
+        )
+    result = selenium.run_async(
+        f"""
+        async def _unpack_archives():
+            import json
+            import time
+            from pyodide.http import pyfetch
+
+            results = []
+            for url, extract_dir, size in {archives!r}:
+                start = time.perf_counter()
+                response = await pyfetch(url)
+                await response.unpack_archive(extract_dir=extract_dir, format="tar")
+                duration = time.perf_counter() - start
+                results.append(
+                    {{"url": url, "dest": extract_dir, "size": size, "time": duration}}
+                )
+            if {wheels!r}:
+                import micropip
+
+                await micropip.install({wheels!r})
+            return json.dumps(results)
+
+        await _unpack_archives()
+        """
+    )
+    return json.loads(result)  # type: ignore[no-any-return]
+
+
+def file_state(path: Path, previous: FileState | None = None) -> FileState:
+    """
+    Return the size, modification time and content hash of a file. The file is
+    only hashed if its size or modification time differ from ``previous``.
+    """
+    stat = path.stat()
+    if previous is not None and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+        return previous
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    return (stat.st_size, stat.st_mtime_ns, digest)
+
+
+def sync_directory_to_emscripten_fs(
+    directory: Path,
+    selenium: Any,
+    dest_base: Path = Path("test_files"),
+    wheel_dir: Path | None = None,
+):
+    """
+    Copy a directory below the current directory and its subdirectories to
+    ``dest_base`` in the emscripten file system, keeping the path relative to
+    the current directory, and install the wheels in ``wheel_dir``.
+
+    Each directory is synced once per runner. The runner keeps a manifest of
+    the files it has been sent, and only the files whose content changed since
+    then are copied, so wheels are only reinstalled when they change. Runners
+    that can mount host directories mount the directory read-only instead, so
+    --run-in-pyodide runs pytest without its cache provider.
+    """
+    directory = directory.absolute()
+    copy_index = selenium.copy_index
+    if directory in copy_index.synced_directories:
+        return
+    base_path = Path.cwd()
+    if hasattr(selenium, "mount_host_directory"):
+        wheels = []
+        if wheel_dir is not None and wheel_dir.exists():
+            wheels = [
+                (src, str(dest_base / src.relative_to(base_path)))
+                for src in wheel_dir.absolute().glob("*.whl")
+            ]
+        _mount_files(
+            [(directory, str(dest_base / directory.relative_to(base_path)))],
+            copy_index.changed(wheels),
+            selenium,
+            install_wheels=True,
+        )
+        copy_index.synced_directories.add(directory)
+        return
+
+    files = [f for f in directory.rglob("*") if not f.is_dir()]
+    if wheel_dir is not None and wheel_dir.exists():
+        files.extend(wheel_dir.absolute().glob("*.whl"))
+
+    changed = copy_index.changed(
+        (src, str(dest_base / src.relative_to(base_path))) for src in files
+    )
+    if changed:
+        _transfer_files(
+            [(src, dest) for src, dest, _ in changed], selenium, install_wheels=True
         )
+        copy_index.add(changed)
+    copy_index.synced_directories.add(directory)
@@ -1,5 +1,6 @@
 import ast
 import functools
+import hashlib
 import pickle
 import sys
 from base64 import b64decode, b64encode
@@ -10,10 +11,12 @@ from pathlib import Path
 from secrets import token_hex
 from textwrap import dedent, indent
 from typing import Any, Protocol
+from weakref import WeakKeyDictionary
 
 from .copy_files_to_pyodide import copy_files_to_emscripten_fs
-from .hook import ORIGINAL_MODULE_ASTS, REWRITTEN_MODULE_ASTS, pytest_wrapper
+from .hook import MODULE_ASTS, pytest_wrapper
 from .runner import _BrowserBaseRunner
+from .server import get_scratch_dir
 from .utils import package_is_built as _package_is_built
 
 MaybeAsyncFuncDef = ast.FunctionDef | ast.AsyncFunctionDef
@@ -36,6 +39,9 @@ class SeleniumType(Protocol):
     def run_js(self, code: str):
         ...
 
+    def run(self, code: str):
+        ...
+
 
 class _ReadableFileobj(Protocol):
     def read(self, __n: int) -> bytes:
@@ -45,12 +51,27 @@ class _ReadableFileobj(Protocol):
         ...
 
 
+# Buffers of at least this many bytes are not base 64 encoded into the code
+# but passed as binary blobs through the scratch directory of the web server.
+# Keep in sync with _decorator_in_pyodide.py.
+_OOB_THRESHOLD = 1 << 18
+_OOB_PREFIX = "oob:"
+_BYTES_TYPES = {"bytes": bytes, "bytearray": bytearray}
+
+
 class Unpickler(pickle.Unpickler):
-    def __init__(self, file: _ReadableFileobj, selenium: SeleniumType):
-        super().__init__(file)
+    def __init__(
+        self,
+        file: _ReadableFileobj,
+        selenium: SeleniumType,
+        buffers: Collection[Any] | None = None,
+    ):
+        super().__init__(file, buffers=buffers)
         self.selenium = selenium
 
     def persistent_load(self, pid: Any) -> Any:
+        if isinstance(pid, tuple) and len(pid) == 2 and pid[0] in _BYTES_TYPES:
+            return _BYTES_TYPES[pid[0]](pid[1])
         if not isinstance(pid, tuple) or len(pid) != 2 or pid[0] != "PyodideHandle":
             raise pickle.UnpicklingError("unsupported persistent object")
         ptr = pid[1]
@@ -61,6 +82,10 @@ class Unpickler(pickle.Unpickler):
 
 class Pickler(pickle.Pickler):
     def persistent_id(self, obj: Any) -> Any:
+        if type(obj) in _BYTES_TYPES.values() and len(obj) >= _OOB_THRESHOLD:
+            # bytes and bytearray are always pickled in band, wrap large ones
+            # in a PickleBuffer so that they can be sent out of band
+            return (type(obj).__name__, pickle.PickleBuffer(obj))
         if not isinstance(obj, PyodideHandle):
             return None
         return ("PyodideHandle", obj.ptr)
@@ -86,6 +111,11 @@ class PyodideHandle:
             return
         ptr = self.ptr
         self.ptr = None
+        release_handle = getattr(self.selenium, "release_handle", None)
+        if release_handle is not None:
+            # Batched with the next command, see _BrowserBaseRunner.release_handle
+            release_handle(ptr)
+            return
         self.selenium.run_js(
             f"""
             pyodide._module._Py_DecRef({ptr});
@@ -99,17 +129,80 @@ def _encode(obj: Any) -> str:
     templating.
     """
     b = BytesIO()
-    Pickler(b).dump(obj)
+    Pickler(b, protocol=5).dump(obj)
     return b64encode(b.getvalue()).decode()
 
 
+def _encode_out_of_band(obj: Any, scratch_dir: Path) -> tuple[str, list[Path]]:
+    """
+    Like _encode, but write large buffers to ``scratch_dir`` instead of
+    encoding them. Returns the encoded object and the files that were written.
+
+    If there are such buffers, the encoded object is
+    ``"oob:<name>,<name>,...:<base 64 pickle>"``, Pyodide fetches the named
+    files from the scratch route of the web server before unpickling.
+    """
+    buffers: list[pickle.PickleBuffer] = []
+
+    def buffer_callback(buf: pickle.PickleBuffer) -> bool:
+        try:
+            nbytes = buf.raw().nbytes
+        except BufferError:
+            # not contiguous
+            return True
+        if nbytes < _OOB_THRESHOLD:
+            return True
+        buffers.append(buf)
+        return False
+
+    b = BytesIO()
+    Pickler(b, protocol=5, buffer_callback=buffer_callback).dump(obj)
+    pickled64 = b64encode(b.getvalue()).decode()
+    paths = []
+    for buf in buffers:
+        path = scratch_dir / f"blob-{token_hex(16)}.bin"
+        path.write_bytes(buf.raw())
+        paths.append(path)
+    if not paths:
+        return pickled64, []
+    return f"{_OOB_PREFIX}{','.join(p.name for p in paths)}:{pickled64}", paths
+
+
+def _scratch_dir(selenium: SeleniumType) -> Path | None:
+    """The scratch directory of the web server of selenium, if there is one"""
+    server_log = getattr(selenium, "server_log", None)
+    if server_log is None:
+        return None
+    scratch_dir = get_scratch_dir(server_log)
+    return scratch_dir if scratch_dir.is_dir() else None
+
+
+def _load_out_of_band(selenium: SeleniumType, result: str) -> tuple[str, list[bytes]]:
+    """
+    Split an encoded object into the base 64 pickle and the out of band
+    buffers that Pyodide uploaded to the scratch directory.
+    """
+    if not result.startswith(_OOB_PREFIX):
+        return result, []
+    names, pickled64 = result.removeprefix(_OOB_PREFIX).split(":", 1)
+    scratch_dir = _scratch_dir(selenium)
+    assert scratch_dir is not None
+    buffers = []
+    for name in names.split(","):
+        path = scratch_dir / name
+        buffers.append(path.read_bytes())
+        path.unlink()
+    return pickled64, buffers
+
+
 def _decode(selenium: SeleniumType, result, status, repr) -> Any:
     if status:
         thing = "exception raised"
     else:
         thing = "value returned"
     try:
-        return Unpickler(BytesIO(b64decode(result)), selenium).load()
+        pickled64, buffers = _load_out_of_band(selenium, result)
+        return Unpickler(BytesIO(b64decode(pickled64)), selenium, buffers).load()
     except Exception as e:
         e.add_note(
             f"The error occurred while unpickling the {thing} from pyodide.\n"
@@ -319,51 +412,56 @@ del temp
     )
 
 
-def _locate_funcdef(
-    module_ast: ast.Module, f: Callable[..., Any]
-) -> tuple[list[ast.stmt], MaybeAsyncFuncDef]:
-    """Locate the statements from the original module that we need to make our
-    wrapper function.
+# Status that run_in_pyodide_main returns if the module isn't cached
+_CACHE_MISS = 2
+
+# Number of cases per round trip for run_in_pyodide(batch=True)
+_DEFAULT_BATCH_SIZE = 100
+
+# Marks the position of the arguments in the code built by _code_template
+_ARGS_PLACEHOLDER = "__pytest_pyodide_args__"
+
+# Hashes of the run_in_pyodide modules that each runner has been sent
+_KNOWN_PAYLOADS: "WeakKeyDictionary[Any, set[str]]" = WeakKeyDictionary()
+_CACHE_INFO = {"resends": 0}
+
 
-    Returns a pair:
-        statements: a list of mypy magic imports that are used for mypy assertion rewrites
-        funcdef: The funcdef node that makes our function
+def _known_payloads(selenium: SeleniumType) -> set[str]:
+    try:
+        return _KNOWN_PAYLOADS.setdefault(selenium, set())
+    except TypeError:
+        # Not weak referenceable, always send the whole module
+        return set()
+
+
+def cache_info(selenium: SeleniumType) -> dict[str, int]:
+    """Statistics of the run_in_pyodide module cache of a runner.
+
+    ``hits`` and ``misses`` count the calls that found / didn't find the
+    compiled module in Pyodide, ``size`` is the number of cached modules and
+    ``resends`` counts the modules that had to be sent again (over all
+    runners) because the cache was lost, e.g. when the page was reloaded.
     """
-    funcname = f.__name__
-    func_line_no = f.__code__.co_firstlineno
-    statements: list[ast.stmt] = []
-    it = iter(module_ast.body)
-    while True:
-        try:
-            node = next(it)
-        except StopIteration:
-            raise Exception(
-                f"Didn't find function {funcname} (line {func_line_no}) in module."
-            ) from None
-        # We need to include the magic imports that pytest inserts
-        if (
-            isinstance(node, ast.Import)
-            and node.names[0].asname
-            and node.names[0].asname.startswith("@")
-        ):
-            statements.append(node)
-
-        if node.end_lineno and (node.lineno < func_line_no < node.end_lineno):
-            it = iter(node.body)  # type: ignore[attr-defined]
-            continue
-
-        # We also want the function definition node
-        if not isinstance(node, ast.FunctionDef | ast.AsyncFunctionDef):
-            continue
-
-        if node.lineno < func_line_no:
-            continue
-
-        if node.name != funcname:
-            raise RuntimeError(
-                f"Internal run_in_pyodide error: looking for function '{funcname}' but found '{node.name}'"
-            )
-        return (statements, node)
+    info = selenium.run(
+        "from pytest_pyodide.decorator import cache_info; cache_info()"
+    )
+    return {**info, **_CACHE_INFO}
+
+
+def _direct_params(item: Any) -> set[str]:
+    """The names of the arguments of a test item that are parametrized
+    directly with pytest.mark.parametrize"""
+    names = set()
+    for mark in item.iter_markers("parametrize"):
+        argnames = mark.args[0] if mark.args else mark.kwargs["argnames"]
+        if isinstance(argnames, str):
+            argnames = [name.strip() for name in argnames.split(",")]
+        indirect = mark.kwargs.get("indirect", False)
+        for name in argnames:
+            if indirect is True or (not isinstance(indirect, bool) and name in indirect):
+                continue
+            names.add(name)
+    return names
 
 
 class run_in_pyodide:
@@ -383,6 +481,7 @@ class run_in_pyodide:
         packages: Collection[str] = (),
         pytest_assert_rewrites: bool = True,
         *,
+        batch: bool | int = False,
         _force_assert_rewrites: bool = False,
     ):
         """
@@ -401,9 +500,32 @@ class run_in_pyodide:
         pytest_assert_rewrites : bool, default = True
             If True, use pytest assertion rewrites. This gives better error messages
             when an assertion fails, but requires us to load pytest.
+
+        batch : bool | int, default = False
+            If True or a positive number, the cases of a parametrized test are
+            run in batches of that size (100 if True) with a single round trip
+            per batch. The results are reported for every case as usual. Only
+            cases whose arguments all come directly (not indirect) from
+            ``pytest.mark.parametrize`` can be batched. A batch only contains
+            cases of one runtime and all of them run in the runner of the
+            first one, also with selenium_standalone, so they must not depend on
+            per test setup or teardown.
         """
 
         self._pkgs = list(packages)
+        # The code around the arguments, see _code_template
+        self._code_templates: dict[tuple[bool, bool, bool], tuple[str, str]] = {}
+        self._batch_size = _DEFAULT_BATCH_SIZE if batch is True else int(batch)
+        # By runtime, the cases that were collected but didn't run yet, in the
+        # order in which they run. Maps the encoded arguments to the arguments
+        # and the number of test items with these arguments.
+        self._batch_queue: dict[str, dict[str, tuple[tuple[Any, ...], int]]] = {}
+        # By runtime, the results of cases that ran in a batch but weren't
+        # reported yet and the cases that ran so far. Not by runner: with
+        # selenium_standalone every test gets a new runner.
+        self._batch_results: dict[
+            str, tuple[dict[str, tuple[int, str, str]], set[str]]
+        ] = {}
         pytest_assert_rewrites = _force_assert_rewrites or (
             pytest_assert_rewrites and package_is_built("pytest")
         )
@@ -411,9 +533,7 @@ class run_in_pyodide:
         if pytest_assert_rewrites:
             self._pkgs.append("pytest")
 
-        self._module_asts_dict = (
-            REWRITTEN_MODULE_ASTS if pytest_assert_rewrites else ORIGINAL_MODULE_ASTS
-        )
+        self._pytest_assert_rewrites = pytest_assert_rewrites
 
         tblib_variants = (
             "pyodide-tblib",
@@ -427,61 +547,237 @@ class run_in_pyodide:
     def __call__(self, f: Callable[..., Any]) -> Callable[..., Any]:
         module = sys.modules[f.__module__]
         module_filename = module.__file__ or ""
-        module_ast = self._module_asts_dict[module_filename]
-
-        statements, funcdef = _locate_funcdef(module_ast, f)
+        statements, funcdef = MODULE_ASTS.locate(
+            module_filename,
+            f.__name__,
+            f.__code__.co_firstlineno,
+            rewrite=self._pytest_assert_rewrites,
+        )
         inner_funcdef = prepare_inner_funcdef(funcdef)
         statements.append(inner_funcdef)
         new_ast_module = ast.Module(statements, type_ignores=[])
 
         wrapper = _create_outer_func(self._run, funcdef, f)
         functools.update_wrapper(wrapper, f)
+        if self._batch_size:
+            # Used by pytest_collection_finish to register the cases
+            wrapper._pytest_pyodide_batch = self  # type: ignore[attr-defined]
 
         # Store information needed by self._code_template
         self._mod = new_ast_module
         self._module_filename = module_filename
         self._func_name = f.__name__
         self._async_func = isinstance(funcdef, ast.AsyncFunctionDef)
+        self._arg_names = [arg.arg for arg in all_args(funcdef)[1:]]
         return wrapper
 
+    def add_item(self, item: Any):
+        """Register the case of a collected test item for batched execution"""
+        callspec = getattr(item, "callspec", None)
+        if callspec is None or "runtime" not in callspec.params:
+            return
+        # The values of indirect parameters are passed to fixtures, the test
+        # gets what the fixtures return. Such cases run on their own.
+        if not set(self._arg_names) <= _direct_params(item):
+            return
+        params = {**getattr(callspec, "funcargs", {}), **callspec.params}
+        args = tuple(params[name] for name in self._arg_names)
+        self._queue_case(callspec.params["runtime"], args)
+
+    def _queue_case(self, runtime: str, args: tuple[Any, ...]):
+        try:
+            key = _encode(args)
+        except Exception:
+            # Not picklable, the test will report the error when it runs
+            return
+        queue = self._batch_queue.setdefault(runtime, {})
+        _, count = queue.get(key, (args, 0))
+        queue[key] = (args, count + 1)
+
+    def clear_batches(self):
+        """Forget the queued cases and the results that were never reported,
+        e.g. of skipped tests"""
+        self._batch_queue.clear()
+        self._batch_results.clear()
+
+    @functools.cached_property
+    def _mod_payload(self) -> tuple[str, str]:
+        """The encoded module and the hash that identifies it inside Pyodide"""
+        mod64 = _encode(self._mod)
+        h = hashlib.sha256()
+        for part in (self._module_filename, self._func_name, mod64):
+            h.update(part.encode())
+            h.update(b"\0")
+        return mod64, h.hexdigest()
+
     def _run(self, selenium: SeleniumType, args: tuple[Any, ...]):
         """The main runner, called from the AST generated in _create_outer_func."""
         __tracebackhide__ = True
-        code = self._code_template(args)
-        if self._pkgs:
-            selenium.load_package(self._pkgs)
-
-        r = selenium.run_async(code)
-        [status, result, repr, *extra] = r
-        self._process_extra(*extra)
+        if self._batch_size:
+            status, result, repr = self._run_batched(selenium, args)
+        else:
+            [(status, result, repr)] = self._run_cases(selenium, [args], batch=False)
 
         result = _decode(selenium, result, status, repr)
         if status:
             raise result
         return result
 
-    def _code_template(self, args: tuple[Any, ...]) -> str:
+    def _run_batched(
+        self, selenium: SeleniumType, args: tuple[Any, ...]
+    ) -> tuple[int, str, str]:
+        """
+        Return the result of the case ``args``. If it didn't run yet, run it
+        together with the next queued cases.
+        """
+        __tracebackhide__ = True
+        key = _encode(args)
+        # The runtime of the runner, like the runtime parameter of the test
+        runtime = selenium.browser
+        queue = self._batch_queue.get(runtime, {})
+        if key in queue:
+            _, count = queue[key]
+            if count > 1:
+                queue[key] = (args, count - 1)
+            else:
+                del queue[key]
+        results, ran = self._batch_results.setdefault(runtime, ({}, set()))
+        if key not in results:
+            keys = [key]
+            cases = [args]
+            for pending_key, (pending_args, _) in queue.items():
+                if len(cases) >= self._batch_size:
+                    break
+                if pending_key not in ran and pending_key != key:
+                    keys.append(pending_key)
+                    cases.append(pending_args)
+            # If the batch failed as a whole, there is only one result and it
+            # belongs to this case
+            batch_results = self._run_cases(selenium, cases, batch=True)
+            ran.update(keys)
+            for k, r in zip(keys, batch_results, strict=False):
+                results[k] = r
+        result = results.pop(key)
+        if not queue:
+            # The last queued case of this runtime ran, anything left belongs
+            # to tests that didn't run
+            self._batch_queue.pop(runtime, None)
+            del self._batch_results[runtime]
+        return result
+
+    def _run_cases(
+        self, selenium: SeleniumType, cases: list[tuple[Any, ...]], batch: bool
+    ) -> list[tuple[int, str, str]]:
+        """
+        Run the function for each argument tuple in ``cases`` and return the
+        encoded results. If ``batch`` is False, there must be exactly one case.
+        """
+        __tracebackhide__ = True
+        known_payloads = _known_payloads(selenium)
+        mod_hash = self._mod_payload[1]
+        scratch_dir = _scratch_dir(selenium)
+        blobs: list[Path] = []
+        cases64 = []
+        for args in cases:
+            if scratch_dir is None:
+                cases64.append(_encode(args))
+            else:
+                case64, case_blobs = _encode_out_of_band(args, scratch_dir)
+                cases64.append(case64)
+                blobs.extend(case_blobs)
+        args64: str | list[str] = cases64 if batch else cases64[0]
+        out_of_band = scratch_dir is not None
+        try:
+            code = self._code_template(
+                args64,
+                send_module=mod_hash not in known_payloads,
+                out_of_band=out_of_band,
+            )
+            if self._pkgs:
+                selenium.load_package(self._pkgs)
+
+            r = selenium.run_async(code)
+            if r[0] == _CACHE_MISS:
+                # Pyodide was restarted or reloaded since we sent the module
+                _CACHE_INFO["resends"] += 1
+                r = selenium.run_async(
+                    self._code_template(
+                        args64, send_module=True, out_of_band=out_of_band
+                    )
+                )
+        finally:
+            for blob in blobs:
+                blob.unlink(missing_ok=True)
+        known_payloads.add(mod_hash)
+        [status, result, repr, *extra] = r
+        self._process_extra(*extra)
+        if batch and not status:
+            return [tuple(case_result) for case_result in result]
+        return [(status, result, repr)]
+
+    def _code_template(
+        self,
+        args64: str | list[str],
+        send_module: bool = True,
+        out_of_band: bool = False,
+    ) -> str:
         """
         Unpickle function ast and its arguments, compile and call function, and
         if the function is async await the result. Last, if there was an
         exception, pickle it and send it back.
+
+        ``args64`` are the arguments encoded with _encode or
+        _encode_out_of_band, or a list of them to run a batch of cases. If
+        ``send_module`` is False, only the hash of the function ast is sent and
+        the result is ``(_CACHE_MISS, "", "")`` if Pyodide doesn't have the
+        compiled function cached. If ``out_of_band`` is True, Pyodide uploads
+        large buffers of the result to the scratch directory of the web server.
+
+        Everything but the arguments is the same for every call, so the code
+        around them is only built once for each combination of the options.
         """
+        key = (send_module, isinstance(args64, list), out_of_band)
+        if key not in self._code_templates:
+            self._code_templates[key] = self._build_code_template(*key)
+        head, tail = self._code_templates[key]
+        return head + repr(args64) + tail
+
+    def _build_code_template(
+        self, send_module: bool, batch: bool, out_of_band: bool
+    ) -> tuple[str, str]:
+        """Return the code before and after the arguments, see _code_template"""
         # Indent by 12 to match the indentation level of the body of __tmp()
         prelude = indent(self._get_code_prelude(), " " * 12)
         epilogue = indent(self._get_code_epilogue(), " " * 12)
+        mod64, mod_hash = self._mod_payload
+        if batch:
+            main = "run_in_pyodide_batch"
+        else:
+            main = "run_in_pyodide_main"
+        if send_module:
+            cache_check = ""
+        else:
+            mod64 = None  # type: ignore[assignment]
+            cache_check = (
+                f"if not is_cached({mod_hash!r}):\n"
+                f"                return ({_CACHE_MISS}, '', '')"
+            )
 
-        return f"""
+        code = f"""
         async def __tmp():
             __tracebackhide__ = True
 
-            from pytest_pyodide.decorator import run_in_pyodide_main
+            from pytest_pyodide.decorator import is_cached, {main}
+            {cache_check}
             \n{prelude}
-            result = await run_in_pyodide_main(
-                {_encode(self._mod)!r},
-                {_encode(args)!r},
+            result = await {main}(
+                {mod64!r},
+                {_ARGS_PLACEHOLDER},
                 {self._module_filename!r},
                 {self._func_name!r},
                 {self._async_func!r},
+                {mod_hash!r},
+                {out_of_band!r},
             )
             \n{epilogue}
             return result
@@ -492,6 +788,8 @@ class run_in_pyodide:
             del __tmp
         result
         """
+        head, tail = code.split(_ARGS_PLACEHOLDER)
+        return head, tail
 
     # Hooks for run_in_pyodide_coverage
 
@@ -569,7 +867,14 @@ class run_in_pyodide_coverage(run_in_pyodide):
         _get_coverage_path().write_bytes(b64decode(coverage_out_binary))
 
 
-def copy_files_to_pyodide(file_list, install_wheels=True, recurse_directories=True):
+def copy_files_to_pyodide(
+    file_list,
+    install_wheels=True,
+    recurse_directories=True,
+    bulk=False,
+    mount=False,
+    lazy=False,
+):
     """A decorator that copies files across to pyodide"""
 
     def wrap(fn):
@@ -592,6 +897,9 @@ def copy_files_to_pyodide(file_list, install_wheels=True, recurse_directories=Tr
                 selenium,
                 install_wheels=install_wheels,
                 recurse_directories=recurse_directories,
+                bulk=bulk,
+                mount=mount,
+                lazy=lazy,
             )
             return fn(*args, **argv)
 
@@ -1,4 +1,3 @@
-import ast
 from collections.abc import Callable
 from copy import copy
 from doctest import DocTest, DocTestRunner, register_optionflag
@@ -16,16 +15,14 @@ from _pytest.scope import Scope
 from pytest import Collector
 
 from . import run_in_pyodide
-from .hook import ORIGINAL_MODULE_ASTS, pytest_wrapper
+from .hook import MODULE_ASTS, pytest_wrapper
 
 __all__ = ["patch_doctest_runner", "collect_doctests"]
 
 
 # Record the ast of this file so we can use run_in_pyodide in here
 # TODO: maybe extract this as a utility function for clarity?
-ORIGINAL_MODULE_ASTS[__file__] = ast.parse(
-    Path(__file__).read_bytes(), filename=__file__
-)
+MODULE_ASTS.add(__file__, Path(__file__).read_bytes())
 # make doctest aware of our `doctest: +RUN_IN_PYODIDE`` optionflag
 RUN_IN_PYODIDE = register_optionflag("RUN_IN_PYODIDE")
 
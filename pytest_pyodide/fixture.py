@@ -2,6 +2,7 @@ import contextlib
 import functools
 import inspect
 import os
+from collections.abc import Callable
 from pathlib import Path
 from typing import Any
 
@@ -9,6 +10,7 @@ import pytest
 
 from .config import get_global_config
 from .hook import pytest_wrapper
+from .pool import RunnerPool, runner_pool_key, use_runner_pool
 from .runner import (
     BrowserWorkerChromeRunner,
     BrowserWorkerFirefoxRunner,
@@ -22,6 +24,7 @@ from .runner import (
     _BrowserBaseRunner,
 )
 from .server import spawn_web_server
+from .snapshot import get_memory_snapshot
 from .utils import parse_driver_timeout, set_webdriver_script_timeout
 
 
@@ -110,8 +113,7 @@ def _get_runner_cls(
     return runner_cls
 
 
-@contextlib.contextmanager
-def selenium_common(
+def _runner_factory(
     request,
     runtime,
     web_server_main,
@@ -119,26 +121,60 @@ def selenium_common(
     browsers=None,
     jspi=False,
     worker=False,
-):
-    """Returns an initialized selenium object.
-
-    If `_should_skip_test` indicate that the test will be skipped,
-    return None, as initializing Pyodide for selenium is expensive
-    """
+) -> Callable[[], _BrowserBaseRunner]:
+    """Returns a function that creates an initialized selenium object."""
 
     server_hostname, server_port, server_log = web_server_main
     runner_cls = _get_runner_cls(runtime, request.config.option.runner.lower(), worker)
 
     dist_dir = Path(os.getcwd(), request.config.getoption("--dist-dir"))
-    runner = runner_cls(
+    runner_kwargs = dict(
         server_port=server_port,
         server_hostname=server_hostname,
         server_log=server_log,
-        load_pyodide=load_pyodide,
         browsers=browsers,
         dist_dir=dist_dir,
         jspi=jspi,
     )
+    snapshot = None
+    if load_pyodide and not jspi and request.config.option.memory_snapshot:
+        snapshot = get_memory_snapshot(
+            request,
+            runner_cls,
+            web_server_main,
+            dist_dir,
+            lambda: runner_cls(load_pyodide=False, **runner_kwargs),
+        )
+    return functools.partial(
+        runner_cls, load_pyodide=load_pyodide, snapshot=snapshot, **runner_kwargs
+    )
+
+
+@contextlib.contextmanager
+def selenium_common(
+    request,
+    runtime,
+    web_server_main,
+    load_pyodide=True,
+    browsers=None,
+    jspi=False,
+    worker=False,
+):
+    """Returns an initialized selenium object.
+
+    If `_should_skip_test` indicate that the test will be skipped,
+    return None, as initializing Pyodide for selenium is expensive
+    """
+
+    runner = _runner_factory(
+        request,
+        runtime,
+        web_server_main,
+        load_pyodide=load_pyodide,
+        browsers=browsers,
+        jspi=jspi,
+        worker=worker,
+    )()
     try:
         yield runner
     finally:
@@ -170,10 +206,41 @@ def rename_fixture(orig_name, new_name):
 standalone = rename_fixture("selenium", "selenium_standalone")
 
 
-@pytest.fixture(scope="function")
-def selenium_standalone(request, runtime, web_server_main, playwright_browsers):
-    with selenium_common(
+@pytest.fixture(scope="session")
+def standalone_runner_pool(request):
+    """Pool of pre-booted runners for `selenium_standalone`, see pool.py"""
+    pool = RunnerPool(request.config.option.standalone_pool_size)
+    request.config.stash[runner_pool_key] = pool
+    try:
+        yield pool
+    finally:
+        pool.close()
+
+
+@contextlib.contextmanager
+def selenium_standalone_common(
+    request, runtime, web_server_main, playwright_browsers, standalone_runner_pool
+):
+    if not use_runner_pool(request.config, runtime):
+        with selenium_common(
+            request, runtime, web_server_main, browsers=playwright_browsers
+        ) as selenium:
+            yield selenium
+        return
+
+    factory = _runner_factory(
         request, runtime, web_server_main, browsers=playwright_browsers
+    )
+    with standalone_runner_pool.runner(runtime, factory) as selenium:
+        yield selenium
+
+
+@pytest.fixture(scope="function")
+def selenium_standalone(
+    request, runtime, web_server_main, playwright_browsers, standalone_runner_pool
+):
+    with selenium_standalone_common(
+        request, runtime, web_server_main, playwright_browsers, standalone_runner_pool
     ) as selenium:
         with set_webdriver_script_timeout(
             selenium, script_timeout=parse_driver_timeout(request.node)
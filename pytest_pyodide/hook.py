@@ -3,26 +3,28 @@ This file is listed in the options.entry_points section of config.cfg so pytest
 will look in here for hooks to execute.
 """
 
-import ast
 import re
 import sys
 from argparse import BooleanOptionalAction
-from copy import copy, deepcopy
+from copy import copy
 from pathlib import Path
 from typing import Any, cast
 
 import pytest
-from _pytest.assertion.rewrite import AssertionRewritingHook, rewrite_asserts
+from _pytest.assertion.rewrite import AssertionRewritingHook
 from _pytest.python import (
     pytest_pycollect_makemodule as orig_pytest_pycollect_makemodule,
 )
 from pytest import Collector, Session
 
-from .copy_files_to_pyodide import copy_files_to_emscripten_fs
+from .ast_cache import AST_CACHE_DIR, AST_CACHE_STATS, ModuleASTStore
+from .copy_files_to_pyodide import close_file_servers, sync_directory_to_emscripten_fs
+from .pool import runner_pool_key
 from .run_tests_inside_pyodide import (
     close_pyodide_browsers,
     get_browser_pyodide,
-    run_test_in_pyodide,
+    host_call_report,
+    pyodide_test_reports,
 )
 from .utils import parse_xfail_browsers
 
@@ -136,10 +138,13 @@ def pytest_configure(config):
     pytest_wrapper.pyodide_run_host_test = run_host
     pytest_wrapper.pyodide_runtimes = runtimes
     pytest_wrapper.pyodide_dist_dir = config.option.dist_dir
+    MODULE_ASTS.maxsize = config.option.module_ast_cache_size
 
 
 def pytest_unconfigure(config):
+    MODULE_ASTS.flush()
     close_pyodide_browsers()
+    close_file_servers()
     try:
         (
             pytest_wrapper.pyodide_run_host_test,
@@ -150,6 +155,37 @@ def pytest_unconfigure(config):
         pass
 
 
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    from .runner import HANDLE_RELEASE_STATS, LOAD_PACKAGE_STATS
+
+    lines = []
+    pool = config.stash.get(runner_pool_key, None)
+    if pool is not None and pool.hits + pool.misses > 0:
+        lines.append(pool.summary())
+    if MODULE_ASTS.loads and config.option.verbose > 0:
+        lines.append(MODULE_ASTS.summary())
+        if AST_CACHE_STATS["hits"] + AST_CACHE_STATS["misses"]:
+            lines.append(
+                "run_in_pyodide AST cache: {hits} hits, {misses} misses".format(
+                    **AST_CACHE_STATS
+                )
+            )
+    if LOAD_PACKAGE_STATS["skipped"]:
+        lines.append(
+            "load_package: {skipped} of {calls} calls skipped, "
+            "the packages were already loaded".format(**LOAD_PACKAGE_STATS)
+        )
+    if HANDLE_RELEASE_STATS["released"]:
+        lines.append(
+            "PyodideHandle: {released} references released "
+            "in {flushes} batches".format(**HANDLE_RELEASE_STATS)
+        )
+    if lines:
+        terminalreporter.write_sep("-", "pytest-pyodide")
+        for line in lines:
+            terminalreporter.write_line(line)
+
+
 @pytest.hookimpl(tryfirst=True)
 def pytest_addoption(parser):
     group = parser.getgroup("general")
@@ -172,6 +208,14 @@ def pytest_addoption(parser):
         action=BooleanOptionalAction,
         help="Run standard pytest tests, but in pyodide",
     )
+    group.addoption(
+        "--run-in-pyodide-session",
+        action=BooleanOptionalAction,
+        default=False,
+        help="With --run-in-pyodide, run the tests in one pytest session per "
+        "runtime that is kept alive inside pyodide instead of starting pytest "
+        "for every test",
+    )
 
     group.addoption(
         "--rt",
@@ -181,6 +225,34 @@ def pytest_addoption(parser):
         help="Select runtimes to run tests (default: %(default)s)",
     )
 
+    group.addoption(
+        "--standalone-pool-size",
+        type=int,
+        default=0,
+        help="Number of runners per runtime that are booted in the background "
+        "for selenium_standalone tests (default: %(default)s)",
+    )
+    group.addoption(
+        "--memory-snapshot",
+        action=BooleanOptionalAction,
+        default=False,
+        help="Boot Pyodide from a memory snapshot that is built once per dist "
+        "directory and cached (requires a Pyodide version that supports "
+        "memory snapshots)",
+    )
+    group.addoption(
+        "--module-ast-cache-size",
+        type=int,
+        default=32,
+        help="Number of run_in_pyodide modules whose ASTs are kept in memory, "
+        "0 keeps all of them (default: %(default)s)",
+    )
+    group.addoption(
+        "--memory-snapshot-packages",
+        default="",
+        help="Comma separated list of packages to preload in the memory snapshot",
+    )
+
 
 # We don't know the params yet, but we can set them when we do know them in
 # pytest_collection
@@ -229,15 +301,16 @@ def _get_pytest_rewrite_config() -> Any:
 
 
 # Now we need to parse the ast of the files, rewrite the ast, and store the
-# original and rewritten ast into dictionaries. `run_in_pyodide` will look the
-# ast up in the appropriate dictionary depending on whether or not it is using
-# pytest assert rewrites.
+# original and rewritten ast. `run_in_pyodide` will look the ast up in the
+# appropriate mapping depending on whether or not it is using pytest assert
+# rewrites. The trees are only built when they are looked up, see ast_cache.py.
 
 REWRITE_CONFIG = _get_pytest_rewrite_config()
 del _get_pytest_rewrite_config
 
-ORIGINAL_MODULE_ASTS: dict[str, ast.Module] = {}
-REWRITTEN_MODULE_ASTS: dict[str, ast.Module] = {}
+MODULE_ASTS = ModuleASTStore()
+ORIGINAL_MODULE_ASTS = MODULE_ASTS.original
+REWRITTEN_MODULE_ASTS = MODULE_ASTS.rewritten
 
 
 def pytest_pycollect_makemodule(module_path: Path, parent: Collector) -> None:
@@ -248,11 +321,9 @@ def pytest_pycollect_makemodule(module_path: Path, parent: Collector) -> None:
     source = module_path.read_bytes()
     if b"run_in_pyodide" in source:
         strfn = str(module_path)
-        tree = ast.parse(source, filename=strfn)
-        ORIGINAL_MODULE_ASTS[strfn] = tree
-        tree2 = deepcopy(tree)
-        rewrite_asserts(tree2, source, strfn, REWRITE_CONFIG)
-        REWRITTEN_MODULE_ASTS[strfn] = tree2
+        cache = getattr(parent.config, "cache", None)
+        cache_dir = cache.mkdir(AST_CACHE_DIR) if cache else None
+        MODULE_ASTS.add(strfn, source, cache_dir, REWRITE_CONFIG)
     orig_pytest_pycollect_makemodule(module_path, parent)
 
 
@@ -311,6 +382,22 @@ def pytest_collection_modifyitems(items: list[Any]) -> None:
     items[:] = sorted(items, key=_get_item_position)
 
 
+def pytest_collection_finish(session: Session) -> None:
+    # Register the cases of run_in_pyodide(batch=True) functions in the order
+    # in which they will run
+    for item in session.items:
+        batch = getattr(getattr(item, "obj", None), "_pytest_pyodide_batch", None)
+        if batch is not None:
+            batch.add_item(item)
+
+
+def pytest_sessionfinish(session: Session) -> None:
+    for item in session.items:
+        batch = getattr(getattr(item, "obj", None), "_pytest_pyodide_batch", None)
+        if batch is not None:
+            batch.clear_batches()
+
+
 @pytest.hookimpl(tryfirst=True)
 def pytest_runtest_setup(item):
     if item.config.option.run_in_pyodide:
@@ -320,19 +407,6 @@ def pytest_runtest_setup(item):
             pytest.skip(reason="pyodide specific test, can't run in pyodide")
         else:
             # Pass this test to pyodide runner
-            # First: make sure that pyodide has the test folder copied over
-            item_path = Path(item.path)
-            copy_files = list(item_path.parent.rglob("*"))
-            # If we have a pyodide build dist folder with wheels in, copy those over
-            # and install the wheels in pyodide so we can import this package for tests
-            dist_path = Path.cwd() / "dist"
-            if dist_path.exists():
-                copy_files.extend(list(dist_path.glob("*.whl")))
-
-            copy_files_with_destinations = []
-            for src in copy_files:
-                dest = Path("test_files") / src.relative_to(Path.cwd())
-                copy_files_with_destinations.append((src, dest))
 
             class RequestType:
                 config = item.config
@@ -342,8 +416,12 @@ def pytest_runtest_setup(item):
                 request=cast(pytest.FixtureRequest, RequestType),
                 runtime=item.pyodide_runtime,
             )
-            copy_files_to_emscripten_fs(
-                copy_files_with_destinations, selenium, install_wheels=True
+            # First: make sure that pyodide has the test folder copied over.
+            # If we have a pyodide build dist folder with wheels in, copy those
+            # over and install the wheels in pyodide so we can import this
+            # package for tests. This is done once per folder.
+            sync_directory_to_emscripten_fs(
+                Path(item.path).parent, selenium, wheel_dir=Path.cwd() / "dist"
             )
     else:
         if not hasattr(item, "fixturenames"):
@@ -371,7 +449,13 @@ def pytest_runtest_call(item):
                 request=cast(pytest.FixtureRequest, RequestType),
                 runtime=item.pyodide_runtime,
             )
-            run_test_in_pyodide(self.nodeid, selenium)
+            # The reports replace the report of the call in
+            # pytest_runtest_makereport
+            self.pyodide_reports = pyodide_test_reports(
+                self.nodeid,
+                selenium,
+                session=item.config.option.run_in_pyodide_session,
+            )
 
         item.runtest = _run_in_pyodide.__get__(item, item.__class__)
         yield
@@ -392,4 +476,18 @@ def pytest_runtest_call(item):
         pytest.xfail(xfail_msg)
 
     yield
+    # Release the handles that the test dropped before the fixtures check for
+    # leaks. Fixtures whose name starts with selenium aren't always runners.
+    flush_handle_releases = getattr(browser, "flush_handle_releases", None)
+    if flush_handle_releases is not None:
+        flush_handle_releases()
     return
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    outcome = yield
+    reports = item.__dict__.pop("pyodide_reports", None)
+    if call.when == "call" and reports is not None:
+        # Report the outcome of the test in pyodide as the outcome of the item
+        outcome.force_result(host_call_report(outcome.get_result(), reports))
@@ -1,15 +1,58 @@
 const vm = require("vm");
+const fs = require("fs");
+const net = require("net");
 const readline = require("readline");
 const path = require("path");
 const util = require("util");
+const { Worker, isMainThread, parentPort, workerData } = require("worker_threads");
 
 const baseUrl = process.argv[2];
 const distDir = process.argv[3];
 const EXTRA_GLOBALS = JSON.parse(process.env.PYTEST_PYODIDE_NODE_TEST_DRIVER_EXTRA_GLOBALS);
+// "line": code is typed into stdin in short `$`-terminated lines, results are
+//         delimited by uuid markers on stdout.
+// "framed": commands and results are sent as length-prefixed binary frames,
+//         see `readFrames` / `writeFrame` below.
+// "threads": like "framed", but the code runs in worker threads which are
+//         started on request, each with its own context and Pyodide.
+const PROTOCOL = process.env.PYTEST_PYODIDE_NODE_TEST_DRIVER_PROTOCOL || "line";
+// If set, frames are exchanged over this file descriptor (one end of a
+// socketpair) instead of stdin / stdout.
+const CHANNEL_FD = process.env.PYTEST_PYODIDE_NODE_TEST_DRIVER_FD;
 
 
 const { loadPyodide } = require(`${distDir}/pyodide`);
-process.chdir(distDir);
+if (isMainThread) {
+  // Workers share the working directory and aren't allowed to change it.
+  process.chdir(distDir);
+} else if (workerData.wasmModule) {
+  // Instantiate Pyodide from the module that the main thread compiled instead
+  // of compiling pyodide.asm.wasm again in every worker. loadPyodide passes
+  // its Emscripten settings to the _createPyodideModule global that
+  // pyodide.asm.js defines, where we set the instantiateWasm hook.
+  const { wasmModule } = workerData;
+  let createPyodideModule;
+  Object.defineProperty(globalThis, "_createPyodideModule", {
+    configurable: true,
+    get() {
+      if (createPyodideModule === undefined) {
+        return undefined;
+      }
+      return function (settings) {
+        settings.instantiateWasm = function (imports, successCallback) {
+          WebAssembly.instantiate(wasmModule, imports).then((instance) =>
+            successCallback(instance, wasmModule)
+          );
+          return {};
+        };
+        return createPyodideModule.apply(this, arguments);
+      };
+    },
+    set(value) {
+      createPyodideModule = value;
+    },
+  });
+}
 
 // node requires full paths.
 function _fetch(path, ...args) {
@@ -53,40 +96,54 @@ for (const key of Object.keys(util.inspect.styles)) {
   util.inspect.styles[key] = undefined;
 }
 
-const rl = readline.createInterface({
-  input: process.stdin,
-  output: process.stdout,
-  terminal: false,
-});
+// Frame layout (shared with runner.py):
+//   magic (4 bytes) | kind (1 byte) | id (uint32 BE) | length (uint32 BE) | payload
+// The magic lets the host find the start of a frame even if something else
+// wrote to stdout in between.
+const FRAME_MAGIC = Buffer.from("\x1bPYF", "latin1");
+const FRAME_HEADER_SIZE = 13;
 
-let cur_code = "";
-let cur_uuid;
-rl.on("line", async function (line) {
-  if (!cur_uuid) {
-    cur_uuid = line;
-    return;
-  }
-  if (line !== cur_uuid) {
-    // each line ends with an extra $, to avoid problems with end-of-line
-    // translation etc.
-    line = line.substring(0, line.lastIndexOf('$'))
-    if(line === ""){
-      cur_code += "\n";
-    } else {
-      cur_code += line;
+function writeFrame(stream, kind, id, payload) {
+  const header = Buffer.alloc(FRAME_HEADER_SIZE);
+  FRAME_MAGIC.copy(header, 0);
+  header.write(kind, 4, "latin1");
+  header.writeUInt32BE(id, 5);
+  header.writeUInt32BE(payload.length, 9);
+  stream.write(Buffer.concat([header, payload]));
+}
+
+function readFrames(stream, onFrame) {
+  let chunks = [];
+  let buffered = 0;
+  let needed = FRAME_HEADER_SIZE;
+  stream.on("data", (chunk) => {
+    chunks.push(chunk);
+    buffered += chunk.length;
+    while (buffered >= needed) {
+      let data = chunks.length === 1 ? chunks[0] : Buffer.concat(chunks);
+      if (!data.subarray(0, 4).equals(FRAME_MAGIC)) {
+        throw new Error("Corrupted frame received from runner.py");
+      }
+      const length = data.readUInt32BE(9);
+      if (data.length < FRAME_HEADER_SIZE + length) {
+        // wait until the whole payload has arrived
+        chunks = [data];
+        needed = FRAME_HEADER_SIZE + length;
+        break;
+      }
+      const kind = data.toString("latin1", 4, 5);
+      const id = data.readUInt32BE(5);
+      const payload = data.subarray(FRAME_HEADER_SIZE, FRAME_HEADER_SIZE + length);
+      const rest = data.subarray(FRAME_HEADER_SIZE + length);
+      chunks = rest.length ? [rest] : [];
+      buffered = rest.length;
+      needed = FRAME_HEADER_SIZE;
+      onFrame(kind, id, payload);
     }
-    // tell runner.py that the line has been read
-    // so it can send the next line without worrying about
-    // filling buffers
-    console.log("{LINE_OK}")
-  } else {
-    evalCode(cur_uuid, cur_code, context);
-    cur_code = "";
-    cur_uuid = undefined;
-  }
-});
+  });
+}
 
-async function evalCode(uuid, code, eval_context) {
+function runInContext(code, eval_context) {
   let p = new Promise((resolve, reject) => {
     eval_context.___outer_resolve = resolve;
     eval_context.___outer_reject = reject;
@@ -96,15 +153,228 @@ async function evalCode(uuid, code, eval_context) {
           ${code}
       })().then(___outer_resolve).catch(___outer_reject);
       `;
+  vm.runInContext(wrapped_code, eval_context, { importModuleDynamically: vm.constants?.USE_MAIN_CONTEXT_DEFAULT_LOADER });
+  return p;
+}
+
+async function evalCode(uuid, code, eval_context) {
   let delim = uuid + ":UUID";
   console.log(delim);
   try {
-    vm.runInContext(wrapped_code, eval_context, { importModuleDynamically: vm.constants?.USE_MAIN_CONTEXT_DEFAULT_LOADER });
-    let result = JSON.stringify(await p);
+    let result = JSON.stringify(await runInContext(code, eval_context));
     console.log(`${delim}\n0\n${result}\n${delim}`);
   } catch (e) {
     console.log(`${delim}\n1\n${e.stack}\n${delim}`);
   }
 }
-console.log("READY!!");
+
+// Reply kinds: "J" JSON result, "B" binary result, "E" error (stack trace).
+async function evalToReply(code, eval_context) {
+  try {
+    const result = await runInContext(code, eval_context);
+    // The result comes from another realm so `instanceof` doesn't work here.
+    if (ArrayBuffer.isView(result)) {
+      return ["B", Buffer.from(result.buffer, result.byteOffset, result.byteLength)];
+    }
+    if (util.types.isAnyArrayBuffer(result)) {
+      return ["B", Buffer.from(result)];
+    }
+    return ["J", Buffer.from(JSON.stringify(result) ?? "null")];
+  } catch (e) {
+    return ["E", Buffer.from(String((e && e.stack) || e))];
+  }
+}
+
+// Written to stdout and stderr with the id of a frame before the reply to it
+// is sent over a separate channel. Once runner.py has read both markers it has
+// read all the console output of the call.
+const LOG_DRAIN_MARKER = "\x1bPYD";
+
+function drainLogs(id) {
+  return Promise.all(
+    [process.stdout, process.stderr].map(
+      (stream) => new Promise((resolve) => stream.write(`${LOG_DRAIN_MARKER}${id}\n`, resolve))
+    )
+  );
+}
+
+async function evalFrame(stream, id, code, eval_context, drain) {
+  const [kind, payload] = await evalToReply(code, eval_context);
+  if (drain) {
+    await drainLogs(id);
+  }
+  writeFrame(stream, kind, id, payload);
+}
+
+let wasmModulePromise;
+function compileWasmModule() {
+  const wasmPath = path.join(distDir, "pyodide.asm.wasm");
+  if (!fs.existsSync(wasmPath)) {
+    return Promise.resolve({});
+  }
+  const wasmBinary = fs.readFileSync(wasmPath);
+  return WebAssembly.compile(wasmBinary).then((wasmModule) => ({ wasmModule }));
+}
+
+function serveWorkers(channel) {
+  const workers = new Map();
+  let nextWorkerId = 1;
+
+  async function startWorker(id) {
+    wasmModulePromise ??= compileWasmModule();
+    const worker = new Worker(__filename, {
+      argv: process.argv.slice(2),
+      workerData: await wasmModulePromise,
+    });
+    const workerId = nextWorkerId++;
+    // Ids of the frames this worker hasn't replied to yet, starting with the
+    // request to start it.
+    const inflight = new Set([id]);
+    let lastError = "";
+    worker.on("message", (msg) => {
+      if (msg.log !== undefined) {
+        writeFrame(channel, "L", workerId, Buffer.from(msg.log));
+      } else if (msg.ready) {
+        inflight.delete(id);
+        workers.set(workerId, { worker, inflight });
+        writeFrame(channel, "J", id, Buffer.from(JSON.stringify(workerId)));
+      } else {
+        inflight.delete(msg.id);
+        writeFrame(channel, msg.kind, msg.id, Buffer.from(msg.payload));
+      }
+    });
+    worker.on("error", (e) => {
+      lastError = String((e && e.stack) || e);
+      writeFrame(channel, "L", workerId, Buffer.from(lastError));
+    });
+    worker.on("exit", (code) => {
+      workers.delete(workerId);
+      for (const frameId of inflight) {
+        writeFrame(channel, "E", frameId, Buffer.from(`Worker exited with code ${code}\n${lastError}`));
+      }
+      inflight.clear();
+    });
+  }
+
+  readFrames(channel, function (kind, id, payload) {
+    const entry = payload.length >= 4 ? workers.get(payload.readUInt32BE(0)) : undefined;
+    switch (kind) {
+      case "W":
+        startWorker(id);
+        break;
+      case "C":
+        if (!entry) {
+          writeFrame(channel, "E", id, Buffer.from("Unknown worker"));
+          break;
+        }
+        entry.inflight.add(id);
+        entry.worker.postMessage({ id, code: payload.toString("utf8", 4) });
+        break;
+      case "K":
+        if (!entry) {
+          writeFrame(channel, "J", id, Buffer.from("null"));
+          break;
+        }
+        workers.delete(payload.readUInt32BE(0));
+        entry.worker.removeAllListeners("exit");
+        entry.worker.terminate().then(() => {
+          writeFrame(channel, "J", id, Buffer.from("null"));
+        });
+        break;
+      case "Q":
+        process.exit(0);
+      default:
+        writeFrame(channel, "E", id, Buffer.from(`Unknown frame kind ${kind}`));
+    }
+  });
+}
+
+function runWorker() {
+  // Send all console output to the main thread, so that it ends up in the logs
+  // of the runner that owns this worker.
+  const sendLog = (...args) => parentPort.postMessage({ log: util.format(...args) });
+  for (const level of ["log", "warn", "info", "error", "debug"]) {
+    console[level] = sendLog;
+  }
+  for (const stream of [process.stdout, process.stderr]) {
+    stream.write = function (chunk, ...rest) {
+      parentPort.postMessage({ log: String(chunk).replace(/\n$/, "") });
+      const cb = rest.find((arg) => typeof arg === "function");
+      if (cb) {
+        cb();
+      }
+      return true;
+    };
+  }
+  parentPort.on("message", async ({ id, code }) => {
+    const [kind, payload] = await evalToReply(code, context);
+    parentPort.postMessage({ id, kind, payload });
+  });
+  parentPort.postMessage({ ready: true });
+}
+
+let channel;
+if (CHANNEL_FD && isMainThread) {
+  channel = new net.Socket({ fd: Number(CHANNEL_FD) });
+  // runner.py closed its end of the socketpair
+  channel.on("end", () => process.exit(0));
+}
+
+if (!isMainThread) {
+  runWorker();
+} else if (PROTOCOL === "threads") {
+  serveWorkers(channel);
+} else if (PROTOCOL === "framed") {
+  const input = channel ?? process.stdin;
+  const output = channel ?? process.stdout;
+  readFrames(input, function (kind, id, payload) {
+    switch (kind) {
+      case "C":
+        evalFrame(output, id, payload.toString(), context, output === channel);
+        break;
+      case "Q":
+        process.exit(0);
+      default:
+        writeFrame(output, "E", id, Buffer.from(`Unknown frame kind ${kind}`));
+    }
+  });
+} else {
+  const rl = readline.createInterface({
+    input: process.stdin,
+    output: process.stdout,
+    terminal: false,
+  });
+
+  let cur_code = "";
+  let cur_uuid;
+  rl.on("line", async function (line) {
+    if (!cur_uuid) {
+      cur_uuid = line;
+      return;
+    }
+    if (line !== cur_uuid) {
+      // each line ends with an extra $, to avoid problems with end-of-line
+      // translation etc.
+      line = line.substring(0, line.lastIndexOf('$'))
+      if(line === ""){
+        cur_code += "\n";
+      } else {
+        cur_code += line;
+      }
+      // tell runner.py that the line has been read
+      // so it can send the next line without worrying about
+      // filling buffers
+      console.log("{LINE_OK}")
+    } else {
+      evalCode(cur_uuid, cur_code, context);
+      cur_code = "";
+      cur_uuid = undefined;
+    }
+  });
+}
+if (channel) {
+  writeFrame(channel, "R", 0, Buffer.alloc(0));
+} else if (isMainThread) {
+  console.log("READY!!");
+}
 // evalCode("xxx", "let pyodide = await loadPyodide(); pyodide.runPython(`print([x*x+1 for x in range(10)])`);", context);
@@ -0,0 +1,115 @@
+"""
+A pool of pre-booted runners for the standalone fixtures.
+
+Starting a browser (or node) and loading Pyodide is the most expensive part of
+a ``selenium_standalone`` test. The pool keeps a number of fully initialized
+runners per runtime booting in background threads, hands one to each
+standalone test and starts booting a replacement while the test runs.
+"""
+
+import contextlib
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+import pytest
+
+if TYPE_CHECKING:
+    # runner.py imports hook.py, which imports this module
+    from .runner import _BrowserBaseRunner
+
+RunnerFactory = Callable[[], "_BrowserBaseRunner"]
+
+runner_pool_key = pytest.StashKey["RunnerPool"]()
+
+
+class RunnerPool:
+    """Keeps ``size`` runners per runtime warm.
+
+    A runner that was fully booted when it was requested counts as a hit, a
+    runner that was still booting or had to be created on the spot counts as
+    a miss.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._runners: dict[str, deque[Future[_BrowserBaseRunner]]] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(size, 1), thread_name_prefix="pytest-pyodide-pool"
+        )
+
+    def _fill(self, runtime: str, factory: RunnerFactory):
+        runners = self._runners.setdefault(runtime, deque())
+        while len(runners) < self.size:
+            runners.append(self._executor.submit(factory))
+
+    def acquire(self, runtime: str, factory: RunnerFactory) -> "_BrowserBaseRunner":
+        """
+        Return a runner for ``runtime``, taken from the pool if possible.
+        ``factory`` is used to boot the runners that refill the pool.
+        """
+        runners = self._runners.setdefault(runtime, deque())
+        future = runners.popleft() if runners else None
+        self._fill(runtime, factory)
+
+        if future is not None and future.done():
+            self.hits += 1
+        else:
+            self.misses += 1
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                # Boot again in the foreground so that the error is reported
+                # by the test that needs the runner.
+                pass
+        return factory()
+
+    def release(self, runner: "_BrowserBaseRunner"):
+        """Shut a runner down in the background."""
+        self._executor.submit(runner.quit)
+
+    @contextlib.contextmanager
+    def runner(
+        self, runtime: str, factory: RunnerFactory
+    ) -> Iterator["_BrowserBaseRunner"]:
+        runner = self.acquire(runtime, factory)
+        try:
+            yield runner
+        finally:
+            self.release(runner)
+
+    def close(self):
+        for runners in self._runners.values():
+            for future in runners:
+                if future.cancel():
+                    continue
+                try:
+                    future.result().quit()
+                except Exception:
+                    pass
+        self._runners.clear()
+        self._executor.shutdown(wait=True)
+
+    def summary(self) -> str:
+        return (
+            f"standalone runner pool (size {self.size}): "
+            f"{self.hits} hits, {self.misses} misses"
+        )
+
+
+def use_runner_pool(config: pytest.Config, runtime: str) -> bool:
+    """
+    Whether standalone runners for ``runtime`` can be booted in the pool.
+
+    Playwright objects must not be used from other threads and safari only
+    supports a single session at a time, so those always boot on demand.
+    """
+    return (
+        config.option.standalone_pool_size > 0
+        and config.option.runner.lower() != "playwright"
+        and runtime != "safari"
+    )
@@ -1,6 +1,5 @@
-import re
+import json
 import sys
-import xml.etree.ElementTree as ET
 from contextlib import AbstractContextManager
 from dataclasses import dataclass
 from pathlib import Path
@@ -12,6 +11,7 @@ if TYPE_CHECKING:
 T = TypeVar("T")
 
 import pytest
+from _pytest.reports import BaseReport, TestReport, pytest_report_from_serializable
 
 from .server import spawn_web_server
 
@@ -87,26 +87,145 @@ def get_browser_pyodide(request: pytest.FixtureRequest, runtime: str):
     return _seleniums[runtime].selenium.get_value()
 
 
-def _remove_pytest_capture_title(
-    capture_element: ET.Element | None, title_name: str
-) -> str | None:
+def _load_session_module(selenium):
+    # selenium.run doesn't load the packages imported by the code
+    selenium.load_package("pytest")
+    _pytest_session_in_pyodide = (
+        Path(__file__).parent / "_pytest_session_in_pyodide.py"
+    ).read_text()
+    selenium.run(f"""
+def temp():
+    from importlib.machinery import ModuleSpec
+    from importlib.util import module_from_spec
+
+    modname = "_pytest_pyodide_session"
+    mod = module_from_spec(ModuleSpec(modname, None))
+    exec({_pytest_session_in_pyodide!r}, mod.__dict__)
+
+    import sys
+
+    sys.modules[modname] = mod
+temp()
+del temp
+        """)
+
+
+def pyodide_test_reports(
+    node_tree_id: str, selenium: "_BrowserBaseRunner", session: bool = False
+) -> list[BaseReport]:
+    """Run a single test inside the pyodide runtime and return its reports.
+
+    The reports are serialized inside pyodide with the
+    pytest_report_to_serializable hook and rebuilt here, so they have the same
+    outcome, duration, longrepr and captured output as in pyodide. If
+    ``session`` is True, the test is run by a pytest session that is kept
+    alive inside pyodide, see run_test_in_pyodide_session.
     """
-    pytest captures (even in xml) have a title line
-    like ------ Capture out -------
+    # The test directory is mounted read-only on node, so pytest can't write
+    # its cache next to the tests
+    args = ["--color=no", "-p", "no:cacheprovider"]
+    if session:
+        call = f"run_test({node_tree_id!r}, {args!r})"
+    else:
+        call = f"run_main({[node_tree_id, *args]!r})"
+    code = f"""
+        import sys
+
+        _session_module = sys.modules.get("_pytest_pyodide_session")
+        _session_module and _session_module.{call}
+        """
+    result = selenium.run(code)
+    if result is None:
+        # First test in this pyodide
+        _load_session_module(selenium)
+        result = selenium.run(code)
+    reports = [pytest_report_from_serializable(data) for data in json.loads(result)]
+    return [report for report in reports if report is not None]
 
-    This helper removes that line.
+
+def _fails_test(report: BaseReport) -> bool:
+    # Only failures of the test itself and of its collection fail the test.
+    # Setup errors are ignored, tests that use fixtures which only exist on the
+    # host (like selenium) error in the setup.
+    return report.failed and getattr(report, "when", "collect") in ("collect", "call")
+
+
+def host_call_report(host_report: TestReport, reports: list[BaseReport]) -> TestReport:
+    """Turn the reports of a test run in pyodide into the report of the call
+    phase of the host item.
+
+    The first report that is skipped or fails the test (e.g. a skipped setup or
+    a failed call) decides the outcome, otherwise the report of the call. Its
+    outcome, longrepr, duration and xfail status are used as they are, the
+    captured output of the test in pyodide is added to the one of the host
+    item. Like with run_test_in_pyodide, the test passes if it errored in the
+    setup.
     """
-    if capture_element is None:
-        return None
-    capture_text = capture_element.text
-    if not capture_text:
-        return None
-    lines = capture_text.splitlines()
-    assert lines[0].find(" " + title_name + " ")
-    ret_data = "\n".join(lines[1:])
-    if re.search(r"\S", ret_data):
-        return ret_data
-    return None
+    report = next(
+        (report for report in reports if report.skipped or _fails_test(report)),
+        None,
+    )
+    if report is None:
+        report = next((report for report in reports if report.when == "call"), None)
+    if report is None and any(report.when == "setup" for report in reports):
+        return TestReport(
+            host_report.nodeid,
+            host_report.location,
+            host_report.keywords,
+            "passed",
+            None,
+            "call",
+            sections=host_report.sections,
+            duration=host_report.duration,
+            start=host_report.start,
+            stop=host_report.stop,
+            user_properties=host_report.user_properties,
+        )
+    if report is None:
+        return TestReport(
+            host_report.nodeid,
+            host_report.location,
+            host_report.keywords,
+            "failed",
+            "Test not found in pyodide",
+            "call",
+            sections=host_report.sections,
+        )
+    extra = {}
+    if hasattr(report, "wasxfail"):
+        extra["wasxfail"] = report.wasxfail
+    return TestReport(
+        host_report.nodeid,
+        host_report.location,
+        host_report.keywords,
+        report.outcome,
+        report.longrepr,
+        "call",
+        sections=[*host_report.sections, *report.sections],
+        duration=getattr(report, "duration", 0),
+        start=host_report.start,
+        stop=host_report.stop,
+        user_properties=[
+            *host_report.user_properties,
+            *getattr(report, "user_properties", []),
+        ],
+        **extra,
+    )
+
+
+def _check_reports(reports: list[BaseReport], ignore_fail: bool) -> bool:
+    for report in reports:
+        if not _fails_test(report):
+            continue
+        for name, content in report.sections:
+            if name.startswith("Captured stdout"):
+                print(content)
+            elif name.startswith("Captured stderr"):
+                sys.stderr.write(content)
+        if not ignore_fail:
+            pytest.fail(report.longreprtext, pytrace=False)
+        return False
+    return True
 
 
 def run_test_in_pyodide(node_tree_id, selenium, ignore_fail=False):
@@ -115,50 +234,37 @@ def run_test_in_pyodide(node_tree_id, selenium, ignore_fail=False):
     browser pyodide with the full node ID, which is the same
     as it is locally except for the test_files folder base.
 
-    It also has a little bit of cunning which reformats the output
-    from the pyodide call to pytest, so that test failures should look
-    roughly the same as they would when you are running pytest locally.
+    If the test fails, the captured output is printed and the test on the
+    host fails with the same message as the test in pyodide, so that test
+    failures look the same as they would when you are running pytest locally.
     """
-    all_args = [
-        node_tree_id,
-        "--color=no",
-        "--junitxml",
-        "test_output.xml",
-        "-o",
-        "junit_logging=out-err",
-    ]
-    ret_xml = selenium.run_async(
-        f"""
-        import pytest
-        retcode = pytest.main({all_args})
-
-        output_xml=""
-        with open("test_output.xml","r") as f:
-            output_xml=f.read()
-        output_xml
-        """
+    return _check_reports(pyodide_test_reports(node_tree_id, selenium), ignore_fail)
+
+
+def run_test_in_pyodide_session(node_tree_id, selenium, ignore_fail=False):
+    """Like run_test_in_pyodide, but the test is run by a pytest session that
+    is started once per runner and kept alive inside pyodide.
+
+    Each test module is collected only once and session and module scoped
+    fixtures are shared between the tests, like they would be when running
+    pytest locally.
+    """
+    return _check_reports(
+        pyodide_test_reports(node_tree_id, selenium, session=True), ignore_fail
     )
-    # get the error from junitxml
-    root = ET.fromstring(ret_xml)
-    fails = root.findall("*/testcase[failure]")
-    for fail in fails:
-        stdout = fail.find("./system-out")
-        stderr = fail.find("./system-err")
-        failure = fail.find("failure")
-        if failure is not None and failure.text:
-            fail_txt = failure.text
-        else:
-            fail_txt = ""
-        stdout_text = _remove_pytest_capture_title(stdout, "Captured Out")
-        stderr_text = _remove_pytest_capture_title(stderr, "Captured Err")
-        if stdout_text is not None:
-            print(stdout_text)
-        if stderr_text is not None:
-            sys.stderr.write(stderr_text)
-        if not ignore_fail:
-            pytest.fail(fail_txt, pytrace=False)
-        return False
-    return True
+
+
+def _finish_pyodide_session(selenium):
+    try:
+        selenium.run("""
+            import sys
+
+            if "_pytest_pyodide_session" in sys.modules:
+                sys.modules["_pytest_pyodide_session"].finish_session()
+            """)
+    except Exception:
+        # The session teardown is best effort, the browser is closed anyway
+        pass
 
 
 def close_pyodide_browsers():
@@ -170,5 +276,6 @@ def close_pyodide_browsers():
     """
     global _seleniums, _playwright_browser_list, _playwright_browser_generator
     for x in _seleniums.values():
+        _finish_pyodide_session(x.selenium.get_value())
         x.selenium.close()
     _seleniums.clear()
@@ -1,12 +1,23 @@
+import atexit
 import json
 import os
+import queue
+import socket
+import struct
+import subprocess
+import sys
 import textwrap
+import threading
+import tty
+from collections.abc import Callable, Sequence
 from pathlib import Path
+from typing import Any
 
 import pexpect
 import pytest
 
 from .config import RUNTIMES, get_global_config
+from .copy_files_to_pyodide import CopyIndex
 from .hook import pytest_wrapper
 
 TEST_SETUP_CODE = """
@@ -88,6 +99,82 @@ globalThis.assertThrowsAsync = async function (cb, errname, pattern) {
 };
 """.strip()
 
+# Registry of the functions registered with ``_BrowserBaseRunner.prepare``.
+# They are compiled once per page, so calling one of them only transfers its
+# name and arguments.
+PREPARED_FUNCTIONS_CODE = """
+(() => {
+    const AsyncFunction = (async () => {}).constructor;
+
+    function checkPyodide() {
+        if(globalThis.pyodide && pyodide._module && pyodide._module._PyErr_Occurred()){
+            try {
+                pyodide._module._pythonexc2js();
+            } catch(e){
+                console.error(`Python exited with error flag set! Error was:\n${e.message}`);
+                // Don't put original error message in new one: we want
+                // "pytest.raises(xxx, match=msg)" to fail
+                throw new Error(`Python exited with error flag set!`);
+            }
+        }
+    }
+
+    const functions = {
+        $define(name, params, body) {
+            functions[name] = new AsyncFunction(...params, body);
+        },
+        $runJs(code) {
+            return new AsyncFunction(code)();
+        },
+    };
+
+    // Calls a function and throws on errors
+    async function run(name, args, pyodideChecks) {
+        if (!Object.hasOwn(functions, name)) {
+            throw new Error(`Unknown prepared function: ${name}`);
+        }
+        const result = await functions[name](...args);
+        if (pyodideChecks) {
+            checkPyodide();
+        }
+        return result;
+    }
+
+    // Calls a function and returns [0, result] or [1, error, stack, message]
+    async function call(name, args, pyodideChecks) {
+        try {
+            return [0, await run(name, args, pyodideChecks)];
+        } catch (e) {
+            return [1, e.toString(), e.stack, e.message];
+        }
+    }
+
+    globalThis.__pytestPyodide = { functions, run, call };
+})();
+""".strip()
+
+
+# load_package calls of all runners, and how many of them were skipped because
+# the packages were already loaded
+LOAD_PACKAGE_STATS = {"calls": 0, "skipped": 0}
+
+# References of PyodideHandles that were released by all runners, and in how
+# many batches
+HANDLE_RELEASE_STATS = {"released": 0, "flushes": 0}
+
+
+class _PreparedFunctionsMissing(Exception):
+    """The page was reloaded or left, the prepared functions are gone"""
+
+
+def _unpack_call_result(retval):
+    """Unpack the result of ``__pytestPyodide.call``"""
+    if retval is None:
+        raise _PreparedFunctionsMissing()
+    if retval[0] == 0:
+        return retval[1]
+    raise JavascriptException(retval[1], retval[2])
+
 
 class JavascriptException(Exception):
     def __init__(self, msg, stack):
@@ -114,6 +201,129 @@ class _BrowserBaseRunner:
     pyodide._api.inTestHoist = true; // improve some error messages for tests
     """
 
+    # Functions that are prepared on every page: name -> (params, body)
+    PREPARED_FUNCTIONS: dict[str, tuple[list[str], str]] = {
+        "run": (
+            ["code", "releases"],
+            """
+            for (const ptr of releases) pyodide._module._Py_DecRef(ptr);
+            let result = pyodide.runPython(code);
+            return pyodide.$handleTestResult(result);
+            """,
+        ),
+        "runAsync": (
+            ["code", "releases"],
+            """
+            for (const ptr of releases) pyodide._module._Py_DecRef(ptr);
+            await pyodide.loadPackagesFromImports(code);
+            let result = await pyodide.runPythonAsync(code);
+            return pyodide.$handleTestResult(result);
+            """,
+        ),
+        "loadPackage": (
+            ["packages"],
+            """
+            const errors = [];
+            try {
+                await pyodide.loadPackage(packages, {
+                    errorCallback: (msg) => { errors.push(msg); },
+                });
+            } catch (e) {
+                errors.push(e.message || String(e));
+            }
+            return [errors, Object.keys(pyodide.loadedPackages || {})];
+            """,
+        ),
+        "createLazyFiles": (
+            ["files", "chunkSize"],
+            """
+            const FS = pyodide.FS;
+            if (typeof XMLHttpRequest === "undefined") {
+                throw new Error("Lazy files need a synchronous XMLHttpRequest");
+            }
+            const inWorker = typeof WorkerGlobalScope !== "undefined";
+
+            function fetchRange(url, start, end) {
+                const xhr = new XMLHttpRequest();
+                xhr.open("GET", url, false);
+                xhr.setRequestHeader("Range", `bytes=${start}-${end - 1}`);
+                if (inWorker) {
+                    xhr.responseType = "arraybuffer";
+                } else {
+                    // Synchronous requests on the main thread can only
+                    // return text, this keeps every byte in a character
+                    xhr.overrideMimeType("text/plain; charset=x-user-defined");
+                }
+                xhr.send(null);
+                if (xhr.status !== 200 && xhr.status !== 206) {
+                    throw new FS.ErrnoError(29); // EIO
+                }
+                let data;
+                if (inWorker) {
+                    data = new Uint8Array(xhr.response);
+                } else {
+                    const text = xhr.responseText;
+                    data = new Uint8Array(text.length);
+                    for (let i = 0; i < text.length; i++) {
+                        data[i] = text.charCodeAt(i) & 0xff;
+                    }
+                }
+                // A server that ignores the range sends the whole file
+                return xhr.status === 200 ? data.subarray(start, end) : data;
+            }
+
+            for (let [url, dest, size] of files) {
+                if (!dest.startsWith("/")) {
+                    dest = `${FS.cwd()}/${dest}`;
+                }
+                const slash = dest.lastIndexOf("/");
+                const parent = dest.substring(0, slash) || "/";
+                FS.mkdirTree(parent);
+                try {
+                    FS.unlink(dest);
+                } catch (e) {}
+
+                // The chunks that have been read, by index
+                const chunks = new Map();
+                function getChunk(idx) {
+                    if (!chunks.has(idx)) {
+                        const start = idx * chunkSize;
+                        const end = Math.min(start + chunkSize, size);
+                        chunks.set(idx, fetchRange(url, start, end));
+                    }
+                    return chunks.get(idx);
+                }
+
+                const node = FS.createFile(parent, dest.substring(slash + 1), {}, true, false);
+                Object.defineProperty(node, "usedBytes", { get: () => size });
+                node.stream_ops = {
+                    ...node.stream_ops,
+                    read(stream, buffer, offset, length, position) {
+                        const count = Math.max(Math.min(length, size - position), 0);
+                        let done = 0;
+                        while (done < count) {
+                            const pos = position + done;
+                            const idx = Math.floor(pos / chunkSize);
+                            const chunk = getChunk(idx);
+                            const from = pos - idx * chunkSize;
+                            const part = chunk.subarray(from, from + count - done);
+                            if (part.length === 0) {
+                                throw new FS.ErrnoError(29); // EIO
+                            }
+                            buffer.set(part, offset + done);
+                            done += part.length;
+                        }
+                        return count;
+                    },
+                    mmap() {
+                        throw new FS.ErrnoError(43); // ENODEV
+                    },
+                };
+            }
+            """,
+        ),
+    }
+
     def __init__(
         self,
         server_port,
@@ -122,9 +332,18 @@ class _BrowserBaseRunner:
         load_pyodide=True,
         dist_dir=None,
         jspi=False,
+        snapshot=None,
         **kwargs,
     ):
         self._config = get_global_config()
+        self._prepared = dict(self.PREPARED_FUNCTIONS)
+        # Packages known to be loaded in the current Pyodide, see load_package
+        self._loaded_packages: set[str] = set()
+        self.load_package_skips = 0
+        # Pointers of collected PyodideHandles, see release_handle
+        self._pending_releases: list[int] = []
+        # Files copied to the emscripten file system, see copy_files_to_pyodide
+        self.copy_index = CopyIndex()
 
         self.server_port = server_port
         self.server_hostname = server_hostname
@@ -132,6 +351,8 @@ class _BrowserBaseRunner:
         self.server_log = server_log
         self.dist_dir = dist_dir
         self.jspi = jspi
+        # URL of a memory snapshot that Pyodide is booted from, see snapshot.py
+        self.snapshot = snapshot
         self.driver = self.get_driver(jspi)
 
         self.set_script_timeout(self.script_timeout)
@@ -165,19 +386,95 @@ class _BrowserBaseRunner:
         self.goto(f"{self.base_url}/module_test.html")
 
     def javascript_setup(self):
-        self.run_js(
-            TEST_SETUP_CODE,
-            pyodide_checks=False,
+        # A new page, nothing is loaded or copied yet and old pointers are
+        # meaningless
+        self._loaded_packages.clear()
+        self._pending_releases = []
+        self.copy_index.clear()
+        definitions = "\n".join(
+            "__pytestPyodide.functions.$define({});".format(
+                ", ".join(json.dumps(x) for x in (name, params, body))
+            )
+            for name, (params, body) in self._prepared.items()
+        )
+        self.run_js_inner(
+            "\n".join([TEST_SETUP_CODE, PREPARED_FUNCTIONS_CODE, definitions]), ""
         )
 
-    def load_pyodide(self):
-        self.run_js(
+    def prepare(self, name: str, body: str, params: Sequence[str] = ()):
+        """Register the body of an async JavaScript function as ``name``.
+
+        The function is compiled once per page (and again after the page is
+        reloaded) and can then be called with ``call``, which only sends the
+        arguments.
+        """
+        if body.startswith("\n"):
+            body = textwrap.dedent(body)
+        self._prepared[name] = (list(params), body)
+        self.call("$define", name, list(params), body, pyodide_checks=False)
+
+    def call(self, name: str, *args: Any, pyodide_checks: bool = True) -> Any:
+        """Call a function registered with ``prepare``.
+
+        The arguments and the return value must be JSON serializable.
+        """
+        try:
+            return self.call_inner(name, list(args), pyodide_checks)
+        except _PreparedFunctionsMissing:
+            # e.g. after the test navigated to another page
+            self.javascript_setup()
+            return self.call_inner(name, list(args), pyodide_checks)
+
+    def call_inner(self, name: str, args: list[Any], pyodide_checks: bool) -> Any:
+        return self.run_js_inner(
+            "return await __pytestPyodide.run({});".format(
+                ", ".join(json.dumps(x) for x in (name, args, pyodide_checks))
+            ),
+            "",
+        )
+
+    def _load_pyodide_script(self, **options):
+        """
+        Return the script that loads Pyodide, with ``options`` added to the
+        options that the configured load script passes to ``loadPyodide``
+        """
+        script = (
             self._config.get_load_pyodide_script(self.browser)
             + self.POST_LOAD_PYODIDE_SCRIPT
         )
+        if not options:
+            return script
+
+        extra_options = ", ".join(f"{k}: {v}" for k, v in options.items())
+        return f"""
+            const __loadPyodide = loadPyodide;
+            globalThis.loadPyodide = (options = {{}}) =>
+                __loadPyodide({{ ...options, {extra_options} }});
+            try {{
+                {script}
+            }} finally {{
+                globalThis.loadPyodide = __loadPyodide;
+            }}
+            """
 
-    def initialize_pyodide(self):
-        self.run_js(
+    def load_pyodide(self):
+        if self.snapshot:
+            self.run_js(
+                self._load_pyodide_script(
+                    _loadSnapshot=f"fetch({self.snapshot!r}).then((r) => r.arrayBuffer())"
+                )
+            )
+        else:
+            self.run_js(self._load_pyodide_script())
+
+    def install_test_result_handler(self) -> bool:
+        """
+        Install ``pyodide.$handleTestResult``.
+
+        Returns whether the decorator module is already present, which is the
+        case if Pyodide was booted from a memory snapshot.
+        """
+        return self.run_js(  # type: ignore[no-any-return]
             """
             let isPyProxy;
             if(pyodide.ffi) {
@@ -196,12 +493,43 @@ class _BrowserBaseRunner:
                 result.destroy();
                 return converted_result;
             }
+            return pyodide.runPython(
+                "import sys; 'pytest_pyodide.decorator' in sys.modules"
+            );
             """
         )
+
+    def initialize_pyodide(self):
+        has_decorator = self.install_test_result_handler()
         self.run_js(self._config.get_initialize_script())
+        if not has_decorator:
+            from .decorator import initialize_decorator
+
+            initialize_decorator(self)
+
+    def make_memory_snapshot(self, url: str, packages: list[str] | None = None):
+        """
+        Boot a Pyodide that can be serialized, install the decorator module
+        and ``packages`` and upload the memory snapshot to ``url``.
+
+        ``url`` must be in the scratch directory of the web server.
+        """
         from .decorator import initialize_decorator
 
+        self.run_js(self._load_pyodide_script(_makeSnapshot="true"))
+        self.install_test_result_handler()
         initialize_decorator(self)
+        if packages:
+            self.load_package(packages)
+        self.run_js(
+            f"""
+            const snapshot = pyodide.makeMemorySnapshot();
+            const response = await fetch({url!r}, {{ method: "PUT", body: snapshot }});
+            if (!response.ok) {{
+                throw new Error(`Failed to upload memory snapshot: ${{response.status}}`);
+            }}
+            """
+        )
 
     @property
     def pyodide_loaded(self):
@@ -218,21 +546,10 @@ class _BrowserBaseRunner:
         self.run_js("self.logs = []", pyodide_checks=False)
 
     def run(self, code):
-        return self.run_js(
-            f"""
-            let result = pyodide.runPython({code!r});
-            return pyodide.$handleTestResult(result);
-            """
-        )
+        return self.call("run", code, self._take_releases())
 
     def run_async(self, code):
-        return self.run_js(
-            f"""
-            await pyodide.loadPackagesFromImports({code!r})
-            let result = await pyodide.runPythonAsync({code!r});
-            return pyodide.$handleTestResult(result);
-            """
-        )
+        return self.call("runAsync", code, self._take_releases())
 
     def run_js(self, code, pyodide_checks=True):
         """Run JavaScript code and check for pyodide errors"""
@@ -240,22 +557,38 @@ class _BrowserBaseRunner:
             # we have a multiline string, fix indentation
             code = textwrap.dedent(code)
 
-        if pyodide_checks:
-            check_code = """
-                    if(globalThis.pyodide && pyodide._module && pyodide._module._PyErr_Occurred()){
-                        try {
-                            pyodide._module._pythonexc2js();
-                        } catch(e){
-                            console.error(`Python exited with error flag set! Error was:\n${e.message}`);
-                            // Don't put original error message in new one: we want
-                            // "pytest.raises(xxx, match=msg)" to fail
-                            throw new Error(`Python exited with error flag set!`);
-                        }
-                    }
-           """
-        else:
-            check_code = ""
-        return self.run_js_inner(code, check_code)
+        return self.call(
+            "$runJs", self._take_release_code() + code, pyodide_checks=pyodide_checks
+        )
+
+    def release_handle(self, ptr: int):
+        """
+        Release the reference held by a PyodideHandle. This is called by the
+        finalizer of the handle, so rather than making a round trip, the
+        pointer is queued and released with the next run_js, run or run_async
+        call or by flush_handle_releases at the end of the test.
+        """
+        self._pending_releases.append(ptr)
+
+    def _take_releases(self) -> list[int]:
+        ptrs, self._pending_releases = self._pending_releases, []
+        if ptrs:
+            HANDLE_RELEASE_STATS["released"] += len(ptrs)
+            HANDLE_RELEASE_STATS["flushes"] += 1
+        return ptrs
+
+    def _take_release_code(self) -> str:
+        ptrs = self._take_releases()
+        if not ptrs:
+            return ""
+        ptrs_json = json.dumps(ptrs)
+        return f"for (const ptr of {ptrs_json}) pyodide._module._Py_DecRef(ptr);\n"
+
+    def flush_handle_releases(self):
+        """Release the references of all collected PyodideHandles now"""
+        code = self._take_release_code()
+        if code:
+            self.call("$runJs", code, pyodide_checks=False)
 
     def get_num_hiwire_keys(self):
         return self.run_js("return pyodide._module.hiwire.num_keys();")
@@ -271,6 +604,7 @@ class _BrowserBaseRunner:
         self.run_js("self.__savedState = pyodide._api.saveState();")
 
     def restore_state(self):
+        self._loaded_packages.clear()
         self.run_js(
             """
             if(self.__savedState){
@@ -317,6 +651,19 @@ class _BrowserBaseRunner:
             pyodide_checks=False,
         )
 
+    def create_lazy_files(self, files, chunk_size):
+        """Create read-only files in the emscripten file system whose content
+        is fetched from a web server when it is read. ``files`` are (url,
+        dest, size) triples. The files are fetched in chunks of
+        ``chunk_size`` bytes with HTTP Range requests, and each chunk is
+        fetched once.
+        """
+        self.call(
+            "createLazyFiles",
+            [[url, str(dest), size] for url, dest, size in files],
+            chunk_size,
+        )
+
     def load_package(self, packages):
         # Pyodide's ``loadPackage`` reports failures in two different ways:
         #
@@ -332,23 +679,20 @@ class _BrowserBaseRunner:
         # single ``RuntimeError`` raised at the call site so load failures
         # are always reported immediately and with the problematic package
         # reference in the message.
-        result = self.run_js(
-            f"""
-            const __errors = [];
-            try {{
-                await pyodide.loadPackage({packages!r}, {{
-                    errorCallback: (msg) => {{ __errors.push(msg); }},
-                }});
-            }} catch (e) {{
-                __errors.push(e.message || String(e));
-            }}
-            return __errors;
-            """
-        )
-        if result:
+        LOAD_PACKAGE_STATS["calls"] += 1
+        names = [packages] if isinstance(packages, str) else packages
+        if self._loaded_packages.issuperset(names):
+            # Nothing new to load, save the round trip
+            self.load_package_skips += 1
+            LOAD_PACKAGE_STATS["skipped"] += 1
+            return
+
+        errors, loaded = self.call("loadPackage", packages)
+        self._loaded_packages.update(loaded)
+        if errors:
             raise RuntimeError(
                 "pyodide.loadPackage({!r}) reported errors:\n  {}".format(
-                    packages, "\n  ".join(result)
+                    packages, "\n  ".join(errors)
                 )
             )
 
@@ -364,6 +708,7 @@ class _SeleniumBaseRunner(_BrowserBaseRunner):
         self.script_timeout = timeout
 
     def quit(self):
+        self.copy_index.clear()
         self.driver.quit()
 
     def refresh(self):
@@ -390,6 +735,25 @@ class _SeleniumBaseRunner(_BrowserBaseRunner):
         print("JavascriptException message: ", retval[3])
         raise JavascriptException(retval[1], retval[2])
 
+    # The same script is sent for every call, so the browser only compiles it
+    # once.
+    CALL_SCRIPT = """
+        const [name, args, pyodideChecks, cb] = arguments;
+        if (!globalThis.__pytestPyodide) {
+            cb(null);
+            return;
+        }
+        globalThis.__pytestPyodide.call(name, args, pyodideChecks).then(cb);
+    """
+
+    def call_inner(self, name, args, pyodide_checks):
+        retval = self.driver.execute_async_script(
+            self.CALL_SCRIPT, name, args, pyodide_checks
+        )
+        if retval is not None and retval[0] != 0:
+            print("JavascriptException message: ", retval[3])
+        return _unpack_call_result(retval)
+
     @property
     def urls(self):
         for handle in self.driver.window_handles:
@@ -417,6 +781,7 @@ class _PlaywrightBaseRunner(_BrowserBaseRunner):
         self.driver.set_default_timeout(timeout * 1000)
 
     def quit(self):
+        self.copy_index.clear()
         self.driver.close()
 
     def refresh(self):
@@ -443,6 +808,16 @@ class _PlaywrightBaseRunner(_BrowserBaseRunner):
             return retval[1]
         raise JavascriptException(retval[1], retval[2])
 
+    CALL_SCRIPT = """
+        ([name, args, pyodideChecks]) => globalThis.__pytestPyodide
+            ? globalThis.__pytestPyodide.call(name, args, pyodideChecks)
+            : null
+    """
+
+    def call_inner(self, name, args, pyodide_checks):
+        retval = self.driver.evaluate(self.CALL_SCRIPT, [name, args, pyodide_checks])
+        return _unpack_call_result(retval)
+
 
 class SeleniumFirefoxRunner(_SeleniumBaseRunner):
     browser = "firefox"
@@ -559,6 +934,15 @@ class _BrowserWorkerRunnerMixin(_BrowserBaseRunner):
 
     def prepare_driver(self):
         super().prepare_driver()
+        self._start_worker()
+
+    def javascript_setup(self):
+        # After the page was reloaded, the worker is gone as well
+        if not super().run_js_inner("return !!self.__workerCall;", ""):
+            self._start_worker()
+        super().javascript_setup()
+
+    def _start_worker(self):
         # Boot a persistent worker on the page and install a small RPC
         # helper (``self.__workerCall``) that returns a promise resolved
         # with the worker's response for a given message id.
@@ -590,11 +974,13 @@ class _BrowserWorkerRunnerMixin(_BrowserBaseRunner):
                     entry({{ id, ...err }});
                 }}
             }};
-            self.__workerCall = function (code) {{
+            // ``message`` is either {{ code }} or a call of a prepared
+            // function: {{ name, args, pyodideChecks }}
+            self.__workerCall = function (message) {{
                 const id = self.__workerNextId++;
                 return new Promise((resolve) => {{
                     self.__workerPending.set(id, resolve);
-                    worker.postMessage({{ id, code }});
+                    worker.postMessage({{ id, ...message }});
                 }});
             }};
         """
@@ -614,7 +1000,7 @@ class _BrowserWorkerRunnerMixin(_BrowserBaseRunner):
             return __result;
         """
         wrapper = f"""
-            const __res = await self.__workerCall({worker_body!r});
+            const __res = await self.__workerCall({{ code: {worker_body!r} }});
             if (__res.ok) {{
                 return __res.result;
             }}
@@ -625,6 +1011,18 @@ class _BrowserWorkerRunnerMixin(_BrowserBaseRunner):
         # check_code here is run on the page. We already handled it in worker_body
         return super().run_js_inner(wrapper, "")
 
+    # The prepared functions live in the worker, see module_webworker_runner.js
+    CALL_SCRIPT = """
+        const [name, args, pyodideChecks, cb] = arguments;
+        if (!self.__workerCall) {
+            cb(null);
+            return;
+        }
+        self.__workerCall({ name, args, pyodideChecks }).then((res) =>
+            cb(res.ok ? res.result : [1, res.error, res.stack, res.message])
+        );
+    """
+
 
 class BrowserWorkerChromeRunner(_BrowserWorkerRunnerMixin, SeleniumChromeRunner):
     pass
@@ -650,19 +1048,257 @@ class PlaywrightFirefoxRunner(_PlaywrightBaseRunner):
     browser = "firefox"
 
 
+# See writeFrame / readFrames in node_test_driver.js for the frame layout.
+NODE_FRAME_MAGIC = b"\x1bPYF"
+NODE_FRAME_HEADER = struct.Struct(">cII")  # kind, id, payload length
+
+
+# Written by node_test_driver.js to stdout and stderr, followed by a frame id,
+# in the pipe transport, see NodeRunner._wait_for_logs
+NODE_LOG_DRAIN_MARKER = "\x1bPYD"
+
+
+def _pack_frame(kind: bytes, frame_id: int, payload: bytes) -> bytes:
+    return (
+        NODE_FRAME_MAGIC
+        + NODE_FRAME_HEADER.pack(kind, frame_id, len(payload))
+        + payload
+    )
+
+
+def _take_frame(buf: bytearray) -> tuple[bytes, bytes, int, bytes] | None:
+    """Remove the first complete frame from buf.
+
+    Returns (output before the frame, kind, frame id, payload), or None if buf
+    doesn't hold a complete frame yet.
+    """
+    start = buf.find(NODE_FRAME_MAGIC)
+    header_end = start + len(NODE_FRAME_MAGIC) + NODE_FRAME_HEADER.size
+    if start < 0 or len(buf) < header_end:
+        return None
+    kind, frame_id, size = NODE_FRAME_HEADER.unpack(
+        buf[start + len(NODE_FRAME_MAGIC) : header_end]
+    )
+    if len(buf) < header_end + size:
+        return None
+    before = bytes(buf[:start])
+    payload = bytes(buf[header_end : header_end + size])
+    del buf[: header_end + size]
+    return before, kind, frame_id, payload
+
+
+def _decode_node_reply(kind: bytes, payload: bytes) -> Any:
+    if kind == b"J":
+        return json.loads(payload)
+    if kind == b"B":
+        return payload
+    raise JavascriptException("", payload.decode())
+
+
+class _NodeThreadHost:
+    """A node_test_driver.js process that hosts one Pyodide per worker thread.
+
+    All the workers instantiate Pyodide from a single compiled
+    ``WebAssembly.Module``, so every additional interpreter costs neither a
+    process startup nor a wasm compilation. Frames are multiplexed over one
+    socketpair: requests are matched with their replies by frame id, and "L"
+    frames carry console output of the worker whose id is in the frame id
+    field.
+    """
+
+    def __init__(self, cmd: list[str], env: dict[str, str]):
+        self._channel, driver_end = socket.socketpair()
+        env = env | {"PYTEST_PYODIDE_NODE_TEST_DRIVER_FD": str(driver_end.fileno())}
+        try:
+            self.process = subprocess.Popen(
+                cmd,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                pass_fds=[driver_end.fileno()],
+            )
+        finally:
+            driver_end.close()
+        # Console output that doesn't belong to any worker
+        self.logs: list[str] = []
+        self._log_handlers: dict[int, Callable[[str], None]] = {}
+        self._lock = threading.Lock()
+        self._frame_id = 0
+        ready: queue.Queue[tuple[bytes, bytes]] = queue.Queue(maxsize=1)
+        self._replies: dict[int, queue.Queue[tuple[bytes, bytes]]] = {0: ready}
+        for target in (self._read_frames, self._collect_logs):
+            threading.Thread(target=target, daemon=True).start()
+        try:
+            kind, _ = ready.get(timeout=60)
+        except queue.Empty:
+            kind = b"E"
+        if kind != b"R":
+            self.close()
+            raise JavascriptException("", "\n".join(self.logs))
+
+    def _collect_logs(self):
+        assert self.process.stdout
+        for line in iter(self.process.stdout.readline, b""):
+            self.logs.append(line.decode(errors="replace").removesuffix("\n"))
+
+    def _read_frames(self):
+        buf = bytearray()
+        while chunk := self._channel.recv(1 << 16):
+            buf += chunk
+            while (frame := _take_frame(buf)) is not None:
+                _, kind, frame_id, payload = frame
+                if kind == b"L":
+                    handler = self._log_handlers.get(frame_id)
+                    if handler:
+                        handler(payload.decode(errors="replace"))
+                    continue
+                reply = self._replies.pop(frame_id, None)
+                if reply:
+                    reply.put((kind, payload))
+        # The driver went away, fail everything that is still waiting
+        for reply in list(self._replies.values()):
+            reply.put((b"E", b"node_test_driver.js exited"))
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def request(self, kind: bytes, payload: bytes, timeout: float) -> Any:
+        reply: queue.Queue[tuple[bytes, bytes]] = queue.Queue(maxsize=1)
+        with self._lock:
+            self._frame_id += 1
+            frame_id = self._frame_id
+            self._replies[frame_id] = reply
+            self._channel.sendall(_pack_frame(kind, frame_id, payload))
+        try:
+            return _decode_node_reply(*reply.get(timeout=timeout))
+        except queue.Empty:
+            self._replies.pop(frame_id, None)
+            raise TimeoutError(
+                f"node_test_driver.js didn't reply within {timeout} seconds"
+            ) from None
+
+    def start_worker(self, log_handler: Callable[[str], None]) -> int:
+        worker_id: int = self.request(b"W", b"", timeout=60)
+        self._log_handlers[worker_id] = log_handler
+        return worker_id
+
+    def stop_worker(self, worker_id: int):
+        self._log_handlers.pop(worker_id, None)
+        self.request(b"K", struct.pack(">I", worker_id), timeout=60)
+
+    def run_js(self, worker_id: int, code: str, timeout: float) -> Any:
+        return self.request(
+            b"C", struct.pack(">I", worker_id) + code.encode(), timeout=timeout
+        )
+
+    def close(self):
+        self._channel.close()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+_NODE_THREAD_HOSTS: dict[tuple[str, ...], _NodeThreadHost] = {}
+# Runners may be booted from several threads, see pool.py
+_NODE_THREAD_HOSTS_LOCK = threading.Lock()
+
+
+def _get_node_thread_host(cmd: list[str], env: dict[str, str]) -> _NodeThreadHost:
+    key = tuple(cmd)
+    with _NODE_THREAD_HOSTS_LOCK:
+        host = _NODE_THREAD_HOSTS.get(key)
+        if host is None or not host.alive:
+            host = _NODE_THREAD_HOSTS[key] = _NodeThreadHost(cmd, env)
+            atexit.register(host.close)
+    return host
+
+
 class NodeRunner(_BrowserBaseRunner):
     browser = "node"
     runner = "node"
 
+    PREPARED_FUNCTIONS = {
+        **_BrowserBaseRunner.PREPARED_FUNCTIONS,
+        "mountHostDirectory": (
+            ["hostPath", "dest", "readonly"],
+            """
+            const FS = pyodide.FS;
+            if (!FS.$readonlyMounts) {
+                // Opening files for writing and creating or removing entries
+                // in a read-only mount fails with EROFS
+                const readonlyMounts = new Set();
+                const nodePermissions = FS.nodePermissions;
+                FS.nodePermissions = function (node, perms) {
+                    if (perms.includes("w") && readonlyMounts.has(node.mount)) {
+                        return 69; // EROFS
+                    }
+                    return nodePermissions.call(this, node, perms);
+                };
+                FS.$readonlyMounts = readonlyMounts;
+            }
+            if (!dest.startsWith("/")) {
+                dest = `${FS.cwd()}/${dest}`;
+            }
+            FS.mkdirTree(dest);
+            const root = FS.mount(FS.filesystems.NODEFS, { root: hostPath }, dest);
+            if (readonly) {
+                FS.$readonlyMounts.add(root.mount);
+            }
+            """,
+        ),
+        "linkHostFiles": (
+            ["links"],
+            """
+            const FS = pyodide.FS;
+            for (let [target, dest] of links) {
+                if (!dest.startsWith("/")) {
+                    dest = `${FS.cwd()}/${dest}`;
+                }
+                const parent = dest.substring(0, dest.lastIndexOf("/"));
+                if (parent) {
+                    FS.mkdirTree(parent);
+                }
+                try {
+                    FS.unlink(dest);
+                } catch (e) {}
+                FS.symlink(target, dest);
+            }
+            """,
+        ),
+    }
+
+    def mount_host_directory(self, host_path, dest, readonly=True):
+        """Mount a directory of the host at ``dest`` in the emscripten file
+        system with NODEFS. Node reads the files straight from the host disk,
+        so nothing is copied. Unless ``readonly`` is False, Pyodide can't
+        modify the directory.
+        """
+        self.call("mountHostDirectory", str(Path(host_path).resolve()), dest, readonly)
+
+    def link_host_files(self, links):
+        """Create symlinks for (target, dest) pairs, replacing existing files"""
+        self.call("linkHostFiles", [[str(target), str(dest)] for target, dest in links])
+
     def init_node(self, jspi=False):
         curdir = Path(__file__).parent
         globals_str = json.dumps(self._config.get_node_extra_globals())
+        self._transport = self._config.get_node_transport()
+        # The pipe and threads transports carry nothing but frames
+        if self._transport == "pty":
+            self._protocol = self._config.get_node_protocol()
+        else:
+            self._protocol = "framed"
+        self._frame_id = 0
         env = os.environ.copy() | {
-            "PYTEST_PYODIDE_NODE_TEST_DRIVER_EXTRA_GLOBALS": globals_str
+            "PYTEST_PYODIDE_NODE_TEST_DRIVER_EXTRA_GLOBALS": globals_str,
+            "PYTEST_PYODIDE_NODE_TEST_DRIVER_PROTOCOL": (
+                "threads" if self._transport == "threads" else self._protocol
+            ),
         }
-        self.p = pexpect.spawn("/bin/bash", timeout=60, env=env)
-        self.p.setecho(False)
-        self.p.delaybeforesend = None
 
         node_version = pexpect.spawn("node --version").read().decode("utf-8")
         node_major = int(node_version.split(".")[0][1:])  # vAA.BB.CC -> AA
@@ -677,15 +1313,118 @@ class NodeRunner(_BrowserBaseRunner):
         if jspi:
             extra_args.append("--experimental-wasm-stack-switching")
 
-        self.p.sendline(
-            f"node --expose-gc {' '.join(extra_args)} {curdir}/node_test_driver.js {self.base_url} {self.dist_dir}",
-        )
+        cmd = [
+            "node",
+            "--expose-gc",
+            *extra_args,
+            f"{curdir}/node_test_driver.js",
+            self.base_url,
+            str(self.dist_dir),
+        ]
+        if self._transport == "threads":
+            self._thread_host = _get_node_thread_host(cmd, env)
+            self._worker_id = self._thread_host.start_worker(self._append_log)
+        elif self._transport == "pipe":
+            self._init_node_pipe(cmd, env)
+        else:
+            self._init_node_pty(cmd, env)
+
+    def _init_node_pty(self, cmd, env):
+        self.p = pexpect.spawn("/bin/bash", timeout=60, env=env)
+        self.p.setecho(False)
+        self.p.delaybeforesend = None
+
+        self.p.sendline(" ".join(cmd))
 
         try:
             self.p.expect_exact("READY!!")
         except (pexpect.exceptions.EOF, pexpect.exceptions.TIMEOUT):
             raise JavascriptException("", self.p.before.decode()) from None
 
+        if self._protocol == "framed":
+            # Frames are binary, so turn off all line discipline processing
+            # (canonical mode, echo, \n -> \r\n translation, ...) of the pty.
+            tty.setraw(self.p.child_fd)
+            # From now on we read from the pty ourselves instead of using
+            # pexpect's expect machinery.
+            self._frame_buffer = bytearray(self.p.buffer.lstrip(b"\r\n"))
+
+    def _init_node_pipe(self, cmd, env):
+        # Frames travel over one end of a socketpair which the driver receives
+        # as an extra file descriptor. stdout and stderr only carry console
+        # output, which we collect into the logs from background threads.
+        self._channel, driver_end = socket.socketpair()
+        env["PYTEST_PYODIDE_NODE_TEST_DRIVER_FD"] = str(driver_end.fileno())
+        self._frame_buffer = bytearray()
+        # The last frame id whose drain marker was read from stdout / stderr
+        self._drained_logs = [0, 0]
+        self._logs_drained = threading.Condition()
+        try:
+            self._process = subprocess.Popen(
+                cmd,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                pass_fds=[driver_end.fileno()],
+            )
+        finally:
+            driver_end.close()
+        self._log_threads = [
+            threading.Thread(
+                target=self._collect_logs, args=(stream, index), daemon=True
+            )
+            for index, stream in enumerate((self._process.stdout, self._process.stderr))
+        ]
+        for thread in self._log_threads:
+            thread.start()
+
+        try:
+            kind, _, _ = self._recv_frame(timeout=60)
+        except (EOFError, TimeoutError):
+            self._stop_node_pipe()
+            raise JavascriptException("", self.logs) from None
+        assert kind == b"R"
+
+    def _append_log(self, line: str):
+        self._logs.append(line)
+
+    def _collect_logs(self, stream, index):
+        for line in iter(stream.readline, b""):
+            text = line.decode(errors="replace").removesuffix("\n")
+            text, marker, frame_id = text.partition(NODE_LOG_DRAIN_MARKER)
+            if text or not marker:
+                self._append_log(text)
+            if marker:
+                with self._logs_drained:
+                    self._drained_logs[index] = int(frame_id)
+                    self._logs_drained.notify_all()
+        # No more output will come
+        with self._logs_drained:
+            self._drained_logs[index] = sys.maxsize
+            self._logs_drained.notify_all()
+
+    def _wait_for_logs(self, frame_id):
+        """Wait until the console output written before the reply to frame_id
+        has been collected. The output arrives over stdout and stderr, which
+        are read by other threads than the replies.
+        """
+        with self._logs_drained:
+            self._logs_drained.wait_for(
+                lambda: min(self._drained_logs) >= frame_id,
+                timeout=self.script_timeout,
+            )
+
+    def _stop_node_pipe(self):
+        self._channel.close()
+        try:
+            self._process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        for thread in self._log_threads:
+            thread.join()
+
     def get_driver(self, jspi=False):
         self._logs = []
         self.init_node(jspi)
@@ -703,7 +1442,17 @@ class NodeRunner(_BrowserBaseRunner):
         self.script_timeout = timeout
 
     def quit(self):
-        self.p.sendeof()
+        self.copy_index.clear()
+        if self._transport == "threads":
+            self._thread_host.stop_worker(self._worker_id)
+        elif self._transport == "pipe":
+            self._send_frame(b"Q", b"")
+            self._stop_node_pipe()
+        elif self._protocol == "framed":
+            self._send_frame(b"Q", b"")
+            self.p.close(force=True)
+        else:
+            self.p.sendeof()
 
     def refresh(self):
         self.quit()
@@ -720,6 +1469,68 @@ class NodeRunner(_BrowserBaseRunner):
     def clean_logs(self):
         self._logs = []
 
+    def _send_frame(self, kind: bytes, payload: bytes) -> int:
+        self._frame_id += 1
+        data = memoryview(_pack_frame(kind, self._frame_id, payload))
+        if self._transport == "pipe":
+            self._channel.sendall(data)
+            return self._frame_id
+        # os.write may write only part of the data if the pty buffer is full
+        while data:
+            data = data[os.write(self.p.child_fd, data) :]
+        return self._frame_id
+
+    def _fill_frame_buffer(self, timeout):
+        # Every transport raises TimeoutError, like _NodeThreadHost.request
+        try:
+            if self._transport == "pipe":
+                self._channel.settimeout(timeout)
+                chunk = self._channel.recv(1 << 16)
+            else:
+                chunk = self.p.read_nonblocking(1 << 16, timeout=timeout)
+        except (TimeoutError, pexpect.exceptions.TIMEOUT):
+            raise TimeoutError(
+                f"node_test_driver.js didn't reply within {timeout} seconds"
+            ) from None
+        except pexpect.exceptions.EOF:
+            chunk = b""
+        if not chunk:
+            raise EOFError("node_test_driver.js closed the connection")
+        self._frame_buffer += chunk
+
+    def _recv_frame(self, timeout=None) -> tuple[bytes, int, bytes]:
+        if timeout is None:
+            timeout = self.script_timeout
+        while (frame := _take_frame(self._frame_buffer)) is None:
+            self._fill_frame_buffer(timeout)
+        before, kind, frame_id, payload = frame
+        # Anything written to stdout before the frame is console output
+        if before:
+            self._append_log(before.decode(errors="replace").removesuffix("\n"))
+        return kind, frame_id, payload
+
+    def _run_js_framed(self, wrapped):
+        if self._transport == "threads":
+            return self._thread_host.run_js(
+                self._worker_id, wrapped, timeout=self.script_timeout
+            )
+        frame_id = self._send_frame(b"C", wrapped.encode())
+        kind, reply_id, payload = self._recv_frame()
+        # Replies to earlier calls that timed out arrive late, skip them
+        while reply_id < frame_id:
+            kind, reply_id, payload = self._recv_frame()
+        if reply_id != frame_id:
+            raise RuntimeError(
+                f"Expected reply to frame {frame_id} but got reply to {reply_id}"
+            )
+        if self._transport == "pipe":
+            self._wait_for_logs(frame_id)
+        return _decode_node_reply(kind, payload)
+
+    def call_inner(self, name, args, pyodide_checks):
+        # The node runner never ran the pyodide checks
+        return super().call_inner(name, args, False)
+
     def run_js_inner(self, code, check_code):
         check_code = ""
         wrapped = f"""
@@ -727,6 +1538,9 @@ class NodeRunner(_BrowserBaseRunner):
             {check_code}
             return result;
         """
+        if self._protocol == "framed":
+            return self._run_js_framed(wrapped)
+
         from uuid import uuid4
 
         cmd_id = str(uuid4())
@@ -5,11 +5,26 @@ import multiprocessing
 import os
 import pathlib
 import queue
+import re
 import shutil
 import socketserver
 import sys
 import tempfile
 from io import BytesIO
+from typing import BinaryIO
+
+# Files in the scratch directory of a web server are served under this prefix
+# and can also be uploaded with PUT, e.g. to hand large blobs from the runtime
+# back to the host.
+SCRATCH_ROUTE = "/_pytest_pyodide/scratch/"
+
+
+def get_scratch_dir(log_path: str | os.PathLike[str]) -> pathlib.Path:
+    """
+    Return the scratch directory of the web server whose logs are written to
+    ``log_path``
+    """
+    return pathlib.Path(log_path).parent / "scratch"
 
 
 @functools.cache
@@ -26,11 +41,33 @@ def _default_templates() -> dict[str, bytes]:
     return templates
 
 
+class _FileRange:
+    """The part of an open file that is sent for a Range request"""
+
+    def __init__(self, f: BinaryIO, start: int, length: int):
+        f.seek(start)
+        self.f = f
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
 class DefaultHandler(http.server.SimpleHTTPRequestHandler):
     default_templates = _default_templates()
+    # Persistent connections, every response needs a Content-Length
+    protocol_version = "HTTP/1.1"
 
     def __init__(self, *args, **kwargs):
         self.extra_headers = kwargs.pop("extra_headers", {})
+        self.scratch_dir = kwargs.pop("scratch_dir", None)
         super().__init__(*args, **kwargs)
 
     def log_message(self, format_, *args):
@@ -66,9 +103,98 @@ class DefaultHandler(http.server.SimpleHTTPRequestHandler):
         else:
             return super().do_GET()
 
+    def send_head(self):
+        range_header = self.headers.get("Range")
+        path = self.translate_path(self.path)
+        if range_header is None or not os.path.isfile(path):
+            return super().send_head()
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+        if match is None or match.groups() == ("", ""):
+            # Multiple or malformed ranges, send the whole file
+            return super().send_head()
+        first, last = match.groups()
+        if first and last and int(last) < int(first):
+            return super().send_head()
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return super().send_head()
+
+        size = os.fstat(f.fileno()).st_size
+        if first:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+        else:
+            # The last bytes of the file
+            start = max(size - int(last), 0)
+            end = size
+        if start >= end:
+            f.close()
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        self.send_response(206)
+        self.send_header("Content-type", self.guess_type(path))
+        self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        return _FileRange(f, start, end - start)
+
+    def get_scratch_path(self) -> pathlib.Path | None:
+        """
+        Return the file in the scratch directory that the request path refers
+        to, None if the request is not for the scratch directory
+        """
+        path = self.path.split("?", 1)[0].split("#", 1)[0]
+        if self.scratch_dir is None or not path.startswith(SCRATCH_ROUTE):
+            return None
+        name = path.removeprefix(SCRATCH_ROUTE)
+        if not name or "/" in name or name.startswith("."):
+            return None
+        return pathlib.Path(self.scratch_dir) / name
+
+    def translate_path(self, path):
+        scratch_path = self.get_scratch_path()
+        if scratch_path is not None:
+            return str(scratch_path)
+        return super().translate_path(path)
+
+    def do_PUT(self):
+        scratch_path = self.get_scratch_path()
+        if scratch_path is None:
+            self.send_error(405, "PUT is only supported in the scratch directory")
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        tmp_path = scratch_path.with_name(f".{scratch_path.name}.part")
+        with tmp_path.open("wb") as f:
+            while length > 0:
+                chunk = self.rfile.read(min(length, 1 << 20))
+                if not chunk:
+                    break
+                f.write(chunk)
+                length -= len(chunk)
+        tmp_path.replace(scratch_path)
+
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_OPTIONS(self):
+        # CORS preflight for PUT and Range requests
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Methods", "GET, HEAD, PUT, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "*")
+        self.end_headers()
+
     def end_headers(self):
         # Enable Cross-Origin Resource Sharing (CORS)
         self.send_header("Access-Control-Allow-Origin", "*")
+        if self.command in ("GET", "HEAD"):
+            self.send_header("Accept-Ranges", "bytes")
         for k, v in self.extra_headers.items():
             self.send_header(k, v)
         if len(self.extra_headers) > 0:
@@ -78,15 +204,27 @@ class DefaultHandler(http.server.SimpleHTTPRequestHandler):
         super().end_headers()
 
 
+class _ThreadingServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Handles every connection in its own thread"""
+
+    # Idle keep-alive connections must not keep the server from stopping
+    daemon_threads = True
+    block_on_close = False
+    # Browsers open many connections at once when loading packages
+    request_queue_size = 64
+
+
 @contextlib.contextmanager
-def spawn_web_server(dist_dir, extra_headers=None, handler_cls=None):
+def spawn_web_server(dist_dir, extra_headers=None, handler_cls=None, threaded=True):
     if not extra_headers:
         extra_headers = {}
     tmp_dir = tempfile.mkdtemp()
     log_path = pathlib.Path(tmp_dir) / "http-server.log"
+    get_scratch_dir(log_path).mkdir()
     q: multiprocessing.Queue[str] = multiprocessing.Queue()
     p = multiprocessing.Process(
-        target=run_web_server, args=(q, log_path, dist_dir, extra_headers, handler_cls)
+        target=run_web_server,
+        args=(q, log_path, dist_dir, extra_headers, handler_cls, threaded),
     )
 
     try:
@@ -105,7 +243,25 @@ def spawn_web_server(dist_dir, extra_headers=None, handler_cls=None):
         shutil.rmtree(tmp_dir)
 
 
-def run_web_server(q, log_filepath, dist_dir, extra_headers, handler_cls):
+def _one_request_per_connection(handler_cls):
+    """
+    Answer with HTTP/1.0, so that every connection is closed after one request.
+    A single threaded server can't serve other clients while a connection is
+    kept alive. A ``functools.partial`` of a handler class is rebuilt around the
+    subclass of the class it wraps.
+    """
+    if isinstance(handler_cls, functools.partial):
+        return functools.partial(
+            _one_request_per_connection(handler_cls.func),
+            *handler_cls.args,
+            **handler_cls.keywords,
+        )
+    return type(handler_cls.__name__, (handler_cls,), {"protocol_version": "HTTP/1.0"})
+
+
+def run_web_server(
+    q, log_filepath, dist_dir, extra_headers, handler_cls, threaded=True
+):
     """Start the HTTP web server
 
     Parameters
@@ -114,6 +270,9 @@ def run_web_server(q, log_filepath, dist_dir, extra_headers, handler_cls):
       communication queue
     log_path : pathlib.Path
       path to the file where to store the logs
+    threaded : bool
+      handle every connection in its own thread and keep connections alive
+      (HTTP/1.1), otherwise serve one request at a time with HTTP/1.0
     """
 
     os.chdir(dist_dir)
@@ -122,10 +281,19 @@ def run_web_server(q, log_filepath, dist_dir, extra_headers, handler_cls):
     sys.stdout = log_fh
     sys.stderr = log_fh
 
+    handler_kwargs = {}
     if not handler_cls:
-        handler_cls = functools.partial(DefaultHandler, extra_headers=extra_headers)
+        handler_cls = DefaultHandler
+        handler_kwargs = {
+            "extra_headers": extra_headers,
+            "scratch_dir": get_scratch_dir(log_filepath),
+        }
+    if not threaded:
+        handler_cls = _one_request_per_connection(handler_cls)
 
-    with socketserver.TCPServer(("", 0), handler_cls) as httpd:
+    server_cls = _ThreadingServer if threaded else socketserver.TCPServer
+    handler = functools.partial(handler_cls, **handler_kwargs)
+    with server_cls(("", 0), handler) as httpd:
         host, port = httpd.server_address
         print(f"Starting webserver at http://{host}:{port}")  # type: ignore[str-bytes-safe]
         httpd.server_name = "test-server"  # type: ignore[attr-defined]
@@ -0,0 +1,129 @@
+"""
+Build and cache Pyodide memory snapshots.
+
+Booting Pyodide and installing the decorator module takes a large part of the
+time needed to start a runner. With ``--memory-snapshot`` the heap of a booted
+interpreter is serialized once per dist directory and runner type, cached on
+disk, and every runner that loads Pyodide boots from it instead.
+"""
+
+import hashlib
+import shutil
+import warnings
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+
+from .config import get_global_config
+from .runner import _BrowserBaseRunner
+from .server import SCRATCH_ROUTE, get_scratch_dir
+
+SNAPSHOT_CACHE_DIR = "pytest-pyodide-snapshots"
+
+# The files of a Pyodide distribution that a memory snapshot depends on
+DIST_FILES = [
+    "pyodide.asm.wasm",
+    "pyodide.asm.js",
+    "pyodide.js",
+    "pyodide.mjs",
+    "python_stdlib.zip",
+    "pyodide-lock.json",
+]
+
+# snapshot keys for which building a snapshot failed in this session
+_FAILED_SNAPSHOTS: set[str] = set()
+
+
+def dist_fingerprint(dist_dir: Path) -> str:
+    """
+    Return a fingerprint of the Pyodide distribution in ``dist_dir`` that
+    changes whenever one of the files the snapshot depends on changes
+    """
+    h = hashlib.sha256()
+    for name in DIST_FILES:
+        path = Path(dist_dir) / name
+        if not path.exists():
+            continue
+        stat = path.stat()
+        h.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return h.hexdigest()
+
+
+def snapshot_key(
+    runner_cls: type[_BrowserBaseRunner], dist_dir: Path, packages: list[str]
+) -> str:
+    """
+    Return the key that identifies a memory snapshot, which is also used as
+    its file name
+    """
+    config = get_global_config()
+    decorator_source = (Path(__file__).parent / "_decorator_in_pyodide.py").read_bytes()
+
+    h = hashlib.sha256()
+    for part in [
+        dist_fingerprint(dist_dir).encode(),
+        runner_cls.__name__.encode(),
+        config.get_load_pyodide_script(runner_cls.browser).encode(),
+        ",".join(sorted(packages)).encode(),
+        decorator_source,
+    ]:
+        h.update(part)
+        h.update(b"\0")
+    return h.hexdigest()[:32]
+
+
+def get_memory_snapshot(
+    request: pytest.FixtureRequest,
+    runner_cls: type[_BrowserBaseRunner],
+    web_server_main: tuple[str, int, Path],
+    dist_dir: Path,
+    make_runner: Callable[[], _BrowserBaseRunner],
+) -> str | None:
+    """
+    Return the URL of the memory snapshot for ``runner_cls``.
+
+    The snapshot is taken from the pytest cache if possible, otherwise it is
+    built with a runner returned by ``make_runner``. Returns None if the
+    snapshot can't be built, e.g. because the Pyodide version doesn't support
+    memory snapshots; Pyodide is then booted from scratch.
+    """
+    packages = [
+        pkg.strip()
+        for pkg in request.config.option.memory_snapshot_packages.split(",")
+        if pkg.strip()
+    ]
+    key = snapshot_key(runner_cls, dist_dir, packages)
+    if key in _FAILED_SNAPSHOTS:
+        return None
+
+    name = f"snapshot-{key}.bin"
+    url = SCRATCH_ROUTE + name
+    served_path = get_scratch_dir(web_server_main[2]) / name
+    if served_path.exists():
+        return url
+
+    cache = getattr(request.config, "cache", None)
+    cached_path = cache.mkdir(SNAPSHOT_CACHE_DIR) / name if cache else None
+    if cached_path is not None and cached_path.exists():
+        shutil.copyfile(cached_path, served_path)
+        return url
+
+    runner = make_runner()
+    try:
+        runner.make_memory_snapshot(url, packages)
+    except Exception as e:
+        _FAILED_SNAPSHOTS.add(key)
+        warnings.warn(
+            f"Failed to build a memory snapshot for {runner_cls.__name__}, "
+            f"Pyodide will be booted from scratch:\n{e}",
+            pytest.PytestWarning,
+            stacklevel=2,
+        )
+        return None
+    finally:
+        runner.quit()
+
+    if cached_path is not None:
+        shutil.copyfile(served_path, cached_path)
+    return url
@@ -2,6 +2,8 @@
 # test_fail is expected to fail obviously!
 import sys
 
+RUNS = 0
+
 
 def test_success():
     print("WOOO")
@@ -25,3 +27,8 @@ def test_check_in_pyodide():
 
 def test_this_doesnt_run(selenium):
     assert "Pyodide specific tests shouldn't be run inside pyodide" == 0
+
+
+def test_count_runs():
+    global RUNS
+    RUNS += 1
@@ -0,0 +1,153 @@
+import ast
+from types import SimpleNamespace
+
+from pytest_pyodide import hook
+from pytest_pyodide.ast_cache import (
+    AST_CACHE_STATS,
+    ModuleASTStore,
+    load_module,
+    save_module,
+)
+
+SOURCE = b"""
+import pytest
+
+def helper(selenium):
+    pass
+
+@pytest.mark.parametrize("x", [1])
+def test_f(selenium, x):
+    def inner(selenium):
+        assert x == 1
+    assert 1 + 1 == 2
+"""
+
+
+def test_module_ast_store():
+    store = ModuleASTStore(maxsize=2)
+    for name in "abc":
+        store.add(name, SOURCE)
+    assert store.memory_usage() == {
+        "modules": 3,
+        "source_bytes": 3 * len(SOURCE),
+        "trees": 0,
+    }
+
+    assert ast.dump(store.original["a"]) == ast.dump(ast.parse(SOURCE))
+    assert store.loads == 1
+
+    store.get("b")
+    store.get("a")
+    # c evicts the least recently used module b
+    store.get("c")
+    assert store.memory_usage()["trees"] == 2
+    store.get("a")
+    assert store.loads == 3
+    store.get("b")
+    assert store.loads == 4
+
+    assert sorted(store.original) == ["a", "b", "c"]
+    assert "d" not in store
+
+
+def test_locate():
+    store = ModuleASTStore()
+    store.add("a", SOURCE)
+
+    # The decorated function starts at the line of its first decorator
+    statements, funcdef = store.locate("a", "test_f", 7, rewrite=False)
+    assert funcdef.name == "test_f"
+    assert statements == []
+
+    # Nested functions are found by their line as well
+    _, funcdef = store.locate("a", "inner", 9, rewrite=False)
+    assert funcdef.name == "inner"
+    # If the line doesn't match, the next function with the name is used
+    _, funcdef = store.locate("a", "helper", 2, rewrite=False)
+    assert funcdef.lineno == 4
+
+    # Only the located function is rewritten
+    statements, funcdef = store.locate("a", "helper", 4, rewrite=True)
+    assert [stmt.names[0].asname for stmt in statements] == [  # type: ignore[attr-defined]
+        "@py_builtins",
+        "@pytest_ar",
+    ]
+    statements, funcdef = store.locate("a", "test_f", 7, rewrite=True)
+    assert not any(isinstance(node, ast.Assert) for node in ast.walk(funcdef))
+    original = store.get("a").tree
+    assert sum(isinstance(node, ast.Assert) for node in ast.walk(original)) == 2
+
+
+def test_load_module(tmp_path):
+    filename = str(tmp_path / "test_mod.py")
+    expected = ast.dump(ast.parse(SOURCE))
+
+    before = dict(AST_CACHE_STATS)
+    module = load_module(tmp_path, SOURCE, filename, None)
+    assert ast.dump(module.tree) == expected
+    assert AST_CACHE_STATS["misses"] == before["misses"] + 1
+    _, rewritten = module.locate("test_f", 7, rewrite=True)
+    save_module(tmp_path, module)
+    [cache_file] = tmp_path.glob("*.pickle")
+
+    # Unchanged modules are unpickled with the functions rewritten so far
+    module = load_module(tmp_path, SOURCE, filename, None)
+    assert ast.dump(module.tree) == expected
+    assert AST_CACHE_STATS["hits"] == before["hits"] + 1
+    funcdef = module.find_function("test_f", 7)
+    assert ast.dump(module._rewritten[funcdef][1]) == ast.dump(rewritten)
+    assert not module.dirty
+
+    # A changed module replaces the cache entry
+    changed = SOURCE + b"\nx = 1\n"
+    module = load_module(tmp_path, changed, filename, None)
+    assert ast.dump(module.tree) == ast.dump(ast.parse(changed))
+    assert AST_CACHE_STATS["misses"] == before["misses"] + 2
+    save_module(tmp_path, module)
+    assert list(tmp_path.glob("*.pickle")) == [cache_file]
+
+    # A broken cache file is rebuilt
+    cache_file.write_bytes(b"garbage")
+    module = load_module(tmp_path, SOURCE, filename, None)
+    assert ast.dump(module.tree) == expected
+    assert AST_CACHE_STATS["misses"] == before["misses"] + 3
+
+
+def test_module_ast_store_flush(tmp_path):
+    store = ModuleASTStore(maxsize=1)
+    store.add("a", SOURCE, tmp_path)
+    store.add("b", SOURCE)
+    store.locate("a", "helper", 4, rewrite=True)
+    # Evicting a module writes it to the cache, modules without a cache
+    # directory are only kept in memory
+    store.get("b")
+    assert len(list(tmp_path.glob("*.pickle"))) == 1
+
+    store = ModuleASTStore()
+    store.add("a", SOURCE, tmp_path)
+    module = store.get("a")
+    assert not module.dirty
+    store.locate("a", "test_f", 7, rewrite=True)
+    assert module.dirty
+    store.flush()
+    assert not module.dirty
+    assert len(load_module(tmp_path, SOURCE, "a", None)._rewritten) == 2
+
+
+def test_terminal_summary_verbose(monkeypatch):
+    store = ModuleASTStore()
+    store.add("a", SOURCE)
+    store.get("a")
+    monkeypatch.setattr(hook, "MODULE_ASTS", store)
+
+    def summary(verbose):
+        lines = []
+        reporter = SimpleNamespace(
+            write_sep=lambda *args: None, write_line=lines.append
+        )
+        config = SimpleNamespace(option=SimpleNamespace(verbose=verbose), stash={})
+        hook.pytest_terminal_summary(reporter, 0, config)
+        return lines
+
+    assert not any("ASTs" in line for line in summary(0))
+    assert store.summary() in summary(1)
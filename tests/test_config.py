@@ -1,3 +1,5 @@
+import pytest
+
 from pytest_pyodide.config import Config, get_global_config
 
 
@@ -23,3 +25,25 @@ def test_config():
 
 def test_global_config():
     assert get_global_config() is get_global_config()
+
+
+def test_node_protocol():
+    c = Config()
+
+    assert c.get_node_protocol() == "line"
+    c.set_node_protocol("framed")
+    assert c.get_node_protocol() == "framed"
+
+    with pytest.raises(ValueError, match="Invalid node protocol"):
+        c.set_node_protocol("carrier-pigeon")  # type: ignore[arg-type]
+
+
+def test_node_transport():
+    c = Config()
+
+    assert c.get_node_transport() == "pty"
+    c.set_node_transport("pipe")
+    assert c.get_node_transport() == "pipe"
+
+    with pytest.raises(ValueError, match="Invalid node transport"):
+        c.set_node_transport("carrier-pigeon")  # type: ignore[arg-type]
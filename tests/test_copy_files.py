@@ -1,9 +1,17 @@
+import os
+import tarfile
+import urllib.request
+from importlib import import_module
 from pathlib import Path
+from types import SimpleNamespace
 
 import pytest
 
 from pytest_pyodide.decorator import copy_files_to_pyodide, run_in_pyodide
 
+# The package exports the decorator under the name of the module
+copy_files = import_module("pytest_pyodide.copy_files_to_pyodide")
+
 
 @copy_files_to_pyodide(
     [(Path(__file__).parent, "non_recursive_test")], recurse_directories=False
@@ -130,3 +138,306 @@ def test_copy_files_run_install_wheel(selenium):
         selenium.run("""import pyodide_http""")
 
     install_package_and_try_import(selenium)
+
+
+def test_sync_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    transferred = []
+    monkeypatch.setattr(
+        copy_files,
+        "_transfer_files",
+        lambda files, selenium, install_wheels: transferred.append(
+            sorted(dest for _, dest in files)
+        ),
+    )
+    selenium = SimpleNamespace(copy_index=copy_files.CopyIndex())
+    (tmp_path / "tests/sub").mkdir(parents=True)
+    (tmp_path / "tests/test_a.py").write_text("a")
+    (tmp_path / "tests/sub/data.txt").write_text("b")
+    (tmp_path / "dist").mkdir()
+    (tmp_path / "dist/pkg-1.0-py3-none-any.whl").write_text("wheel")
+
+    copy_files.sync_directory_to_emscripten_fs(
+        Path("tests"), selenium, wheel_dir=Path("dist")
+    )
+    assert transferred == [
+        [
+            "test_files/dist/pkg-1.0-py3-none-any.whl",
+            "test_files/tests/sub/data.txt",
+            "test_files/tests/test_a.py",
+        ]
+    ]
+
+    # A directory is synced once
+    (tmp_path / "tests/test_a.py").write_text("changed")
+    copy_files.sync_directory_to_emscripten_fs(Path("tests"), selenium)
+    assert len(transferred) == 1
+
+    # Only files whose content changed are copied again, the wheel is unchanged
+    (tmp_path / "tests/sub/data.txt").write_text("b")
+    copy_files.sync_directory_to_emscripten_fs(
+        Path("tests/sub"), selenium, wheel_dir=Path("dist")
+    )
+    assert len(transferred) == 1
+    selenium.copy_index.synced_directories.clear()
+    copy_files.sync_directory_to_emscripten_fs(
+        Path("tests"), selenium, wheel_dir=Path("dist")
+    )
+    assert transferred[1:] == [["test_files/tests/test_a.py"]]
+
+
+def test_sync_directory_mounted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(copy_files, "_transfer_files", None)
+    mounts = []
+    installed = []
+    selenium = SimpleNamespace(
+        copy_index=copy_files.CopyIndex(),
+        mount_host_directory=lambda src, dest: mounts.append((src, dest)),
+        link_host_files=None,
+        run_async=installed.append,
+    )
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests/test_a.py").write_text("a")
+    (tmp_path / "dist").mkdir()
+    (tmp_path / "dist/pkg-1.0-py3-none-any.whl").write_text("wheel")
+
+    # The directory is mounted instead of copied and the wheels are installed
+    # from a mount of their directory
+    copy_files.sync_directory_to_emscripten_fs(
+        Path("tests"), selenium, wheel_dir=Path("dist")
+    )
+    [hidden_mount] = [dest for src, dest in mounts if src == tmp_path / "dist"]
+    assert mounts == [
+        (tmp_path / "tests", "test_files/tests"),
+        (tmp_path / "dist", hidden_mount),
+    ]
+    [code] = installed
+    assert f"emfs:{hidden_mount}/pkg-1.0-py3-none-any.whl" in code
+
+    selenium.copy_index.synced_directories.clear()
+    copy_files.sync_directory_to_emscripten_fs(
+        Path("tests"), selenium, wheel_dir=Path("dist")
+    )
+    assert len(mounts) == 2
+    assert len(installed) == 1
+
+
+def test_copy_index(tmp_path):
+    src = tmp_path / "a.txt"
+    other = tmp_path / "b.txt"
+    src.write_text("a")
+    other.write_text("a")
+    index = copy_files.CopyIndex()
+
+    [(_, _, state)] = changed = index.changed([(src, "a.txt")])
+    index.add(changed)
+    assert index.changed([(src, "a.txt")]) == []
+    # Another source with the same content is not copied again
+    assert index.changed([(other, "a.txt")]) == []
+    assert index.files["a.txt"][0] == other
+    assert index.files["a.txt"][1][2] == state[2]
+
+    # Changed content is copied again
+    other.write_text("b")
+    assert [dest for _, dest, _ in index.changed([(other, "a.txt")])] == ["a.txt"]
+
+    index.clear()
+    assert len(index.changed([(src, "a.txt")])) == 1
+
+
+def test_copy_index_lazy(tmp_path, monkeypatch):
+    src = tmp_path / "a.txt"
+    other = tmp_path / "b.txt"
+    src.write_text("a")
+    other.write_text("a")
+    index = copy_files.CopyIndex()
+
+    # Lazy files are compared by size and modification time, never hashed
+    monkeypatch.setattr(copy_files, "file_state", None)
+    [(_, _, state)] = changed = index.changed([(src, "a.txt")], lazy=True)
+    assert state[2] == ""
+    index.add(changed)
+    assert index.changed([(src, "a.txt")], lazy=True) == []
+    assert len(index.changed([(other, "a.txt")], lazy=True)) == 1
+    os.utime(src, ns=(0, 0))
+    assert len(index.changed([(src, "a.txt")], lazy=True)) == 1
+
+
+def test_file_server_is_reused(tmp_path):
+    (tmp_path / "a.txt").write_text("hello")
+    hostname, port, log_path = copy_files.file_server(tmp_path)
+    assert copy_files.file_server(tmp_path) == (hostname, port, log_path)
+    with urllib.request.urlopen(f"http://{hostname}:{port}/a.txt") as response:
+        assert response.read() == b"hello"
+
+    copy_files.close_file_servers()
+    assert not log_path.exists()
+    assert copy_files.file_server(tmp_path) != (hostname, port, log_path)
+    copy_files.close_file_servers()
+
+
+def test_build_archive(tmp_path, monkeypatch):
+    (tmp_path / "a.txt").write_text("a")
+    (tmp_path / "b.txt").write_text("b")
+    pairs = [(tmp_path / "a.txt", "data/a.txt"), (tmp_path / "b.txt", "b.txt")]
+    files = copy_files.CopyIndex().changed(pairs)
+
+    path = copy_files.build_archive(files, tmp_path)
+    with tarfile.open(path) as tar:
+        assert tar.getnames() == ["data/a.txt", "b.txt"]
+        assert tar.extractfile("data/a.txt").read() == b"a"  # type: ignore[union-attr]
+
+    # Archives are cached by content, using the hashes from CopyIndex.changed
+    mtime = path.stat().st_mtime_ns
+    with monkeypatch.context() as m:
+        m.setattr(copy_files, "file_state", None)
+        assert copy_files.build_archive(files, tmp_path) == path
+    assert path.stat().st_mtime_ns == mtime
+    (tmp_path / "b.txt").write_text("changed")
+    files = copy_files.CopyIndex().changed(pairs)
+    assert copy_files.build_archive(files, tmp_path) != path
+
+
+@copy_files_to_pyodide(
+    [(Path(__file__).parent, "bulk_test"), (__file__, "/tmp/bulk_test.py")],
+    bulk=True,
+)
+def test_copy_files_bulk(selenium):
+    selenium.run(
+        f"""
+        from pathlib import Path
+        assert Path("bulk_test/{Path(__file__).name}").exists()
+        assert Path("bulk_test/datafiles/in_pyodide_tests.py").exists()
+        assert "test_copy_files_bulk" in Path("/tmp/bulk_test.py").read_text()
+        """
+    )
+
+
+def test_copy_files_single_round_trip(selenium, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for i in range(20):
+        (tmp_path / f"file{i}.txt").write_text(str(i))
+    calls = 0
+    run_async = selenium.run_async
+
+    def counting_run_async(code):
+        nonlocal calls
+        calls += 1
+        return run_async(code)
+
+    monkeypatch.setattr(selenium, "run_async", counting_run_async)
+    results = copy_files.copy_files_to_emscripten_fs(
+        [(tmp_path, "round_trip")], selenium
+    )
+    assert calls == 1
+    assert sorted(result["dest"] for result in results) == sorted(
+        f"round_trip/file{i}.txt" for i in range(20)
+    )
+    assert all(result["size"] in (1, 2) for result in results)
+
+
+def test_mount_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data/sub").mkdir(parents=True)
+    (tmp_path / "data/sub/a.txt").write_text("a")
+    (tmp_path / "b.txt").write_text("b")
+    mounts = []
+    links = []
+    selenium = SimpleNamespace(
+        copy_index=copy_files.CopyIndex(),
+        mount_host_directory=lambda src, dest: mounts.append((src, dest)),
+        link_host_files=links.extend,
+    )
+
+    copy_files.copy_files_to_emscripten_fs(
+        [(tmp_path / "data", "data"), (tmp_path / "b.txt", "b.txt")],
+        selenium,
+        mount=True,
+    )
+    [hidden_mount] = [dest for src, dest in mounts if src == tmp_path]
+    assert mounts == [(tmp_path / "data", "data"), (tmp_path, hidden_mount)]
+    assert links == [(f"{hidden_mount}/b.txt", "b.txt")]
+
+    # Subdirectories of mounted directories are visible already
+    copy_files.copy_files_to_emscripten_fs(
+        [(tmp_path / "data/sub", "data/sub"), (tmp_path / "b.txt", "b.txt")],
+        selenium,
+        mount=True,
+    )
+    assert len(mounts) == 2
+    assert len(links) == 1
+
+
+def test_copy_files_mounted_read_only(selenium):
+    if selenium.browser != "node":
+        pytest.skip("Only node mounts host directories")
+    copy_files.copy_files_to_emscripten_fs(
+        [(Path(__file__).parent, "mounted")], selenium, mount=True
+    )
+    selenium.run(
+        f"""
+        from pathlib import Path
+        assert "test_copy_files_mounted_read_only" in Path(
+            "mounted/{Path(__file__).name}"
+        ).read_text()
+        try:
+            Path("mounted/new_file.txt").write_text("x")
+        except OSError:
+            pass
+        else:
+            assert False, "mounted directories are read-only"
+        """
+    )
+
+
+def test_create_lazy_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data/big.bin").write_bytes(bytes(range(256)) * 16)
+    lazy_files = []
+    selenium = SimpleNamespace(
+        browser="chrome",
+        copy_index=copy_files.CopyIndex(),
+        create_lazy_files=lambda files, chunk_size: lazy_files.extend(files),
+    )
+
+    results = copy_files.copy_files_to_emscripten_fs(
+        [(tmp_path / "data", "lazy")], selenium, lazy=True
+    )
+    [(url, dest, size)] = lazy_files
+    assert (dest, size) == ("lazy/big.bin", 4096)
+    assert results == [{"url": url, "dest": dest, "size": None, "time": 0}]
+
+    # The chunks are fetched with Range requests
+    request = urllib.request.Request(url, headers={"Range": "bytes=256-511"})
+    with urllib.request.urlopen(request) as response:
+        assert response.status == 206
+        assert response.read() == bytes(range(256))
+    copy_files.close_file_servers()
+
+    # Unchanged files are not created again
+    copy_files.copy_files_to_emscripten_fs(
+        [(tmp_path / "data", "lazy")], selenium, lazy=True
+    )
+    assert len(lazy_files) == 1
+
+
+@copy_files_to_pyodide([(Path(__file__).parent, "lazy_test")], lazy=True)
+def test_copy_files_lazy(selenium):
+    selenium.run(
+        f"""
+        from pathlib import Path
+        path = Path("lazy_test/{Path(__file__).name}")
+        with path.open("rb") as f:
+            f.seek(2)
+            assert f.read(6) == b"port t"
+        assert "test_copy_files_lazy" in path.read_text()
+        try:
+            path.write_text("x")
+        except OSError:
+            pass
+        else:
+            assert False, "lazy files are read-only"
+        """
+    )
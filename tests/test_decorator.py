@@ -1,10 +1,11 @@
 from collections.abc import Callable
+from types import SimpleNamespace
 
 import pytest
 from hypothesis import given, settings
 
 from pyodide.ffi import JsException
-from pytest_pyodide.decorator import run_in_pyodide
+from pytest_pyodide.decorator import cache_info, run_in_pyodide
 from pytest_pyodide.hypothesis import any_strategy, std_hypothesis_settings
 from pytest_pyodide.utils import parse_driver_timeout
 
@@ -311,6 +312,61 @@ def test_selenium_handle(selenium):
     # check_refcount(selenium, 3)
 
 
+def test_handle_release_batched(selenium, monkeypatch):
+    import gc
+
+    from pytest_pyodide.runner import HANDLE_RELEASE_STATS
+
+    handles = [returns_handle(selenium) for _ in range(3)]
+    before = dict(HANDLE_RELEASE_STATS)
+
+    calls = []
+    call = selenium.call
+
+    def counting_call(name, *args, **kwargs):
+        calls.append(name)
+        return call(name, *args, **kwargs)
+
+    monkeypatch.setattr(selenium, "call", counting_call)
+    del handles
+    gc.collect()
+    # Collecting the handles doesn't make a round trip
+    assert calls == []
+
+    # The references are released together with the next command
+    selenium.run_js("return 1;")
+    assert calls == ["$runJs"]
+    assert HANDLE_RELEASE_STATS["released"] == before["released"] + 3
+    assert HANDLE_RELEASE_STATS["flushes"] == before["flushes"] + 1
+
+    # Also with run and run_async
+    for run in [selenium.run, selenium.run_async]:
+        handles = [returns_handle(selenium) for _ in range(2)]
+        before = dict(HANDLE_RELEASE_STATS)
+        calls.clear()
+        del handles
+        gc.collect()
+        assert run("1 + 1") == 2
+        assert len(calls) == 1
+        assert HANDLE_RELEASE_STATS["released"] == before["released"] + 2
+
+
+def test_runtest_call_fixture_without_releases():
+    from pytest_pyodide.hook import pytest_runtest_call
+
+    # A fixture whose name starts with selenium, but that isn't a runner
+    item = SimpleNamespace(
+        config=SimpleNamespace(option=SimpleNamespace(run_in_pyodide=False)),
+        _fixtureinfo=SimpleNamespace(argnames=["selenium_config"]),
+        funcargs={"selenium_config": SimpleNamespace(browser="chrome")},
+        get_closest_marker=lambda name: None,
+    )
+    hook = pytest_runtest_call(item)
+    next(hook)
+    with pytest.raises(StopIteration):
+        next(hook)
+
+
 def test_pytest_dot_skip(selenium):
     """Check that pytest.skip, etc will work inside @run_in_pyodide"""
 
@@ -431,3 +487,166 @@ def test_complex_args(selenium):
     fn_with_complex_args2(selenium, 5, 6, 7, 8, 9, a=8, c=7, q=11)
     with pytest.raises(TypeError, match="multiple values"):
         fn_with_complex_args2(selenium, 5, 6, 7, 8, 9, b=8, c=7, q=11)
+
+
+@run_in_pyodide
+def add_one(selenium, x):
+    return x + 1
+
+
+def test_module_cache(selenium_standalone):
+    assert add_one(selenium_standalone, 1) == 2
+    before = cache_info(selenium_standalone)
+    # The second call only sends the hash of the module
+    assert add_one(selenium_standalone, 2) == 3
+    after = cache_info(selenium_standalone)
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"]
+
+    # After a reload the cache is empty and the module is sent again
+    selenium_standalone.refresh()
+    selenium_standalone.load_pyodide()
+    selenium_standalone.initialize_pyodide()
+    assert add_one(selenium_standalone, 3) == 4
+    assert cache_info(selenium_standalone)["resends"] == after["resends"] + 1
+
+
+@run_in_pyodide
+def reverse_buffers(selenium, data):
+    return [bytes(reversed(x)) for x in data]
+
+
+def test_out_of_band_buffers(selenium, tmp_path):
+    from pytest_pyodide.decorator import _OOB_THRESHOLD, _scratch_dir
+
+    small = b"abc"
+    large = bytes(range(256)) * (_OOB_THRESHOLD // 256 + 1)
+    data = [small, large, bytearray(large)]
+    assert reverse_buffers(selenium, data) == [bytes(reversed(x)) for x in data]
+
+    # The blobs in both directions are cleaned up
+    scratch_dir = _scratch_dir(selenium)
+    assert scratch_dir is not None
+    assert not list(scratch_dir.glob("blob-*"))
+
+
+@pytest.mark.parametrize("x", range(5))
+@run_in_pyodide(batch=2)
+def test_batch(selenium, x):
+    if x == 3:
+        pytest.skip("skipped in a batch")
+    assert x < 5
+
+
+@run_in_pyodide(batch=2)
+def _batched(selenium, x):
+    pass
+
+
+def _batch_item(runtime, x, indirect=False):
+    mark = pytest.mark.parametrize("x", [x], indirect=indirect).mark
+    return SimpleNamespace(
+        callspec=SimpleNamespace(params={"runtime": runtime, "x": x}),
+        iter_markers=lambda name: [mark],
+    )
+
+
+def test_batch_queue(monkeypatch):
+    batch = _batched._pytest_pyodide_batch
+    batches = []
+
+    def run_cases(selenium, cases, batch):
+        batches.append((selenium.browser, [x for (x,) in cases]))
+        return [(0, str(x), "") for (x,) in cases]
+
+    monkeypatch.setattr(batch, "_run_cases", run_cases)
+    for item in [
+        _batch_item("chrome", 1),
+        _batch_item("node", 2),
+        _batch_item("chrome", 3),
+        # Runs on its own, the test gets the value of the fixture
+        _batch_item("chrome", 4, indirect=True),
+        _batch_item("chrome", 5),
+    ]:
+        batch.add_item(item)
+
+    chrome = SimpleNamespace(browser="chrome")
+    node = SimpleNamespace(browser="node")
+    assert batch._run_batched(chrome, (1,)) == (0, "1", "")
+    assert batch._run_batched(node, (2,)) == (0, "2", "")
+    assert batch._run_batched(chrome, (3,)) == (0, "3", "")
+    assert batch._run_batched(chrome, (40,)) == (0, "40", "")
+    # The cases of a runtime only run in its batches
+    assert batches == [
+        ("chrome", [1, 3]),
+        ("node", [2]),
+        ("chrome", [40, 5]),
+    ]
+    # The result of 5 is dropped once the last queued case of chrome ran
+    assert batch._run_batched(chrome, (5,)) == (0, "5", "")
+    assert batch._batch_queue == batch._batch_results == {}
+
+    # Results of skipped tests are dropped at the end of the session
+    batch.add_item(_batch_item("chrome", 6))
+    batch.add_item(_batch_item("chrome", 7))
+    batch._run_batched(chrome, (6,))
+    assert batch._batch_results
+    batch.clear_batches()
+    assert batch._batch_queue == batch._batch_results == {}
+
+
+BATCH_TESTS = """
+import pytest
+from pytest_pyodide import run_in_pyodide
+
+@pytest.mark.parametrize("x", range(5))
+@run_in_pyodide(batch=3)
+def test_square(selenium, x):
+    assert x * x == x**2
+"""
+
+
+def test_batch_round_trips(pytester, selenium, request, playwright_browsers):
+    file = pytester.makepyfile(BATCH_TESTS)
+    calls = []
+
+    class CountingRunner:
+        """A new runner object for every test, like selenium_standalone"""
+
+        def __init__(self, runner):
+            self._runner = runner
+
+        def __getattr__(self, name):
+            return getattr(self._runner, name)
+
+        def run_async(self, code):
+            calls.append(code)
+            return self._runner.run_async(code)
+
+    class MyPlugin:
+        def pytest_fixture_setup(self, fixturedef, request):
+            vals = {
+                "selenium": CountingRunner(selenium),
+                "playwright_browsers": playwright_browsers,
+            }
+            if fixturedef.argname in vals:
+                val = vals[fixturedef.argname]
+                cache_key = fixturedef.cache_key(request)
+                fixturedef.cached_result = (val, cache_key, None)
+                return val
+
+    result = pytester.inline_run(
+        file,
+        "--dist-dir",
+        request.config.getoption("--dist-dir"),
+        "--rt",
+        selenium.browser,
+        "--runner",
+        request.config.option.runner,
+        "--rootdir",
+        str(file.parent),
+        plugins=(MyPlugin(),),
+    )
+    result.assertoutcome(passed=5)
+    # The cases registered at collection run in two batches
+    assert len(calls) == 2
@@ -19,6 +19,19 @@ def test_selenium_standalone_refresh(selenium_standalone_refresh, dummy):
     assert p.is_file()
 
 
+def test_prepare_call(selenium_standalone):
+    selenium_standalone.prepare("add", "return a + b;", ["a", "b"])
+    assert selenium_standalone.call("add", 1, 2) == 3
+    assert selenium_standalone.call("add", "x", "'y\"") == "x'y\""
+
+    # The prepared functions are installed again after a reload
+    selenium_standalone.refresh()
+    assert selenium_standalone.call("add", 3, 4) == 7
+
+    with pytest.raises(selenium_standalone.JavascriptException, match="Unknown"):
+        selenium_standalone.call("missing")
+
+
 def test_playwright_browsers(playwright_browsers, request):
     if request.config.option.runner.lower() != "playwright":
         pytest.skip("this test should only run when playwright is specified")
@@ -52,3 +52,18 @@ def test_load_package_partial_failure_raises(selenium):
 
     msg = str(exc_info.value)
     assert "definitely-not-a-real-package-xyz" in msg
+
+
+def test_load_package_skips_loaded_packages(selenium):
+    """Once a package is known to be loaded, loading it again doesn't need a
+    round trip to the browser."""
+    selenium.load_package("micropip")
+    skips = selenium.load_package_skips
+    selenium.load_package("micropip")
+    selenium.load_package(["micropip"])
+    assert selenium.load_package_skips == skips + 2
+
+    # After restoring the state, we ask Pyodide again
+    selenium.restore_state()
+    selenium.load_package("micropip")
+    assert selenium.load_package_skips == skips + 2
@@ -0,0 +1,107 @@
+import pytest
+
+from pytest_pyodide import get_global_config
+from pytest_pyodide.fixture import selenium_common
+from pytest_pyodide.runner import JavascriptException
+
+
+@pytest.fixture(params=["pty", "pipe", "threads"])
+def selenium_node_framed(request, runtime, web_server_main, playwright_browsers):
+    if runtime != "node":
+        pytest.skip("node specific test")
+
+    config = get_global_config()
+    protocol = config.get_node_protocol()
+    transport = config.get_node_transport()
+    config.set_node_protocol("framed")
+    config.set_node_transport(request.param)
+    try:
+        with selenium_common(
+            request, runtime, web_server_main, browsers=playwright_browsers
+        ) as selenium:
+            yield selenium
+    finally:
+        config.set_node_protocol(protocol)
+        config.set_node_transport(transport)
+
+
+def test_framed_run_js(selenium_node_framed):
+    assert selenium_node_framed.run_js("return 1 + 1;") == 2
+    assert selenium_node_framed.run_js("return { a: [1, 'x\\ny'] };") == {
+        "a": [1, "x\ny"]
+    }
+    assert selenium_node_framed.run_js("return undefined;") is None
+
+
+def test_framed_large_payload(selenium_node_framed):
+    big = "x" * 200_000
+    assert selenium_node_framed.run_js(f"return {big!r}.length;") == len(big)
+
+
+def test_framed_binary_result(selenium_node_framed):
+    result = selenium_node_framed.run_js("return new Uint8Array([0, 10, 13, 27]);")
+    assert result == b"\x00\n\r\x1b"
+
+
+def test_framed_error(selenium_node_framed):
+    with pytest.raises(JavascriptException, match="some error"):
+        selenium_node_framed.run_js("throw new Error('some error');")
+    # The runner is still usable after an error
+    assert selenium_node_framed.run_js("return 7;") == 7
+
+
+def test_framed_timeout(selenium_node_framed):
+    timeout = selenium_node_framed.script_timeout
+    selenium_node_framed.set_script_timeout(0.5)
+    try:
+        with pytest.raises(TimeoutError):
+            selenium_node_framed.run_js(
+                "await new Promise((r) => setTimeout(r, 1500)); return 1;"
+            )
+    finally:
+        selenium_node_framed.set_script_timeout(timeout)
+    # The late reply to the call that timed out is skipped
+    result = selenium_node_framed.run_js(
+        "await new Promise((r) => setTimeout(r, 1500)); return 2;"
+    )
+    assert result == 2
+    assert selenium_node_framed.run_js("return 3;") == 3
+
+
+def test_framed_run_python(selenium_node_framed):
+    selenium_node_framed.run("print('hello from python')")
+    assert "hello from python" in selenium_node_framed.logs
+    assert selenium_node_framed.run("1 + 1") == 2
+
+
+def test_pipe_refresh(selenium_node_framed):
+    selenium_node_framed.run_js("globalThis.x = 1;")
+    selenium_node_framed.refresh()
+    assert selenium_node_framed.run_js("return typeof x;") == "undefined"
+
+
+def test_threads_share_process(request, runtime, web_server_main, playwright_browsers):
+    if runtime != "node":
+        pytest.skip("node specific test")
+
+    config = get_global_config()
+    transport = config.get_node_transport()
+    config.set_node_transport("threads")
+    try:
+        with (
+            selenium_common(
+                request, runtime, web_server_main, browsers=playwright_browsers
+            ) as selenium1,
+            selenium_common(
+                request, runtime, web_server_main, browsers=playwright_browsers
+            ) as selenium2,
+        ):
+            assert selenium1.run_js("return process.pid;") == selenium2.run_js(
+                "return process.pid;"
+            )
+            # but every runner has its own context and interpreter
+            selenium1.run("x = 1")
+            assert selenium1.run("'x' in globals()")
+            assert not selenium2.run("'x' in globals()")
+    finally:
+        config.set_node_transport(transport)
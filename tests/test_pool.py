@@ -0,0 +1,75 @@
+import threading
+
+from pytest_pyodide.pool import RunnerPool
+
+
+class DummyRunner:
+    def __init__(self):
+        # Runners from the pool are booted in its background threads
+        self.booted_in = threading.current_thread().name
+        self.closed = threading.Event()
+
+    def quit(self):
+        self.closed.set()
+
+
+def test_runner_pool():
+    created: list[DummyRunner] = []
+    created_changed = threading.Condition()
+
+    def factory():
+        runner = DummyRunner()
+        with created_changed:
+            created.append(runner)
+            created_changed.notify_all()
+        return runner
+
+    def wait_for_created(n):
+        with created_changed:
+            assert created_changed.wait_for(lambda: len(created) >= n, timeout=10)
+
+    pool = RunnerPool(2)
+    # The first runner has to be booted on the spot, while the pool is filled
+    first = pool.acquire("node", factory)
+    assert first.booted_in == threading.current_thread().name
+    assert pool.misses == 1
+    wait_for_created(3)
+
+    pool.release(first)
+    assert first.closed.wait(10)
+
+    # The next runner comes from the pool and is replaced by a new one
+    runner = pool.acquire("node", factory)
+    assert runner is not first
+    assert runner.booted_in.startswith("pytest-pyodide-pool")
+    assert not runner.closed.is_set()
+    assert pool.hits + pool.misses == 2
+    wait_for_created(4)
+    pool.release(runner)
+
+    # Closing the pool shuts down the released and the waiting runners
+    pool.close()
+    assert len(created) == 4
+    assert all(runner.closed.is_set() for runner in created)
+    assert pool.summary() == (
+        f"standalone runner pool (size 2): {pool.hits} hits, {pool.misses} misses"
+    )
+
+
+def test_runner_pool_boot_error():
+    def factory():
+        if threading.current_thread().name.startswith("pytest-pyodide-pool"):
+            raise RuntimeError("boot failed")
+        return DummyRunner()
+
+    pool = RunnerPool(1)
+    first = pool.acquire("node", factory)
+    # The runner that failed to boot in the pool is booted in the foreground
+    runner = pool.acquire("node", factory)
+    assert runner is not first
+    assert runner.booted_in == threading.current_thread().name
+    pool.release(first)
+    pool.release(runner)
+    pool.close()
+    assert first.closed.is_set()
+    assert runner.closed.is_set()
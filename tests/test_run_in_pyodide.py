@@ -1,48 +1,182 @@
 from pathlib import Path
 
 import pytest
+from _pytest.reports import TestReport
 
+from pytest_pyodide._pytest_session_in_pyodide import check_pytest_version
 from pytest_pyodide.copy_files_to_pyodide import copy_files_to_emscripten_fs
-from pytest_pyodide.run_tests_inside_pyodide import run_test_in_pyodide
+from pytest_pyodide.run_tests_inside_pyodide import (
+    host_call_report,
+    pyodide_test_reports,
+    run_test_in_pyodide,
+    run_test_in_pyodide_session,
+)
 
 
-# fixture to copy the test file across
-@pytest.fixture(scope="function")
-def remote_test_file(selenium):
+def _copy_test_file(selenium):
     datafile_path = (Path(__file__).parent / "datafiles/in_pyodide_tests.py").resolve()
     datafile_path = datafile_path.relative_to(Path.cwd())
     dest_path = Path("test_files", datafile_path)
     copy_files_to_emscripten_fs(
         [(datafile_path, dest_path)], selenium, install_wheels=False
     )
-    yield dest_path
+    return dest_path
 
 
-def test_fail_test(remote_test_file, selenium):
-    success = run_test_in_pyodide(
-        f"{remote_test_file}::test_fail", selenium, ignore_fail=True
-    )
+# fixture to copy the test file across
+@pytest.fixture(scope="function")
+def remote_test_file(selenium):
+    yield _copy_test_file(selenium)
+
+
+@pytest.fixture(params=["main", "session"])
+def run_test(request):
+    if request.param == "session":
+        return run_test_in_pyodide_session
+    return run_test_in_pyodide
+
+
+def test_fail_test(remote_test_file, selenium, run_test):
+    success = run_test(f"{remote_test_file}::test_fail", selenium, ignore_fail=True)
     assert success is False
 
 
 @pytest.mark.xfail
-def test_xfail_test(remote_test_file, selenium):
-    run_test_in_pyodide(f"{remote_test_file}::test_fail", selenium, ignore_fail=False)
+def test_xfail_test(remote_test_file, selenium, run_test):
+    run_test(f"{remote_test_file}::test_fail", selenium, ignore_fail=False)
+
+
+def test_succeed_test(remote_test_file, selenium, run_test):
+    run_test(f"{remote_test_file}::test_success", selenium, ignore_fail=False)
+
+
+def test_running_in_pyodide(remote_test_file, selenium, run_test):
+    run_test(f"{remote_test_file}::test_check_in_pyodide", selenium, ignore_fail=False)
+
+
+def test_pyodide_tests_skipped_inside_pyodide(remote_test_file, selenium, run_test):
+    run_test(f"{remote_test_file}::test_this_doesnt_run", selenium, ignore_fail=False)
+
 
+def test_session_shares_module(remote_test_file, selenium):
+    # The module is collected once, so its globals survive between tests
+    for _ in range(2):
+        run_test_in_pyodide_session(
+            f"{remote_test_file}::test_count_runs", selenium, ignore_fail=False
+        )
+    runs = selenium.run("""
+        import sys
+        sys.modules["in_pyodide_tests"].RUNS
+        """)
+    assert runs == 2
 
-def test_succeed_test(remote_test_file, selenium):
-    run_test_in_pyodide(
-        f"{remote_test_file}::test_success", selenium, ignore_fail=False
+
+@pytest.mark.parametrize("session", [False, True])
+def test_pyodide_test_reports(remote_test_file, selenium, session):
+    reports = pyodide_test_reports(
+        f"{remote_test_file}::test_fail", selenium, session=session
     )
+    assert [(report.when, report.outcome) for report in reports] == [
+        ("setup", "passed"),
+        ("call", "failed"),
+        ("teardown", "passed"),
+    ]
+    assert "assert 1 == 0" in reports[1].longreprtext
+    assert ("Captured stdout call", "Oh dear\n") in reports[1].sections
 
 
-def test_running_in_pyodide(remote_test_file, selenium):
-    run_test_in_pyodide(
-        f"{remote_test_file}::test_check_in_pyodide", selenium, ignore_fail=False
+@pytest.mark.parametrize("session", [False, True])
+def test_pyodide_test_reports_clean_runner(selenium_standalone, session):
+    # pytest isn't loaded yet in a new pyodide
+    remote_test_file = _copy_test_file(selenium_standalone)
+    reports = pyodide_test_reports(
+        f"{remote_test_file}::test_success", selenium_standalone, session=session
     )
+    assert [(report.when, report.outcome) for report in reports] == [
+        ("setup", "passed"),
+        ("call", "passed"),
+        ("teardown", "passed"),
+    ]
 
 
-def test_pyodide_tests_skipped_inside_pyodide(remote_test_file, selenium):
-    run_test_in_pyodide(
-        f"{remote_test_file}::test_this_doesnt_run", selenium, ignore_fail=False
+def _report(when, outcome, longrepr=None, **extra):
+    return TestReport(
+        "remote::test", ("remote", 1, "test"), {}, outcome, longrepr, when, **extra
     )
+
+
+def test_host_call_report():
+    host = TestReport(
+        "host::test",
+        ("host", 1, "test"),
+        {"test": 1},
+        "passed",
+        None,
+        "call",
+        sections=[("Captured stdout call", "host\n")],
+        duration=1.5,
+    )
+
+    report = host_call_report(
+        host,
+        [
+            _report("setup", "passed"),
+            _report(
+                "call",
+                "failed",
+                "assert 0",
+                duration=0.25,
+                sections=[("Captured stdout call", "remote\n")],
+            ),
+            _report("teardown", "passed"),
+        ],
+    )
+    assert (report.nodeid, report.location, report.when) == (
+        "host::test",
+        ("host", 1, "test"),
+        "call",
+    )
+    assert (report.outcome, report.longreprtext, report.duration) == (
+        "failed",
+        "assert 0",
+        0.25,
+    )
+    assert [content for _, content in report.sections] == ["host\n", "remote\n"]
+
+    # A skipped setup decides the outcome
+    report = host_call_report(
+        host,
+        [
+            _report("setup", "skipped", ("remote", 1, "Skipped: no")),
+            _report("teardown", "passed"),
+        ],
+    )
+    assert report.skipped
+
+    report = host_call_report(
+        host,
+        [_report("setup", "passed"), _report("call", "skipped", "", wasxfail="reason")],
+    )
+    assert report.skipped and report.wasxfail == "reason"
+
+    # Setup errors are ignored like in run_test_in_pyodide
+    report = host_call_report(
+        host,
+        [
+            _report("setup", "failed", "fixture 'selenium' not found"),
+            _report("teardown", "passed"),
+        ],
+    )
+    assert report.passed and report.longrepr is None
+
+    # No reports, the test wasn't found
+    assert host_call_report(host, []).failed
+
+
+def test_check_pytest_version():
+    check_pytest_version(pytest.__version__)
+    check_pytest_version("8.3.0.dev1")
+    with pytest.raises(RuntimeError, match="pytest 6.2.5 is not supported"):
+        check_pytest_version("6.2.5")
+    with pytest.raises(RuntimeError, match="pytest >=7.0,<10.0 is needed"):
+        check_pytest_version("10.0.0")
@@ -9,6 +9,7 @@ so we know the worker runner behaves the same way end-to-end.
 import pytest
 
 from pytest_pyodide import run_in_pyodide
+from pytest_pyodide.fixture import selenium_common
 from pytest_pyodide.runner import (
     BrowserWorkerChromeRunner,
     BrowserWorkerFirefoxRunner,
@@ -33,6 +34,7 @@ def test_worker_runner_classes_inherit_mixin():
         # The mixin's overrides must win over the Selenium base.
         assert cls.run_js_inner is _BrowserWorkerRunnerMixin.run_js_inner
         assert cls.prepare_driver is _BrowserWorkerRunnerMixin.prepare_driver
+        assert cls.CALL_SCRIPT is _BrowserWorkerRunnerMixin.CALL_SCRIPT
 
 
 def test_worker_runner_browser_attributes():
@@ -127,6 +129,27 @@ def test_selenium_worker_logs(selenium_worker):
     assert "hello from worker" not in selenium_worker.logs
 
 
+def test_selenium_worker_prepare_after_reload(
+    request, runtime, web_server_main, playwright_browsers
+):
+    """After the page is reloaded, ``call`` starts the worker again and
+    prepares the functions in it instead of failing."""
+    if runtime == "node":
+        pytest.skip("selenium_worker has no support in node")
+    with selenium_common(
+        request,
+        runtime,
+        web_server_main,
+        load_pyodide=False,
+        browsers=playwright_browsers,
+        worker=True,
+    ) as selenium:
+        selenium.prepare("add", "return a + b;", ["a", "b"])
+        assert selenium.call("add", 1, 2) == 3
+        selenium.driver.refresh()
+        assert selenium.call("add", 3, 4) == 7
+
+
 @run_in_pyodide
 def test_selenium_worker_run_in_pyodide(selenium_worker):
     """``run_in_pyodide`` should work with the worker fixture just like it
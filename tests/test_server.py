@@ -1,9 +1,17 @@
+import functools
+import http.client
 import http.server
 from http import HTTPStatus
 
 import requests
 
-from pytest_pyodide.server import DefaultHandler, _default_templates, spawn_web_server
+from pytest_pyodide.server import (
+    SCRATCH_ROUTE,
+    DefaultHandler,
+    _default_templates,
+    get_scratch_dir,
+    spawn_web_server,
+)
 
 
 def test_spawn_web_server_with_params(tmp_path):
@@ -75,3 +83,94 @@ def test_custom_handler(tmp_path):
         res = requests.get(f"http://{hostname}:{port}/index.txt")
         assert res.ok
         assert res.content == b"hello world"
+
+
+def test_scratch_route(tmp_path):
+    with spawn_web_server(tmp_path) as (hostname, port, log_path):
+        url = f"http://{hostname}:{port}{SCRATCH_ROUTE}blob.bin"
+        data = b"\x00\x01" * 1000
+        assert requests.get(url).status_code == 404
+
+        res = requests.put(url, data=data)
+        assert res.status_code == 201
+        assert (get_scratch_dir(log_path) / "blob.bin").read_bytes() == data
+
+        res = requests.get(url)
+        assert res.ok
+        assert res.content == data
+
+        # Only the scratch directory is writable
+        res = requests.put(f"http://{hostname}:{port}/blob.bin", data=b"a")
+        assert res.status_code == 405
+        assert not (tmp_path / "blob.bin").exists()
+
+
+def test_range_requests(tmp_path):
+    (tmp_path / "data.bin").write_bytes(bytes(range(100)))
+    with spawn_web_server(tmp_path) as (hostname, port, _):
+        url = f"http://{hostname}:{port}/data.bin"
+        res = requests.get(url)
+        assert res.status_code == 200
+        assert res.headers["Accept-Ranges"] == "bytes"
+
+        res = requests.get(url, headers={"Range": "bytes=10-19"})
+        assert res.status_code == 206
+        assert res.headers["Content-Range"] == "bytes 10-19/100"
+        assert res.content == bytes(range(10, 20))
+
+        res = requests.get(url, headers={"Range": "bytes=-5"})
+        assert res.content == bytes(range(95, 100))
+        res = requests.get(url, headers={"Range": "bytes=90-200"})
+        assert res.content == bytes(range(90, 100))
+
+        res = requests.get(url, headers={"Range": "bytes=100-"})
+        assert res.status_code == 416
+        assert res.headers["Content-Range"] == "bytes */100"
+
+        # Multiple ranges are not supported, the whole file is sent
+        res = requests.get(url, headers={"Range": "bytes=0-1,5-6"})
+        assert res.status_code == 200
+        assert res.content == bytes(range(100))
+
+
+def test_keep_alive(tmp_path):
+    (tmp_path / "a.txt").write_text("a")
+    with spawn_web_server(tmp_path) as (hostname, port, _):
+        conn = http.client.HTTPConnection(hostname, port)
+        sockets = []
+        for _ in range(3):
+            conn.request("GET", "/a.txt")
+            res = conn.getresponse()
+            assert res.version == 11
+            assert res.read() == b"a"
+            sockets.append(conn.sock)
+        # All requests were sent over one connection
+        assert sockets[0] is not None
+        assert sockets == [sockets[0]] * 3
+
+        # The open connection doesn't block other clients
+        res = requests.get(f"http://{hostname}:{port}/a.txt", timeout=5)
+        assert res.content == b"a"
+        conn.close()
+
+    # Without threads, every connection is closed after one request, also with
+    # a custom handler or a partial of one
+    for handler_cls in [
+        None,
+        CustomTemplateHandler,
+        functools.partial(http.server.SimpleHTTPRequestHandler, directory=tmp_path),
+    ]:
+        with spawn_web_server(tmp_path, handler_cls=handler_cls, threaded=False) as (
+            hostname,
+            port,
+            _,
+        ):
+            conn = http.client.HTTPConnection(hostname, port)
+            conn.request("GET", "/a.txt")
+            res = conn.getresponse()
+            assert res.version == 10
+            assert res.read() == b"a"
+
+            res = requests.get(f"http://{hostname}:{port}/a.txt", timeout=5)
+            assert res.content == b"a"
+            conn.close()
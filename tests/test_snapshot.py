@@ -0,0 +1,65 @@
+import os
+import warnings
+
+import pytest
+
+from pytest_pyodide.fixture import selenium_common
+from pytest_pyodide.runner import NodeRunner, SeleniumChromeRunner
+from pytest_pyodide.server import get_scratch_dir
+from pytest_pyodide.snapshot import dist_fingerprint, snapshot_key
+
+
+def test_dist_fingerprint(tmp_path):
+    empty = dist_fingerprint(tmp_path)
+
+    wasm = tmp_path / "pyodide.asm.wasm"
+    wasm.write_bytes(b"\0asm")
+    fingerprint = dist_fingerprint(tmp_path)
+    assert fingerprint != empty
+    assert dist_fingerprint(tmp_path) == fingerprint
+
+    # Files that the snapshot doesn't depend on are ignored
+    (tmp_path / "some-package.whl").write_bytes(b"")
+    assert dist_fingerprint(tmp_path) == fingerprint
+
+    os.utime(wasm, ns=(0, 0))
+    assert dist_fingerprint(tmp_path) != fingerprint
+
+
+def test_snapshot_key(tmp_path):
+    key = snapshot_key(NodeRunner, tmp_path, [])
+    assert snapshot_key(NodeRunner, tmp_path, []) == key
+    assert snapshot_key(SeleniumChromeRunner, tmp_path, []) != key
+
+    key_with_packages = snapshot_key(NodeRunner, tmp_path, ["a", "b"])
+    assert key_with_packages != key
+    assert snapshot_key(NodeRunner, tmp_path, ["b", "a"]) == key_with_packages
+
+
+def test_boot_from_snapshot(
+    request, runtime, web_server_main, playwright_browsers, monkeypatch
+):
+    monkeypatch.setattr(request.config.option, "memory_snapshot", True)
+    monkeypatch.setattr(request.config.option, "memory_snapshot_packages", "micropip")
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        with selenium_common(
+            request, runtime, web_server_main, browsers=playwright_browsers
+        ) as selenium:
+            if selenium.snapshot is None:
+                pytest.skip(f"No memory snapshot: {[str(w.message) for w in caught]}")
+            name = selenium.snapshot.rpartition("/")[2]
+            assert (get_scratch_dir(web_server_main[2]) / name).exists()
+
+            # The decorator module and the preloaded package are in the
+            # snapshot. selenium.run doesn't load packages, so the import only
+            # works if micropip was loaded before the snapshot was taken.
+            assert selenium.run_js("return 'micropip' in pyodide.loadedPackages;")
+            assert selenium.run(
+                """
+                import sys
+                import micropip
+
+                "pytest_pyodide.decorator" in sys.modules
+                """
+            )